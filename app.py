@@ -4,17 +4,24 @@ from tabs.dataset import dataset_layout
 from tabs.stats import stats_layout
 from tabs.upload import upload_layout
 from tabs.download import download_layout
-from tabs.map import map_layout
+from tabs.map import map_layout, public_map, public_map_cache_control
 from tabs.joins import joins_layout
 import os
+import hmac
 import secrets
-from dotenv import load_dotenv
-from flask import Flask, redirect, session, jsonify, request
+import config
+from flask import Flask, Response, abort, redirect, render_template_string, session, jsonify, request
 from authlib.integrations.flask_client import OAuth
 from urllib.parse import parse_qs
-from cache_config import cache
+import result_cache
+import dataset_store
+import metrics
+import slow_log
+import mirror
+import site_index
+import counties
 
-load_dotenv(override=True)
+config.load()
 
 # Initialize OAuth
 server = Flask(__name__)
@@ -72,6 +79,120 @@ def unauthorized():
         f"client_id={os.getenv('AUTH0_CLIENT_ID')}"
     )
 
+def require_stats_access():
+    # Query, cache and dataset stats name callbacks, tables and sizes, so they
+    # are for admins, or a scraper sending METRICS_TOKEN
+    token = metrics.METRICS_TOKEN
+    sent = request.headers.get("Authorization", "").encode("utf-8")
+    if token and hmac.compare_digest(sent, f"Bearer {token}".encode("utf-8")):
+        return
+    if not slow_log.is_admin(session.get('user')):
+        abort(403)
+
+@server.route('/cache-stats')
+def cache_stats():
+    require_stats_access()
+    return jsonify(dict(result_cache.stats(), datasets=dataset_store.stats()))
+
+@server.route('/public/map.json')
+def public_map_json():
+    # No session needed: the same map is shown before and after logging in
+    try:
+        etag, body = public_map()
+    except Exception as e:
+        print(f"Error building the public map: {e}")
+        abort(503)
+    response = Response(body, mimetype="application/json")
+    response.set_etag(etag)
+    response.headers["Cache-Control"] = public_map_cache_control()
+    return response.make_conditional(request)
+
+@server.route('/public/counties.<fingerprint>.geojson')
+def county_geojson(fingerprint):
+    current, body, compressed = counties.geojson()
+    # The name changes with the contents, so a matching file never goes stale
+    if fingerprint != current:
+        abort(404)
+    if 'gzip' in request.accept_encodings:
+        response = Response(compressed, mimetype="application/geo+json", headers={"Content-Encoding": "gzip"})
+    else:
+        response = Response(body, mimetype="application/geo+json")
+    response.headers["Vary"] = "Accept-Encoding"
+    response.headers["Cache-Control"] = "public, max-age=31536000, immutable"
+    return response
+
+@server.route('/metrics')
+def query_metrics():
+    require_stats_access()
+    return Response(metrics.prometheus(), mimetype="text/plain; version=0.0.4")
+
+@server.route('/metrics.json')
+def query_metrics_json():
+    require_stats_access()
+    return jsonify(metrics.summary())
+
+SLOW_QUERIES_PAGE = '''
+<!DOCTYPE html>
+<html>
+    <head>
+        <title>Slow queries</title>
+        <link href="https://cdn.jsdelivr.net/npm/bootstrap@5.3.1/dist/css/bootstrap.min.css" rel="stylesheet">
+    </head>
+    <body class="p-4">
+        <h2>Slow queries</h2>
+        <p class="text-muted">SQL Server queries slower than {{ threshold }} s, grouped by query text, most total time first.</p>
+        {% for q in offenders %}
+        <div class="card mb-3">
+            <div class="card-header">
+                <b>{{ q.query_id }}</b> &middot; {{ q.count }} runs &middot;
+                total {{ "%.2f"|format(q.total_seconds) }} s &middot;
+                mean {{ "%.2f"|format(q.mean_seconds) }} s &middot;
+                max {{ "%.2f"|format(q.max_seconds) }} s &middot;
+                {{ q.callbacks|join(", ") }}
+                {% if q.plan %}&middot; <a href="slow-queries/{{ q.query_id }}/plan.sqlplan">plan</a>{% endif %}
+            </div>
+            <div class="card-body">
+                <pre>{{ q.sql }}</pre>
+                <p><small>Parameters of slowest run: {{ q.slowest_params }}</small></p>
+                {% if q.error %}<p class="text-danger">Error: {{ q.error }}</p>{% endif %}
+                {% if q.plan_error %}<p class="text-warning">No plan: {{ q.plan_error }}</p>{% endif %}
+                {% for index in q.findings.missing_indexes %}
+                <p>Missing index on {{ index.table }} (impact {{ index.impact }}%):
+                   equality {{ (index.equality or [])|join(", ") or "none" }}; inequality {{ (index.inequality or [])|join(", ") or "none" }}; include {{ (index.include or [])|join(", ") or "none" }}</p>
+                {% endfor %}
+                {% for convert in q.findings.converts %}
+                <p>Conversion affects {{ convert.issue }}: <code>{{ convert.expression }}</code></p>
+                {% endfor %}
+                {% if q.findings.try_cast_columns %}
+                <p>Wrapped in TRY_CAST: {{ q.findings.try_cast_columns|join(", ") }}</p>
+                {% endif %}
+            </div>
+        </div>
+        {% else %}
+        <p>No slow queries logged.</p>
+        {% endfor %}
+    </body>
+</html>
+'''
+
+@server.route('/admin/slow-queries')
+def slow_queries():
+    if not slow_log.is_admin(session.get('user')):
+        abort(403)
+    return render_template_string(SLOW_QUERIES_PAGE, offenders=slow_log.worst_offenders(),
+                                  threshold=slow_log.SLOW_QUERY_SECONDS)
+
+@server.route('/admin/slow-queries/<query_id>/plan.sqlplan')
+def slow_query_plan(query_id):
+    if not slow_log.is_admin(session.get('user')):
+        abort(403)
+    plan = slow_log.latest_plan(query_id)
+    if plan is None:
+        abort(404)
+    # .sqlplan files open directly in SQL Server Management Studio
+    return Response(plan, mimetype="application/xml",
+                    headers={"Content-Disposition": f"attachment; filename={query_id}.sqlplan"})
+
 css = ["https://cdn.jsdelivr.net/npm/bootstrap@5.3.1/dist/css/bootstrap.min.css"]
 app = Dash(name="Sork Lab Dashboard", server=server, external_stylesheets=css, suppress_callback_exceptions=True, requests_pathname_prefix='/app/')
 
@@ -115,12 +236,6 @@ app.index_string = '''
 </html>
 '''
 
-cache.init_app(server, config={
-    'CACHE_TYPE': 'filesystem',
-    'CACHE_DIR': '/tmp',
-    'CACHE_THRESHOLD': 100
-})
-
 def serve_layout():
 
     dcc.Location(id='url', refresh=False)
@@ -259,4 +374,9 @@ def display_error_message(search):
     return ""
 
 if __name__ == "__main__":
+    # Background work starts here, or in each gunicorn worker (gunicorn.conf.py),
+    # never at import where a preloading master would run it too
+    mirror.warm()
+    site_index.warm()
+    dataset_store.start_pruning()
     app.run(debug=True)
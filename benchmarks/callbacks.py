@@ -0,0 +1,283 @@
+"""Time the dashboard's callbacks against the offline backend.
+
+    python -m benchmarks.callbacks run --sizes 10000,100000 --out results.json
+    python -m benchmarks.callbacks compare baseline.json results.json --threshold 0.2
+
+run generates synthetic data for each size, seeds a local database and calls
+the callbacks from tabs/*.py directly, with application caches cleared before
+every call (cold) and after one untimed call (warm). compare exits non-zero
+when a callback's median time grew by more than the threshold.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import statistics
+import subprocess
+import tempfile
+
+DEFAULT_SIZES = "10000,100000"
+DEFAULT_REPEAT = 5
+# Differences smaller than this many seconds are noise, not regressions
+DEFAULT_MIN_SECONDS = 0.01
+
+# Text the tabs render when a callback caught an exception
+ERROR_MARKERS = ('"Error"', "Error generating", "Error executing", "An error occurred")
+
+
+def _cases(tabs, size):
+    # (callback name, function, args) for every benchmarked callback. Column
+    # names are those written by benchmarks.synthetic_data.
+    stats, joins, dataset, download, map_tab = tabs
+    core = "db_main"
+    core_columns = ["Accession", "Locality", "Year", "Site", "Block", "Height_cm", "Diameter_mm", "Survival"]
+    locality = _first_locality(map_tab.map_table)
+    return [
+        ("generate_linear_regression", stats.generate_linear_regression,
+         (1, core, "Diameter_mm", "Height_cm", None, False)),
+        ("generate_pca", stats.generate_pca,
+         (1, core, ["Height_cm", "Diameter_mm", "Block"], "2d", None, False)),
+        ("generate_summary_statistics", stats.generate_summary_statistics,
+         (1, core, "Height_cm", None, False)),
+        ("joins.execute_join", joins.execute_join,
+         (1, core, ["Height_cm", "Diameter_mm"], ["tmax_sum", "ppt_mm"], ["tmax", "ppt"])),
+        ("dataset.execute_join", dataset.execute_join,
+         (1, core, "inner", map_tab.map_table, "Accession", "Accession",
+          ["Height_cm", "Site"], ["locality_full_name"], 1000)),
+        ("public_map", map_tab.public_map, ()),
+        ("display_click_data", map_tab.display_click_data, ({"points": [{"text": locality}]},)),
+        ("update_preview", download.update_preview, (1, core, 1, 100, core_columns)),
+        ("download_csv", download.download_csv, (1, core, 1, min(size, 100000), core_columns)),
+    ]
+
+
+def _first_locality(map_table):
+    from database import fetch_uncached
+    from query import table_ref
+
+    df = fetch_uncached(f"SELECT TOP (1) [locality_full_name] FROM {table_ref(map_table)}", credentials="pub")
+    return df.iloc[0, 0]
+
+
+def _failed(result):
+    from plotly.utils import PlotlyJSONEncoder
+
+    text = json.dumps(result, cls=PlotlyJSONEncoder)
+    return any(marker in text for marker in ERROR_MARKERS)
+
+
+def measure(size, repeat, out, only=None):
+    """Time every callback in this process and write the results to out.
+
+    Runs in a child process started by run(), whose environment selects the
+    offline backend and data size.
+    """
+    import app
+    import catalog
+    import metrics
+    import result_cache
+    import row_counts
+    import site_index
+    from dash._callback_context import context_value
+    from dash._utils import AttributeDict
+    from tabs import stats, joins, dataset, download
+    from tabs import map as map_tab
+
+    def clear_caches():
+        result_cache.clear()
+        catalog.invalidate()
+        row_counts.invalidate()
+        site_index.invalidate()
+
+    def call(name, function, args):
+        # Inside a request, so queries are attributed to the callback in metrics
+        with app.server.test_request_context("/app/_dash-update-component", method="POST", json={"output": name}):
+            context_value.set(AttributeDict(triggered_inputs=[], outputs_list=[], inputs_list=[], states_list=[]))
+            started = time.perf_counter()
+            result = function(*args)
+            return time.perf_counter() - started, result
+
+    results = []
+    for name, function, args in _cases((stats, joins, dataset, download, map_tab), size):
+        if only and name not in only:
+            continue
+        for cache_state in ("cold", "warm"):
+            clear_caches()
+            if cache_state == "warm":
+                call(name, function, args)
+            metrics.reset()
+
+            runs, failed = [], False
+            for _ in range(repeat):
+                if cache_state == "cold":
+                    clear_caches()
+                seconds, result = call(name, function, args)
+                runs.append(seconds)
+                failed = failed or _failed(result)
+
+            queries = metrics.summary().get(name, {})
+            results.append({
+                "callback": name,
+                "size": size,
+                "cache": cache_state,
+                "runs": runs,
+                "median": statistics.median(runs),
+                "min": min(runs),
+                "max": max(runs),
+                "queries_per_call": queries.get("queries", 0) / repeat,
+                "db_seconds_per_call": queries.get("seconds", 0.0) / repeat,
+                "failed": failed,
+            })
+            print(f"{size:>9}  {cache_state}  {name:<28} {results[-1]['median']:.4f}s"
+                  + ("  FAILED" if failed else ""), file=sys.stderr)
+
+    with open(out, "w") as f:
+        json.dump(results, f)
+
+
+def _git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(sizes, repeat, backend, out, work_dir, only=None, seed=0):
+    """Benchmark every size in a fresh child process and write one JSON report."""
+    import offline
+    from benchmarks import synthetic_data
+    from tabs.joins import CORE_TABLES
+
+    os.makedirs(work_dir, exist_ok=True)
+    results = []
+    for size in sizes:
+        fixture_dir = os.path.join(work_dir, f"rows-{size}-seed-{seed}")
+        db_path = os.path.join(work_dir, f"rows-{size}-seed-{seed}.{backend}")
+        if not os.path.exists(db_path):
+            synthetic_data.generate(size, fixture_dir, seed)
+            offline.seed(backend, fixture_dir, db_path)
+
+        env = dict(
+            os.environ,
+            DB_BACKEND=backend,
+            DB_FIXTURE_DIR=fixture_dir,
+            DB_OFFLINE_PATH=db_path,
+            DB_FIXTURE_RESEED="false",
+            TABLE_OPTIONS=",".join(CORE_TABLES),
+            MAIN_TABLE="db_main",
+            MAP_TABLE=synthetic_data.MAP_TABLE,
+            DATA_VERSION_DIR=os.path.join(work_dir, "data-versions"),
+            MIRROR_ENABLED="false",
+            QUERY_LOG="",
+            SLOW_QUERY_SECONDS="0",
+        )
+        with tempfile.NamedTemporaryFile(suffix=".json", delete=False) as f:
+            partial = f.name
+        try:
+            command = [sys.executable, "-m", "benchmarks.callbacks", "measure",
+                       "--size", str(size), "--repeat", str(repeat), "--out", partial]
+            if only:
+                command += ["--callbacks", ",".join(only)]
+            subprocess.run(command, env=env, check=True)
+            with open(partial) as f:
+                results.extend(json.load(f))
+        finally:
+            os.remove(partial)
+
+    report = {
+        "meta": {
+            "created_at": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "commit": _git_commit(),
+            "backend": backend,
+            "repeat": repeat,
+            "seed": seed,
+            "python": platform.python_version(),
+            "machine": platform.platform(),
+        },
+        "results": results,
+    }
+    with open(out, "w") as f:
+        json.dump(report, f, indent=2)
+    return report
+
+
+def compare(baseline, current, threshold, min_seconds):
+    """Print a comparison table and return the regressed cases."""
+    def keyed(report):
+        return {(r["callback"], r["size"], r["cache"]): r for r in report["results"]}
+
+    before, after = keyed(baseline), keyed(current)
+    regressions = []
+    print(f"{'callback':<28} {'size':>9} {'cache':<5} {'baseline':>9} {'current':>9} {'change':>8}")
+    for key in sorted(after):
+        new = after[key]
+        old = before.get(key)
+        if old is None:
+            print(f"{key[0]:<28} {key[1]:>9} {key[2]:<5} {'-':>9} {new['median']:>9.4f}      new")
+            continue
+        change = new["median"] / old["median"] - 1 if old["median"] else 0.0
+        regressed = new["failed"] or (change > threshold and new["median"] - old["median"] > min_seconds)
+        flag = "  REGRESSION" if regressed else ""
+        if new["failed"]:
+            flag = "  FAILED"
+        print(f"{key[0]:<28} {key[1]:>9} {key[2]:<5} {old['median']:>9.4f} {new['median']:>9.4f} {change:>+8.1%}{flag}")
+        if regressed:
+            regressions.append(key)
+    for key in sorted(set(before) - set(after)):
+        print(f"{key[0]:<28} {key[1]:>9} {key[2]:<5} missing from the current results")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = commands.add_parser("run", help="benchmark the callbacks and write a JSON report")
+    run_parser.add_argument("--sizes", default=DEFAULT_SIZES, help="comma separated core table sizes")
+    run_parser.add_argument("--repeat", type=int, default=DEFAULT_REPEAT)
+    run_parser.add_argument("--backend", choices=["sqlite", "duckdb"], default="duckdb")
+    run_parser.add_argument("--callbacks", help="comma separated callback names to run (default all)")
+    run_parser.add_argument("--seed", type=int, default=0)
+    run_parser.add_argument("--work-dir", default=os.path.join(tempfile.gettempdir(), "sork-benchmarks"),
+                            help="where generated data and databases are kept between runs")
+    run_parser.add_argument("--out", default="benchmark_results.json")
+
+    measure_parser = commands.add_parser("measure", help=argparse.SUPPRESS)
+    measure_parser.add_argument("--size", type=int, required=True)
+    measure_parser.add_argument("--repeat", type=int, required=True)
+    measure_parser.add_argument("--callbacks")
+    measure_parser.add_argument("--out", required=True)
+
+    compare_parser = commands.add_parser("compare", help="fail if results regressed against a baseline")
+    compare_parser.add_argument("baseline")
+    compare_parser.add_argument("current")
+    compare_parser.add_argument("--threshold", type=float, default=0.2,
+                                help="allowed relative slowdown of the median (default 0.2 = 20%%)")
+    compare_parser.add_argument("--min-seconds", type=float, default=DEFAULT_MIN_SECONDS,
+                                help="ignore slowdowns smaller than this many seconds")
+
+    args = parser.parse_args()
+    only = args.callbacks.split(",") if getattr(args, "callbacks", None) else None
+
+    if args.command == "measure":
+        measure(args.size, args.repeat, args.out, only)
+    elif args.command == "run":
+        sizes = [int(s) for s in args.sizes.split(",")]
+        run(sizes, args.repeat, args.backend, args.out, args.work_dir, only, args.seed)
+        print(f"Wrote {args.out}")
+    else:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        with open(args.current) as f:
+            current = json.load(f)
+        regressions = compare(baseline, current, args.threshold, args.min_seconds)
+        if regressions:
+            print(f"{len(regressions)} regression(s) beyond {args.threshold:.0%}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,287 @@
+"""Replay scripted dashboard sessions from many simulated users at once.
+
+Start the app against the offline backend first, e.g.
+
+    DB_BACKEND=duckdb python app.py
+    python -m benchmarks.load_test --url http://127.0.0.1:8050/ --users 30 --duration 120
+
+Each user opens the map, clicks a site, picks a table in the dataset tab,
+runs a join, runs a PCA and downloads rows, posting to _dash-update-component
+exactly as the browser would. The map itself comes from public/map.json,
+fetched with If-None-Match once a user has seen it, like a browser's cache. Callback payloads are built from the server's
+_dash-dependencies, so they follow the app's real callback graph.
+"""
+import sys
+import json
+import time
+import random
+import argparse
+import threading
+from urllib.parse import urljoin
+import requests
+from benchmarks.callbacks import ERROR_MARKERS
+
+# Values chosen by the simulated users. The defaults match benchmarks.synthetic_data.
+SCENARIO = {
+    "table": "db_main",
+    "join_core_table": "db_main",
+    "join_core_columns": ["Height_cm", "Diameter_mm"],
+    "join_tree_columns": ["tmax_sum", "ppt_mm"],
+    "join_garden_columns": ["tmax", "ppt"],
+    "pca_columns": ["Height_cm", "Diameter_mm", "Block"],
+    "download_columns": ["Accession", "Locality", "Year", "Site", "Height_cm"],
+    "download_rows": 1000,
+}
+
+QUANTILES = (0.5, 0.95, 0.99)
+# Callbacks fired per user action, including those triggered by other callbacks
+MAX_CHAIN = 50
+
+
+def session_steps(scenario):
+    """(step name, {component property: new value}) in the order a user clicks."""
+    return [
+        ("open map", {"reset-map.n_clicks": None}),
+        ("click site", {"california-map.clickData": "<site>"}),
+        ("pick table", {"dataset_dropdown.value": scenario["table"]}),
+        ("run join", {
+            "join-tab-core-dropdown.value": scenario["join_core_table"],
+            "join-core-table-options.value": scenario["join_core_columns"],
+            "join-tree-table-options.value": scenario["join_tree_columns"],
+            "join-garden-table-options.value": scenario["join_garden_columns"],
+            "join-tab-execute-button.n_clicks": 1,
+        }),
+        ("run pca", {
+            "stats-table-dropdown.value": scenario["table"],
+            "pca-variables.value": scenario["pca_columns"],
+            "pca-dimensions.value": "2d",
+            "run-pca-button.n_clicks": 1,
+        }),
+        ("download", {
+            "download_table_dropdown.value": scenario["table"],
+            "download-start-row.value": 1,
+            "download-end-row.value": scenario["download_rows"],
+            "download-columns.value": scenario["download_columns"],
+            "download-button.n_clicks": 1,
+        }),
+    ]
+
+
+def _outputs(output):
+    # "..a.b...c.d.." for several outputs, "a.b" for one
+    def split(spec):
+        component, prop = spec.rsplit(".", 1)
+        return {"id": component, "property": prop}
+
+    if output.startswith(".."):
+        return [split(spec) for spec in output[2:-2].split("...")]
+    return split(output)
+
+
+def _key(item):
+    return f"{item['id']}.{item['property']}"
+
+
+class Stats:
+    """Latency samples and error counts per callback, shared by every user."""
+
+    def __init__(self):
+        self.samples = {}
+        self.errors = {}
+        self.sessions = 0
+        self.lock = threading.Lock()
+
+    def add(self, name, seconds, error):
+        with self.lock:
+            self.samples.setdefault(name, []).append(seconds)
+            if error:
+                self.errors[name] = self.errors.get(name, 0) + 1
+
+    def report(self, elapsed):
+        with self.lock:
+            per_callback = {}
+            for name, samples in sorted(self.samples.items()):
+                ordered = sorted(samples)
+                entry = {"requests": len(ordered), "errors": self.errors.get(name, 0),
+                         "max": ordered[-1]}
+                for q in QUANTILES:
+                    entry[f"p{int(q * 100)}"] = ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+                per_callback[name] = entry
+            total = sum(len(s) for s in self.samples.values())
+            errors = sum(self.errors.values())
+            return {
+                "seconds": elapsed,
+                "sessions": self.sessions,
+                "requests": total,
+                "errors": errors,
+                "error_rate": errors / total if total else 0.0,
+                "requests_per_second": total / elapsed if elapsed else 0.0,
+                "sessions_per_second": self.sessions / elapsed if elapsed else 0.0,
+                "callbacks": per_callback,
+            }
+
+
+class User(threading.Thread):
+    """One simulated browser running sessions until the deadline."""
+
+    def __init__(self, base_url, dependencies, steps, stats, deadline, think, cookie=None):
+        super().__init__(daemon=True)
+        self.base_url = base_url
+        self.dependencies = dependencies
+        self.steps = steps
+        self.stats = stats
+        self.deadline = deadline
+        self.think = think
+        self.http = requests.Session()
+        if cookie:
+            self.http.headers["Cookie"] = cookie
+        self.map_etag = None
+        self.map_sites = None
+
+    def run(self):
+        while time.monotonic() < self.deadline:
+            self.run_session()
+            with self.stats.lock:
+                self.stats.sessions += 1
+
+    def run_session(self):
+        values = {}
+        site = None
+        for step, changes in self.steps:
+            if time.monotonic() >= self.deadline:
+                return
+            if step == "open map":
+                site = self.fetch_map()
+            # One property at a time, letting each change settle as it would in the page
+            for prop, value in changes.items():
+                values[prop] = site if value == "<site>" else value
+                pending, fired = [prop], 0
+                while pending and fired < MAX_CHAIN:
+                    changed = pending.pop(0)
+                    for dependency in self.dependencies:
+                        if changed not in (_key(i) for i in dependency["inputs"]):
+                            continue
+                        response = self.fire(dependency, values, changed)
+                        fired += 1
+                        # Outputs land in the page and trigger the callbacks that read them
+                        for component, props in ((response or {}).get("response") or {}).items():
+                            for name, output in props.items():
+                                values[f"{component}.{name}"] = output
+                                pending.append(f"{component}.{name}")
+            if self.think:
+                time.sleep(random.uniform(0.5, 1.5) * self.think)
+
+    def fetch_map(self):
+        # What the map's clientside callback does; returns a click on one of its sites
+        headers = {"If-None-Match": self.map_etag} if self.map_etag else {}
+        started = time.perf_counter()
+        try:
+            response = self.http.get(urljoin(self.base_url, "public/map.json"), headers=headers, timeout=300)
+            error = response.status_code not in (200, 304)
+        except requests.RequestException:
+            response, error = None, True
+        self.stats.add("public/map.json", time.perf_counter() - started, error)
+
+        if response is None or error:
+            return None
+        if response.status_code == 200:
+            self.map_etag = response.headers.get("ETag")
+            self.map_sites = [s["locality_full_name"] for s in response.json()["sites"]]
+        return {"points": [{"text": random.choice(self.map_sites)}]} if self.map_sites else None
+
+    def fire(self, dependency, values, changed):
+        outputs = _outputs(dependency["output"])
+        body = {
+            "output": dependency["output"],
+            "outputs": outputs,
+            "inputs": [dict(i, value=values.get(_key(i))) for i in dependency["inputs"]],
+            "state": [dict(s, value=values.get(_key(s))) for s in dependency["state"]],
+            "changedPropIds": [changed] if values.get(changed) is not None else [],
+        }
+        first = outputs[0] if isinstance(outputs, list) else outputs
+        name = first["id"] + "." + first["property"].split("@")[0]
+
+        started = time.perf_counter()
+        try:
+            response = self.http.post(urljoin(self.base_url, "_dash-update-component"), json=body, timeout=300)
+            text = response.text
+            error = response.status_code >= 400 or any(marker in text for marker in ERROR_MARKERS)
+        except requests.RequestException:
+            response, error = None, True
+        self.stats.add(name, time.perf_counter() - started, error)
+
+        if response is None or response.status_code != 200:
+            return None
+        try:
+            return response.json()
+        except ValueError:
+            return None
+
+
+def run(base_url, users, duration, ramp_up, think, scenario, cookie=None):
+    """Run the load test and return the report."""
+    http = requests.Session()
+    if cookie:
+        http.headers["Cookie"] = cookie
+    dependencies = http.get(urljoin(base_url, "_dash-dependencies"), timeout=60).json()
+    dependencies = [d for d in dependencies if not d.get("clientside_function")]
+
+    stats = Stats()
+    started = time.monotonic()
+    deadline = started + duration
+    threads = []
+    for i in range(users):
+        user = User(base_url, dependencies, session_steps(scenario), stats, deadline, think, cookie)
+        user.start()
+        threads.append(user)
+        if ramp_up and i < users - 1:
+            time.sleep(ramp_up / users)
+    for user in threads:
+        user.join()
+    report = stats.report(time.monotonic() - started)
+    report["meta"] = {"url": base_url, "users": users, "duration": duration,
+                      "ramp_up": ramp_up, "think": think, "scenario": scenario}
+    return report
+
+
+def print_report(report):
+    print(f"{report['sessions']} sessions, {report['requests']} requests in {report['seconds']:.1f}s: "
+          f"{report['requests_per_second']:.1f} req/s, error rate {report['error_rate']:.1%}")
+    print(f"{'callback':<32} {'requests':>8} {'errors':>7} {'p50':>8} {'p95':>8} {'p99':>8} {'max':>8}")
+    for name, entry in report["callbacks"].items():
+        print(f"{name:<32} {entry['requests']:>8} {entry['errors']:>7} {entry['p50']:>8.3f} "
+              f"{entry['p95']:>8.3f} {entry['p99']:>8.3f} {entry['max']:>8.3f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--url", default="http://127.0.0.1:8050/",
+                        help="Dash URL prefix, e.g. https://host/app/ behind the proxy")
+    parser.add_argument("--users", type=int, default=10, help="concurrent simulated users")
+    parser.add_argument("--duration", type=float, default=60, help="seconds to keep starting sessions")
+    parser.add_argument("--ramp-up", type=float, default=5, help="seconds over which users start")
+    parser.add_argument("--think", type=float, default=1.0, help="mean pause between steps in seconds")
+    parser.add_argument("--scenario", help="JSON file overriding the tables and columns users pick")
+    parser.add_argument("--cookie", help="Cookie header to send, e.g. a logged-in session")
+    parser.add_argument("--out", help="also write the report to this JSON file")
+    parser.add_argument("--max-error-rate", type=float, default=0.01,
+                        help="exit non-zero when the error rate is above this")
+    args = parser.parse_args()
+
+    scenario = dict(SCENARIO)
+    if args.scenario:
+        with open(args.scenario) as f:
+            scenario.update(json.load(f))
+
+    base_url = args.url if args.url.endswith("/") else args.url + "/"
+    report = run(base_url, args.users, args.duration, args.ramp_up, args.think, scenario, args.cookie)
+    print_report(report)
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(report, f, indent=2)
+    if report["error_rate"] > args.max_error_rate:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
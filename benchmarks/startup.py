@@ -0,0 +1,189 @@
+"""Time how long a fresh process takes to import the app and serve its layout.
+
+    python -m benchmarks.startup --repeat 5 --out startup.json --max-seconds 2
+
+Each run is a new interpreter, as a gunicorn worker or a restart would be.
+The report lists the slowest imports, any heavy library that was loaded
+before first use, any query run and any thread started at import time; any of
+the last three, or a median above --max-seconds, makes the command exit
+non-zero.
+"""
+import os
+import sys
+import json
+import time
+import threading
+import argparse
+import platform
+import statistics
+import shutil
+import subprocess
+import tempfile
+
+DEFAULT_REPEAT = 5
+# Libraries that should only load when a callback first needs them
+LAZY_MODULES = ("scipy", "sklearn", "plotly.express", "duckdb", "pyarrow")
+TOP_IMPORTS = 15
+
+
+def _loaded_by_pandas():
+    # pandas imports some of LAZY_MODULES itself when they are installed
+    # (pyarrow, for one), and the app cannot avoid importing pandas
+    child = subprocess.run(
+        [sys.executable, "-c", "import sys, json, pandas; "
+         f"print(json.dumps([m for m in {LAZY_MODULES!r} if m in sys.modules]))"],
+        capture_output=True, text=True, check=True)
+    return json.loads(child.stdout)
+
+
+def measure(out):
+    """Import the app in this process and write the timings to out."""
+    started = time.perf_counter()
+    import app
+    imported = time.perf_counter() - started
+    # Background work belongs in the gunicorn workers, not in a preloading master
+    threads = sorted(t.name for t in threading.enumerate() if t is not threading.main_thread())
+
+    import metrics
+
+    # The first request builds the layout, which a worker does before its first page
+    started = time.perf_counter()
+    response = app.server.test_client().get("/_dash-layout")
+    first_request = time.perf_counter() - started
+
+    result = {
+        "import_seconds": imported,
+        "first_request_seconds": first_request,
+        "first_request_status": response.status_code,
+        "queries_at_import": sum(c["queries"] for c in metrics.summary().values()),
+        "threads_at_import": threads,
+        "lazy_modules_loaded": [m for m in LAZY_MODULES if m in sys.modules],
+    }
+    with open(out, "w") as f:
+        json.dump(result, f)
+
+
+def _import_times(stderr):
+    # -X importtime lines: "import time: self [us] | cumulative | imported package"
+    times = {}
+    for line in stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        parts = line[len("import time:"):].split("|")
+        if len(parts) != 3 or not parts[1].strip().isdigit():
+            continue
+        name = parts[2].strip()
+        if name.split(".")[0] not in ("benchmarks", "dotenv"):
+            times[name] = int(parts[1]) / 1e6
+    return times
+
+
+def run(repeat, out=None):
+    """Start the app in repeat fresh processes and return the report."""
+    work_dir = tempfile.mkdtemp(prefix="sork-startup-")
+    # Settings the tabs read at import. The database file does not exist and
+    # there are no fixtures, so any query at import time fails loudly. The
+    # mirror is on so that a sync started at import shows up as a thread.
+    env = dict(
+        os.environ,
+        DB_BACKEND="duckdb",
+        DB_FIXTURE_DIR=os.path.join(work_dir, "fixtures"),
+        DB_OFFLINE_PATH=os.path.join(work_dir, "missing.duckdb"),
+        TABLE_OPTIONS=os.getenv("TABLE_OPTIONS") or "db_main",
+        MAIN_TABLE=os.getenv("MAIN_TABLE") or "db_main",
+        MAP_TABLE=os.getenv("MAP_TABLE") or "maternal_tree_sites",
+        DATA_VERSION_DIR=os.path.join(work_dir, "data-versions"),
+        MIRROR_ENABLED="true",
+        MIRROR_DIR=os.path.join(work_dir, "mirror"),
+        QUERY_LOG="",
+    )
+
+    runs, import_times = [], {}
+    try:
+        for _ in range(repeat):
+            partial = os.path.join(work_dir, "run.json")
+            started = time.perf_counter()
+            child = subprocess.run(
+                [sys.executable, "-X", "importtime", "-m", "benchmarks.startup", "measure", "--out", partial],
+                env=env, capture_output=True, text=True)
+            process_seconds = time.perf_counter() - started
+            if child.returncode != 0:
+                print(child.stderr[-3000:], file=sys.stderr)
+                raise RuntimeError("The app failed to start; see the error above")
+            with open(partial) as f:
+                result = json.load(f)
+            result["process_seconds"] = process_seconds
+            runs.append(result)
+            for name, seconds in _import_times(child.stderr).items():
+                import_times.setdefault(name, []).append(seconds)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    loaded_by_pandas = _loaded_by_pandas()
+    slowest = sorted(((statistics.median(v), k) for k, v in import_times.items()), reverse=True)
+    report = {
+        "meta": {
+            "created_at": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "repeat": repeat,
+            "python": platform.python_version(),
+            "machine": platform.platform(),
+        },
+        "import_seconds": statistics.median(r["import_seconds"] for r in runs),
+        "first_request_seconds": statistics.median(r["first_request_seconds"] for r in runs),
+        "process_seconds": statistics.median(r["process_seconds"] for r in runs),
+        "queries_at_import": max(r["queries_at_import"] for r in runs),
+        "threads_at_import": runs[-1]["threads_at_import"],
+        "lazy_modules_loaded": [m for m in runs[-1]["lazy_modules_loaded"] if m not in loaded_by_pandas],
+        "lazy_modules_loaded_by_pandas": loaded_by_pandas,
+        "slowest_imports": [{"module": k, "seconds": s} for s, k in slowest[:TOP_IMPORTS]],
+        "runs": runs,
+    }
+    if out:
+        with open(out, "w") as f:
+            json.dump(report, f, indent=2)
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("command", nargs="?", default="run", choices=["run", "measure"],
+                        help=argparse.SUPPRESS)
+    parser.add_argument("--repeat", type=int, default=DEFAULT_REPEAT)
+    parser.add_argument("--out", help="write the JSON report to this file")
+    parser.add_argument("--max-seconds", type=float,
+                        help="exit non-zero when the median import takes longer than this")
+    args = parser.parse_args()
+
+    if args.command == "measure":
+        measure(args.out)
+        return
+
+    report = run(args.repeat, args.out)
+    print(f"import app: {report['import_seconds']:.3f}s, first request: {report['first_request_seconds']:.3f}s, "
+          f"whole process: {report['process_seconds']:.3f}s (median of {args.repeat})")
+    print("slowest imports (cumulative):")
+    for entry in report["slowest_imports"]:
+        print(f"  {entry['seconds']:>8.3f}s  {entry['module']}")
+
+    if report["lazy_modules_loaded_by_pandas"]:
+        print(f"not checked, pandas imports them itself: {', '.join(report['lazy_modules_loaded_by_pandas'])}")
+
+    failed = False
+    if report["queries_at_import"]:
+        print(f"FAILED: {report['queries_at_import']} queries ran at import time")
+        failed = True
+    if report["threads_at_import"]:
+        print(f"FAILED: threads started at import time: {', '.join(report['threads_at_import'])}")
+        failed = True
+    if report["lazy_modules_loaded"]:
+        print(f"FAILED: loaded at import time: {', '.join(report['lazy_modules_loaded'])}")
+        failed = True
+    if args.max_seconds is not None and report["import_seconds"] > args.max_seconds:
+        print(f"FAILED: import took longer than {args.max_seconds}s")
+        failed = True
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,243 @@
+"""Generate synthetic lab tables for scale testing.
+
+Writes one CSV (or Parquet) file per table into a fixture directory that the
+sqlite and duckdb backends seed from, and optionally seeds that backend and
+writes a CSV of extra rows for the upload tab.
+
+    python -m benchmarks.synthetic_data --rows 1000000 --backend duckdb
+"""
+import os
+import argparse
+import numpy as np
+import pandas as pd
+import offline
+from tabs.joins import CORE_TABLES, MATERNAL_TREE_TABLE, GARDENS_TABLE
+
+MAP_TABLE = os.getenv("MAP_TABLE") or "maternal_tree_sites"
+
+SITES = ["Chico", "Placerville", "Davis", "Auburn", "Hopland"]
+YEARS = list(range(2015, 2024))
+BUDBURST_STAGES = [0, 1, 2, 3, 4, 5]
+
+# Rows generated and written at a time, so 10M-row tables fit in memory
+CHUNK_ROWS = 1_000_000
+
+# Valley oak range inside California, roughly
+LATITUDE_RANGE = (34.0, 40.5)
+LONGITUDE_RANGE = (-123.0, -118.5)
+
+
+def _localities(rng, count):
+    latitude = rng.uniform(*LATITUDE_RANGE, count)
+    longitude = rng.uniform(*LONGITUDE_RANGE, count)
+    return pd.DataFrame({
+        "Locality": [f"L{i:03d}" for i in range(count)],
+        "locality_full_name": [f"Locality {i:03d}" for i in range(count)],
+        "Latitude": latitude,
+        "Longitude": longitude,
+        # Warmer and drier to the south
+        "climate": (LATITUDE_RANGE[1] - latitude) / (LATITUDE_RANGE[1] - LATITUDE_RANGE[0]),
+    })
+
+
+def _tree_count(rows):
+    # About 20 seedlings per maternal tree, as in the gardens
+    return int(np.clip(rows // 20, 50, 500_000))
+
+
+def _trees(rng, localities, count):
+    home = rng.integers(0, len(localities), count)
+    place = localities.iloc[home].reset_index(drop=True)
+    return pd.DataFrame({
+        "Accession": np.arange(1, count + 1),
+        "Locality": place["Locality"],
+        "locality_full_name": place["locality_full_name"],
+        # Trees scatter a few kilometres around their locality
+        "Latitude": place["Latitude"] + rng.normal(0, 0.02, count),
+        "Longitude": place["Longitude"] + rng.normal(0, 0.02, count),
+        "Elevation_m": rng.gamma(2.0, 150.0, count).round(1),
+        "climate": place["climate"],
+    })
+
+
+def maternal_tree_table(rng, trees):
+    """Climate at each maternal tree. Accession is stored as text, as in the lab's table."""
+    n = len(trees)
+    climate = trees["climate"].to_numpy()
+    return pd.DataFrame({
+        "Accession": trees["Accession"].astype(float).astype(str),
+        "Locality": trees["Locality"],
+        "Latitude": trees["Latitude"].round(5),
+        "Longitude": trees["Longitude"].round(5),
+        "Elevation_m": trees["Elevation_m"],
+        "tmax_sum": (29 + 6 * climate + rng.normal(0, 0.8, n)).round(2),
+        "tmin_winter": (1 + 4 * climate + rng.normal(0, 0.8, n)).round(2),
+        "ppt_mm": (900 - 600 * climate + rng.normal(0, 60, n)).clip(100).round(1),
+        "cwd_mm": (700 + 500 * climate + rng.normal(0, 50, n)).round(1),
+        "aet_mm": (450 - 150 * climate + rng.normal(0, 30, n)).round(1),
+    })
+
+
+def map_table(trees):
+    """One row per maternal tree with the location columns tabs/map.py reads."""
+    return trees[["Accession", "Locality", "locality_full_name", "Latitude", "Longitude", "Elevation_m"]].round(5)
+
+
+def garden_climate_table(rng):
+    """Monthly PRISM-style climate per garden site and year. Year is stored as text."""
+    rows = [(site, year, month) for site in SITES for year in YEARS for month in range(1, 13)]
+    df = pd.DataFrame(rows, columns=["Site", "Year", "Month"])
+    season = np.cos((df["Month"] - 7) / 12 * 2 * np.pi)
+    n = len(df)
+    df["tmax"] = (22 + 11 * season + rng.normal(0, 1.5, n)).round(2)
+    df["tmin"] = (7 + 7 * season + rng.normal(0, 1.5, n)).round(2)
+    df["ppt"] = (np.clip(90 - 85 * season + rng.normal(0, 20, n), 0, None)).round(1)
+    df["Year"] = df["Year"].astype(str)
+    return df[["Year", "Site", "Month", "tmax", "tmin", "ppt"]]
+
+
+def _planting(rng, trees, n, with_year=True):
+    pick = rng.integers(0, len(trees), n)
+    columns = {
+        "Accession": trees["Accession"].to_numpy()[pick],
+        "Locality": trees["Locality"].to_numpy()[pick],
+    }
+    if with_year:
+        columns["Year"] = rng.choice(YEARS, n)
+    columns["Site"] = rng.choice(SITES, n)
+    df = pd.DataFrame(columns)
+    return df, trees["climate"].to_numpy()[pick]
+
+
+def core_chunk(rng, table, trees, n):
+    """n rows of one of the core tables in CORE_TABLES."""
+    if table == "leaf_traits_2016":
+        df, climate = _planting(rng, trees, n, with_year=False)
+        df["SLA"] = (110 - 20 * climate + rng.normal(0, 12, n)).round(2)
+        df["LDMC"] = (0.42 + 0.05 * climate + rng.normal(0, 0.03, n)).round(4)
+        df["Leaf_area_cm2"] = rng.lognormal(3.0, 0.35, n).round(2)
+        df["Leaf_N"] = (2.1 + rng.normal(0, 0.25, n)).round(3)
+        return df
+
+    df, climate = _planting(rng, trees, n)
+    if table == "db_main":
+        df["Block"] = rng.integers(1, 11, n)
+        df["Height_cm"] = (60 + 25 * climate + rng.normal(0, 15, n)).clip(1).round(1)
+        df["Diameter_mm"] = (12 + 4 * climate + rng.normal(0, 3, n)).clip(0.5).round(2)
+        df["Survival"] = (rng.random(n) < 0.85 - 0.1 * climate).astype(int)
+        # Dead seedlings are not measured
+        dead = df["Survival"] == 0
+        df.loc[dead, ["Height_cm", "Diameter_mm"]] = np.nan
+    elif table == "budburst_detailed_all":
+        df["Stage"] = rng.choice(BUDBURST_STAGES, n)
+        df["Julian_day"] = (70 + 6 * df["Stage"] - 10 * climate + rng.normal(0, 5, n)).round().astype(int)
+    elif table == "biomass_2021_combined_fordb_052224":
+        df["Shoot_mass_g"] = rng.lognormal(2.5 + 0.3 * climate, 0.4).round(3)
+        df["Root_mass_g"] = (df["Shoot_mass_g"] * rng.lognormal(0.2, 0.3, n)).round(3)
+    else:
+        raise ValueError(f"Unknown core table: {table}")
+    return df
+
+
+def _write(df, path, file_format):
+    if file_format == "parquet":
+        df.to_parquet(path, index=False)
+    else:
+        df.to_csv(path, index=False)
+
+
+def _write_chunks(chunks, path, file_format):
+    # Only one chunk is held in memory at a time
+    if file_format == "parquet":
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        writer = None
+        try:
+            for chunk in chunks:
+                batch = pa.Table.from_pandas(chunk, preserve_index=False)
+                if writer is None:
+                    writer = pq.ParquetWriter(path, batch.schema)
+                writer.write_table(batch)
+        finally:
+            if writer is not None:
+                writer.close()
+    else:
+        for i, chunk in enumerate(chunks):
+            chunk.to_csv(path, index=False, mode="w" if i == 0 else "a", header=i == 0)
+
+
+def _tree_frame(rng, rows):
+    # Drawn first from the generator, so the same seed always gives the same trees
+    count = _tree_count(rows)
+    # About 12 maternal trees per locality
+    return _trees(rng, _localities(rng, max(5, count // 12)), count)
+
+
+def generate(rows, out_dir, seed=0, file_format="csv"):
+    """Write every table to out_dir. rows is the size of each core table.
+
+    Returns {table name: rows written}.
+    """
+    rng = np.random.default_rng(seed)
+    os.makedirs(out_dir, exist_ok=True)
+    tree_df = _tree_frame(rng, rows)
+
+    written = {}
+    for table, df in (
+        (MATERNAL_TREE_TABLE, maternal_tree_table(rng, tree_df)),
+        (MAP_TABLE, map_table(tree_df)),
+        (GARDENS_TABLE, garden_climate_table(rng)),
+    ):
+        _write(df, os.path.join(out_dir, f"{table}.{file_format}"), file_format)
+        written[table] = len(df)
+
+    for table in CORE_TABLES:
+        chunks = (core_chunk(rng, table, tree_df, min(CHUNK_ROWS, rows - start))
+                  for start in range(0, rows, CHUNK_ROWS))
+        _write_chunks(chunks, os.path.join(out_dir, f"{table}.{file_format}"), file_format)
+        written[table] = rows
+    return written
+
+
+def upload_csv(path, table, rows, fixture_rows, seed=0):
+    """Write new measurements for table, in its column order, for the upload tab.
+
+    fixture_rows and seed must match the generate() call, so the rows refer
+    to the same maternal trees.
+    """
+    tree_df = _tree_frame(np.random.default_rng(seed), fixture_rows)
+    core_chunk(np.random.default_rng([seed, 1]), table, tree_df, rows).to_csv(path, index=False)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=10_000, help="rows in each core table (10k to 10M)")
+    parser.add_argument("--out", default=offline.DB_FIXTURE_DIR, help="fixture directory to write")
+    parser.add_argument("--format", choices=["csv", "parquet"], default="csv")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--backend", choices=["none"] + list(offline.BACKENDS), default="none",
+                        help="also rebuild this offline backend's database from the new fixtures")
+    parser.add_argument("--upload-csv", help="also write new db_main rows to this CSV for the upload tab")
+    parser.add_argument("--upload-rows", type=int, default=1000, help="rows in the upload CSV")
+    args = parser.parse_args()
+
+    written = generate(args.rows, args.out, args.seed, args.format)
+    for table, count in written.items():
+        print(f"{count:>10} rows  {table}")
+
+    if args.upload_csv:
+        upload_csv(args.upload_csv, "db_main", args.upload_rows, args.rows, args.seed)
+        print(f"Wrote {args.upload_rows} upload rows to {args.upload_csv}")
+
+    if args.backend != "none":
+        offline.seed(args.backend, fixture_dir=args.out)
+        print(f"Seeded {offline.database_path(args.backend)}")
+
+    print(f"TABLE_OPTIONS={','.join(CORE_TABLES)}")
+    print("MAIN_TABLE=db_main")
+    print(f"MAP_TABLE={MAP_TABLE}")
+
+
+if __name__ == "__main__":
+    main()
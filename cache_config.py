@@ -1,4 +0,0 @@
-from flask_caching import Cache
-
-# Caching
-cache = Cache()
\ No newline at end of file
@@ -0,0 +1,108 @@
+import os
+import time
+import threading
+import config
+from database import DB_BACKEND, fetch_data_from_sql, fetch_data_from_sql_pub
+
+# Load environment variables
+config.load()
+
+# Seconds before the catalog is reloaded from INFORMATION_SCHEMA
+CATALOG_TTL = int(os.getenv("CATALOG_TTL", "600"))
+
+NUMERIC_SQL_TYPES = {
+    "tinyint", "smallint", "int", "bigint",
+    "decimal", "numeric", "float", "real",
+    "money", "smallmoney",
+    # SQLite and DuckDB names used by the offline backends
+    "integer", "double", "hugeint",
+    "utinyint", "usmallint", "uinteger", "ubigint",
+}
+
+CATALOG_QUERY = """
+SELECT TABLE_NAME, COLUMN_NAME, DATA_TYPE, IS_NULLABLE
+FROM INFORMATION_SCHEMA.COLUMNS
+WHERE TABLE_SCHEMA = 'dbo'
+ORDER BY TABLE_NAME, ORDINAL_POSITION
+"""
+
+# SQLite has no INFORMATION_SCHEMA; the offline database is attached as dbo
+SQLITE_CATALOG_QUERY = """
+SELECT m.name AS TABLE_NAME, p.name AS COLUMN_NAME, p.type AS DATA_TYPE,
+       CASE WHEN p."notnull" THEN 'NO' ELSE 'YES' END AS IS_NULLABLE
+FROM dbo.sqlite_master m
+JOIN pragma_table_info(m.name, 'dbo') p
+WHERE m.type IN ('table', 'view')
+ORDER BY m.name, p.cid
+"""
+
+_fetchers = {
+    "main": fetch_data_from_sql,
+    "pub": fetch_data_from_sql_pub,
+}
+
+# credential set -> (loaded_at, {table: [column info, ...]})
+_catalogs = {}
+_lock = threading.Lock()
+
+
+def _load(credentials):
+    df = _fetchers[credentials](SQLITE_CATALOG_QUERY if DB_BACKEND == "sqlite" else CATALOG_QUERY)
+    if df is None:
+        raise RuntimeError("Could not load the table catalog.")
+    # DuckDB names INFORMATION_SCHEMA columns in lower case
+    df.columns = [c.upper() for c in df.columns]
+
+    tables = {}
+    for row in df.itertuples(index=False):
+        # DuckDB reports precision inline, e.g. DECIMAL(18,3)
+        sql_type = row.DATA_TYPE.lower().split("(")[0].strip()
+        tables.setdefault(row.TABLE_NAME, []).append({
+            "name": row.COLUMN_NAME,
+            "sql_type": sql_type,
+            "nullable": row.IS_NULLABLE == "YES",
+            "numeric": sql_type in NUMERIC_SQL_TYPES,
+        })
+    return tables
+
+
+def _catalog(credentials):
+    entry = _catalogs.get(credentials)
+    if entry is not None and time.monotonic() - entry[0] < CATALOG_TTL:
+        return entry[1]
+
+    with _lock:
+        entry = _catalogs.get(credentials)
+        if entry is None or time.monotonic() - entry[0] >= CATALOG_TTL:
+            entry = (time.monotonic(), _load(credentials))
+            _catalogs[credentials] = entry
+        return entry[1]
+
+
+def invalidate():
+    """Drop the cached catalog so the next lookup reloads it."""
+    with _lock:
+        _catalogs.clear()
+
+
+def get_column_info(table, credentials="main"):
+    """Column name, SQL type, nullability and numeric flag for each column of a table."""
+    tables = _catalog(credentials)
+    if table not in tables:
+        raise ValueError(f"Unknown table: {table}")
+    return tables[table]
+
+
+def get_columns(table, credentials="main"):
+    """Column names of a table in ordinal order."""
+    return [col["name"] for col in get_column_info(table, credentials)]
+
+
+def get_numeric_columns(table, credentials="main"):
+    """Columns whose SQL type is numeric."""
+    return [col["name"] for col in get_column_info(table, credentials) if col["numeric"]]
+
+
+def get_categorical_columns(table, credentials="main"):
+    """Columns whose SQL type is not numeric."""
+    return [col["name"] for col in get_column_info(table, credentials) if not col["numeric"]]
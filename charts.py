@@ -1,21 +1,16 @@
-import plotly.express as px
 import plotly.graph_objects as go
-import numpy as np
-from dash import html
-from scipy import stats
 from database import fetch_data_from_sql
-from dotenv import load_dotenv
+from query import table_ref, column_list
+import config
 import os
 
 # Load environment variables
-load_dotenv(override=True)
+config.load()
 
 # Get main table
 table_options = os.getenv("TABLE_OPTIONS", "").split(",")
 default_table = os.getenv("MAIN_TABLE")
 
-db_df = fetch_data_from_sql(f"SELECT TOP 20 * FROM [dbo].[{default_table}]")
-
 def create_database_Table(num, selected_columns=None, row_count=20):
     if num is None or num < 0 or num >= len(table_options):
         return go.Figure()  # Return empty figure if index is invalid
@@ -23,16 +18,16 @@ def create_database_Table(num, selected_columns=None, row_count=20):
     selected_table = table_options[num]
     
     try:
-        # Use the row_count parameter to limit the number of rows
-        db_df = fetch_data_from_sql(f"SELECT TOP {row_count} * FROM [dbo].[{selected_table}]")
+        # Use the row_count parameter to limit the number of rows, fetching only selected columns
+        columns = column_list(selected_columns) if selected_columns else "*"
+        db_df = fetch_data_from_sql(
+            f"SELECT TOP (:row_count) {columns} FROM {table_ref(selected_table)}",
+            {"row_count": int(row_count)}
+        )
     except Exception as e:
         print(f"Error fetching data from table {selected_table}: {e}")
         return go.Figure()  # Return an empty figure if query fails
 
-    # Filter selected columns
-    if selected_columns:
-        db_df = db_df[selected_columns]  # Show only selected columns
-
     # Calculate if horizontal scrolling is needed (if more than 15 columns)
     enable_scrolling = len(db_df.columns) > 15
     
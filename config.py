@@ -0,0 +1,18 @@
+import threading
+from dotenv import load_dotenv
+
+# Settings are read from the environment, filled from .env once per process.
+# Variables the process was started with win over .env, so a deployment or a
+# benchmark runner can always set them. Modules call load() before their
+# os.getenv lookups instead of reading .env themselves.
+_loaded = False
+_lock = threading.Lock()
+
+
+def load():
+    """Read .env into the environment on the first call; later calls do nothing."""
+    global _loaded
+    with _lock:
+        if not _loaded:
+            load_dotenv(override=False)
+            _loaded = True
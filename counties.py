@@ -0,0 +1,253 @@
+import os
+import json
+import gzip
+import hashlib
+import threading
+import numpy as np
+import pandas as pd
+import config
+import site_index
+
+# Load environment variables
+config.load()
+
+# County outlines for the map's choropleth layer. The polygons are simplified
+# once per process, indexed by a grid of cells that lists the counties whose
+# bounding box overlaps each cell, and served to the browser as one gzipped
+# GeoJSON file named after its contents.
+COUNTIES_GEOJSON = os.path.join(os.path.dirname(os.path.abspath(__file__)), "california_counties.geojson")
+# Douglas-Peucker tolerance in degrees; 0.005 is about 500 m, 0 keeps every vertex
+COUNTY_SIMPLIFY_TOLERANCE = float(os.getenv("COUNTY_SIMPLIFY_TOLERANCE", "0.005"))
+
+# Side of the spatial index cells, in degrees
+_CELL_DEGREES = 0.25
+# Points tested against a county's edges at once, bounding the memory used
+_POINT_BLOCK = 4096
+
+_layer = None
+_lock = threading.Lock()
+
+
+def _simplify(ring, tolerance):
+    # Douglas-Peucker on a closed ring, keeping the first and last point
+    points = np.asarray(ring, dtype=np.float64)
+    if tolerance <= 0 or len(points) <= 4:
+        return points
+    keep = np.zeros(len(points), dtype=bool)
+    keep[0] = keep[-1] = True
+    stack = [(0, len(points) - 1)]
+    while stack:
+        start, end = stack.pop()
+        if end - start < 2:
+            continue
+        a, b = points[start], points[end]
+        between = points[start + 1:end]
+        dx, dy = b - a
+        length = np.hypot(dx, dy)
+        if length == 0:
+            distance = np.hypot(between[:, 0] - a[0], between[:, 1] - a[1])
+        else:
+            distance = np.abs(dx * (between[:, 1] - a[1]) - dy * (between[:, 0] - a[0])) / length
+        farthest = int(np.argmax(distance))
+        if distance[farthest] > tolerance:
+            middle = start + 1 + farthest
+            keep[middle] = True
+            stack.extend([(start, middle), (middle, end)])
+    simplified = points[keep]
+    return simplified if len(simplified) >= 4 else points
+
+
+def _polygons(geometry):
+    if geometry["type"] == "Polygon":
+        return [geometry["coordinates"]]
+    if geometry["type"] == "MultiPolygon":
+        return geometry["coordinates"]
+    return []
+
+
+def _load():
+    with open(COUNTIES_GEOJSON) as f:
+        source = json.load(f)
+
+    ids, names, edges, boxes, features = [], [], [], [], []
+    for feature in source["features"]:
+        polygons = [[_simplify(ring, COUNTY_SIMPLIFY_TOLERANCE) for ring in polygon]
+                    for polygon in _polygons(feature["geometry"])]
+        rings = [ring for polygon in polygons for ring in polygon]
+        if not rings:
+            continue
+        ids.append(feature["properties"]["GEO_ID"])
+        names.append(feature["properties"]["NAME"])
+        # Every edge of every ring; the even-odd rule then handles holes and islands
+        starts = np.vstack([ring[:-1] for ring in rings])
+        ends = np.vstack([ring[1:] for ring in rings])
+        edges.append((starts[:, 0], ends[:, 0], starts[:, 1], ends[:, 1]))
+        stacked = np.vstack(rings)
+        boxes.append((*stacked.min(axis=0), *stacked.max(axis=0)))
+        features.append({
+            "type": "Feature",
+            "id": ids[-1],
+            "properties": {"GEO_ID": ids[-1], "NAME": names[-1]},
+            "geometry": {
+                "type": "MultiPolygon",
+                "coordinates": [[np.round(ring, 5).tolist() for ring in polygon] for polygon in polygons],
+            },
+        })
+
+    # Spatial index: grid cell -> counties whose bounding box overlaps it
+    boxes = np.array(boxes)
+    origin = boxes[:, :2].min(axis=0)
+    shape = np.ceil((boxes[:, 2:].max(axis=0) - origin) / _CELL_DEGREES).astype(int) + 1
+    grid = [[] for _ in range(shape[0] * shape[1])]
+    for county, (x0, y0, x1, y1) in enumerate(boxes):
+        c0, r0 = np.floor((np.array([x0, y0]) - origin) / _CELL_DEGREES).astype(int)
+        c1, r1 = np.floor((np.array([x1, y1]) - origin) / _CELL_DEGREES).astype(int)
+        for row in range(r0, r1 + 1):
+            for col in range(c0, c1 + 1):
+                grid[row * shape[0] + col].append(county)
+
+    body = json.dumps({"type": "FeatureCollection", "features": features}, separators=(",", ":")).encode("utf-8")
+    return {
+        "ids": ids,
+        "names": names,
+        "edges": edges,
+        "origin": origin,
+        "shape": shape,
+        "grid": grid,
+        "geojson": body,
+        "geojson_gzip": gzip.compress(body, 9),
+        "fingerprint": hashlib.sha1(body).hexdigest()[:16],
+    }
+
+
+def _get_layer():
+    global _layer
+    if _layer is None:
+        with _lock:
+            if _layer is None:
+                _layer = _load()
+    return _layer
+
+
+def _inside(x, y, edges):
+    # Even-odd rule: count the edges a ray from each point to the east crosses
+    x1, x2, y1, y2 = edges
+    y = y[:, None]
+    spans = (y1 > y) != (y2 > y)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        crossing_x = x1 + (y - y1) * (x2 - x1) / (y2 - y1)
+    return np.count_nonzero(spans & (x[:, None] < crossing_x), axis=1) % 2 == 1
+
+
+def assign(longitude, latitude):
+    """Position in county_ids() of the county holding each point; -1 outside every county.
+
+    Each distinct coordinate is tested once, and only against the counties
+    listed for its grid cell.
+    """
+    layer = _get_layer()
+    points = np.column_stack([np.asarray(longitude, dtype=np.float64), np.asarray(latitude, dtype=np.float64)])
+    result = np.full(len(points), -1, dtype=np.int64)
+    valid = np.isfinite(points).all(axis=1)
+    if not valid.any():
+        return result
+
+    # Trees of one site usually share coordinates. Each (lon, lat) pair is
+    # viewed as one complex number, which np.unique sorts much faster than rows
+    pairs, inverse = np.unique(np.ascontiguousarray(points[valid]).view(np.complex128).ravel(), return_inverse=True)
+    unique = np.column_stack([pairs.real, pairs.imag])
+    found = np.full(len(unique), -1, dtype=np.int64)
+
+    col, row = np.floor((unique - layer["origin"]) / _CELL_DEGREES).astype(int).T
+    columns, rows = layer["shape"]
+    in_grid = (col >= 0) & (col < columns) & (row >= 0) & (row < rows)
+    cells = np.where(in_grid, row * columns + col, -1)
+    order = np.argsort(cells, kind="stable")
+    order = order[cells[order] >= 0]
+    cell_ids, starts = np.unique(cells[order], return_index=True)
+    for cell, start, end in zip(cell_ids, starts, np.append(starts[1:], len(order))):
+        pending = order[start:end]
+        for county in layer["grid"][cell]:
+            for block in range(0, len(pending), _POINT_BLOCK):
+                part = pending[block:block + _POINT_BLOCK]
+                inside = _inside(unique[part, 0], unique[part, 1], layer["edges"][county])
+                found[part[inside]] = county
+            pending = pending[found[pending] < 0]
+            if not len(pending):
+                break
+
+    result[valid] = found[inverse]
+    return result
+
+
+def county_ids():
+    """GEO_ID of each county, in the order assign() numbers them."""
+    return list(_get_layer()["ids"])
+
+
+def geojson():
+    """(fingerprint, GeoJSON bytes, the same bytes gzipped) of the simplified outlines."""
+    layer = _get_layer()
+    return layer["fingerprint"], layer["geojson"], layer["geojson_gzip"]
+
+
+def geojson_path():
+    """Path of the outlines under the app's URL prefix; changes whenever they do."""
+    return f"public/counties.{_get_layer()['fingerprint']}.geojson"
+
+
+def _aggregate(sites, trees):
+    layer = _get_layer()
+    n = len(layer["ids"])
+    site_county = assign(sites["longitude"], sites["latitude"])
+    tree_county = assign(trees["Longitude"], trees["Latitude"])
+    placed = tree_county >= 0
+
+    summary = pd.DataFrame({
+        "GEO_ID": layer["ids"],
+        "county": layer["names"],
+        "sites": np.bincount(site_county[site_county >= 0], minlength=n),
+        "trees": np.bincount(tree_county[placed], minlength=n),
+    })
+    # Mean of every numeric trait over the trees in each county
+    traits = [c for c in trees.select_dtypes("number").columns if c not in ("Latitude", "Longitude")]
+    for trait in traits:
+        values = trees[trait].to_numpy(dtype=np.float64)
+        counted = placed & ~np.isnan(values)
+        totals = np.bincount(tree_county[counted], weights=values[counted], minlength=n)
+        counts = np.bincount(tree_county[counted], minlength=n)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            summary[trait] = np.where(counts > 0, totals / counts, np.nan)
+
+    # -1 (outside every county) picks the trailing None
+    site_geo_ids = np.array(layer["ids"] + [None], dtype=object)[site_county]
+    return {
+        "summary": summary,
+        "traits": traits,
+        "site_counties": pd.Series(site_geo_ids, index=sites["locality_full_name"].to_numpy()),
+    }
+
+
+def _county_data(table=None):
+    return site_index.derived(
+        "counties", lambda sites: _aggregate(sites, site_index.get_tree_rows(table)), table)
+
+
+def county_summary(table=None):
+    """One row per county: GEO_ID, county, sites, trees, then the mean of each numeric trait.
+
+    Computed once per data version of the map table. Shared by every caller;
+    do not modify it.
+    """
+    return _county_data(table)["summary"]
+
+
+def county_traits(table=None):
+    """Names of the trait columns in county_summary()."""
+    return _county_data(table)["traits"]
+
+
+def county_sites(geo_id, table=None):
+    """Names of the tree sites inside a county."""
+    site_counties = _county_data(table)["site_counties"]
+    return site_counties.index[site_counties.to_numpy() == geo_id].tolist()
@@ -0,0 +1,82 @@
+import os
+import time
+import uuid
+import tempfile
+import threading
+import hashlib
+import config
+
+# Load environment variables
+config.load()
+
+# One small file per table holds its current version token. Files are shared by
+# every worker process on the host, so a bump in one worker is seen by all.
+DATA_VERSION_DIR = os.getenv("DATA_VERSION_DIR", os.path.join(tempfile.gettempdir(), "sork-data-versions"))
+
+# Also fold SQL Server's database-wide change tracking version into every table
+# version, so changes made outside the dashboard invalidate cached results too
+USE_CHANGE_TRACKING = os.getenv("DATA_VERSION_CHANGE_TRACKING", "false").lower() in ("1", "true", "yes")
+CHANGE_TRACKING_POLL_SECONDS = int(os.getenv("DATA_VERSION_POLL_SECONDS", "30"))
+
+_change_tracking = {"checked_at": 0.0, "version": None}
+_lock = threading.Lock()
+
+
+def _path(table):
+    digest = hashlib.sha1(table.encode("utf-8")).hexdigest()
+    return os.path.join(DATA_VERSION_DIR, digest)
+
+
+def _local_version(table):
+    try:
+        with open(_path(table)) as f:
+            return f.read().strip() or "0"
+    except FileNotFoundError:
+        return "0"
+
+
+def _change_tracking_version():
+    if not USE_CHANGE_TRACKING:
+        return None
+    now = time.monotonic()
+    if now - _change_tracking["checked_at"] < CHANGE_TRACKING_POLL_SECONDS:
+        return _change_tracking["version"]
+
+    with _lock:
+        if now - _change_tracking["checked_at"] >= CHANGE_TRACKING_POLL_SECONDS:
+            # Imported here because the database layer consults this module
+            from database import fetch_uncached
+
+            df = fetch_uncached("SELECT CHANGE_TRACKING_CURRENT_VERSION() AS version")
+            version = None if df is None or df.empty else df.iloc[0]["version"]
+            # NULL (NaN once in a DataFrame) when change tracking is not enabled on the database
+            _change_tracking["version"] = None if version is None or version != version else str(version)
+            _change_tracking["checked_at"] = now
+        return _change_tracking["version"]
+
+
+def change_tracking_available():
+    """Whether table versions currently follow SQL Server change tracking."""
+    return _change_tracking_version() is not None
+
+
+def table_version(table):
+    """Opaque token that changes whenever the table's data changes."""
+    ct = _change_tracking_version()
+    local = _local_version(table)
+    return local if ct is None else f"{local}:{ct}"
+
+
+def table_versions(tables):
+    """Versions of several tables as a hashable tuple."""
+    return tuple((table, table_version(table)) for table in sorted(tables))
+
+
+def bump(table):
+    """Record that a table's data changed, e.g. after an upload."""
+    os.makedirs(DATA_VERSION_DIR, exist_ok=True)
+    # A random token instead of a counter, so concurrent bumps never collide
+    tmp = f"{_path(table)}.{os.getpid()}.{threading.get_ident()}"
+    with open(tmp, "w") as f:
+        f.write(uuid.uuid4().hex)
+    os.replace(tmp, _path(table))
@@ -1,78 +1,425 @@
 import os
+import datetime
+import decimal
+import threading
+import time
+import numpy as np
 import pandas as pd
-from sqlalchemy import create_engine
-from dotenv import load_dotenv
+from sqlalchemy import create_engine, text
+import config
+import result_cache
+import mirror
+import metrics
+import offline
+import tsql
 
 # Load environment variables
-load_dotenv(override=True)
+config.load()
 
-def fetch_data_from_sql(query):
-    """Fetch data from SQL Server using SQLAlchemy with PyODBC."""
-    
-    driver = "ODBC Driver 18 for SQL Server"
+DRIVER = "ODBC Driver 18 for SQL Server"
+
+# mssql talks to SQL Server. sqlite and duckdb run against a local database
+# seeded from fixture files, with the tabs' T-SQL translated on the way.
+DB_BACKEND = os.getenv("DB_BACKEND", "mssql").lower()
+
+# Environment variable suffix for each credential set
+CREDENTIAL_SETS = {
+    "main": "",     # read access used by the dashboard tabs
+    "pub": "_PUB",  # public, unauthenticated map access
+    "up": "_UP",    # write access used by the upload tab
+}
+
+# Rows pulled from the cursor per fetchmany() call in the columnar path
+FETCH_BATCH_ROWS = int(os.getenv("DB_FETCH_BATCH_ROWS", "10000"))
+
+# Engines are shared process-wide, one per credential set
+_engines = {}
+_engines_lock = threading.Lock()
+
+
+def _pool_settings():
+    """Connection pool configuration, overridable through environment variables."""
+    return {
+        "pool_size": int(os.getenv("DB_POOL_SIZE", "5")),
+        "max_overflow": int(os.getenv("DB_MAX_OVERFLOW", "10")),
+        "pool_pre_ping": os.getenv("DB_POOL_PRE_PING", "true").lower() in ("1", "true", "yes"),
+        "pool_recycle": int(os.getenv("DB_POOL_RECYCLE", "1800")),
+        "pool_timeout": int(os.getenv("DB_POOL_TIMEOUT", "30")),
+    }
+
+
+def _connection_string(credentials):
+    suffix = CREDENTIAL_SETS[credentials]
     server = os.getenv("DB_SERVER")
     database = os.getenv("DB_DATABASE")
-    username = os.getenv("DB_USERNAME")
-    password = os.getenv("DB_PASSWORD")
+    username = os.getenv(f"DB_USERNAME{suffix}")
+    password = os.getenv(f"DB_PASSWORD{suffix}")
 
     if not all([server, database, username, password]):
         raise ValueError("Missing one or more database environment variables.")
 
     # SQLAlchemy connection string
-    connection_string = (
+    return (
         f"mssql+pyodbc://{username}:{password}@{server}/{database}"
-        f"?driver={driver}&Encrypt=yes&TrustServerCertificate=yes"
+        f"?driver={DRIVER}&Encrypt=yes&TrustServerCertificate=yes"
     )
 
-    try:
-        # Use SQLAlchemy engine 
-        engine = create_engine(connection_string, fast_executemany=True)
 
+def get_engine(credentials="main"):
+    """Return the pooled engine for a credential set, creating it on first use."""
+    if credentials not in CREDENTIAL_SETS:
+        raise ValueError(f"Unknown credential set: {credentials}")
+    if DB_BACKEND != "mssql" and DB_BACKEND not in offline.BACKENDS:
+        raise ValueError(f"Unknown database backend: {DB_BACKEND}")
+
+    engine = _engines.get(credentials)
+    if engine is not None:
+        return engine
+
+    with _engines_lock:
+        engine = _engines.get(credentials)
+        if engine is None:
+            if DB_BACKEND == "mssql":
+                engine = create_engine(
+                    _connection_string(credentials),
+                    fast_executemany=True,
+                    **_pool_settings()
+                )
+            else:
+                # Every credential set shares the one local database
+                engine = offline.engine(DB_BACKEND, **_pool_settings())
+            _engines[credentials] = engine
+        return engine
+
+
+def dispose_engines(close=True):
+    """Close every pooled connection, e.g. after a configuration change.
+
+    In a freshly forked worker pass close=False: the pooled connections belong
+    to the parent, so they are dropped without being closed and the worker
+    opens its own.
+    """
+    with _engines_lock:
+        for engine in _engines.values():
+            engine.dispose(close=close)
+        _engines.clear()
+
+
+def _backend_sql(query):
+    # T-SQL as written by the tabs, rewritten for a local backend
+    if DB_BACKEND == "mssql":
+        return query
+    return tsql.translate(query, DB_BACKEND, schema="dbo", keep_binds=True)
+
+
+def fetch_uncached(query, params=None, credentials="main"):
+    """Run a query directly against the database, bypassing the result cache."""
+    engine = get_engine(credentials)
+    started = time.perf_counter()
+
+    try:
         with engine.connect() as connection:
-            df = pd.read_sql_query(query, connection)
+            df = pd.read_sql_query(text(_backend_sql(query)), connection, params=params or {})
 
+        metrics.record(query, credentials, DB_BACKEND, started, *metrics.result_size(df), params=params)
         return df
 
     except Exception as e:
         print(f"Database error: {e}")
+        metrics.record(query, credentials, DB_BACKEND, started, error=e, params=params)
         return None
 
+
+def _fetch(query, params, credentials):
+    started = time.perf_counter()
+    # Served locally when the mirror holds fresh copies of every table read
+    df = mirror.fetch(query, params, credentials)
+    if df is not None:
+        metrics.record(query, credentials, "mirror", started, *metrics.result_size(df))
+        return df
+
+    # fetch_uncached records its own metrics; only cache hits are recorded here
+    missed = []
+
+    def fetch():
+        missed.append(True)
+        return fetch_uncached(query, params, credentials)
+
+    df = result_cache.get_or_fetch(query, params, credentials, fetch)
+    if not missed:
+        metrics.record(query, credentials, "cache", started, *metrics.result_size(df))
+    return df
+
+
+def fetch_data_from_sql(query, params=None):
+    """Fetch data from SQL Server using the pooled main engine.
+
+    Values are passed as :name bind parameters in params so the server can
+    reuse one cached plan for every value.
+    """
+    return _fetch(query, params, "main")
+
+
+def fetch_data_from_sql_pub(query, params=None):
+    """Fetch data from SQL Server using the pooled public engine."""
+    return _fetch(query, params, "pub")
+
+
+def _numpy_column(values, type_code):
+    # Build one typed array per column instead of a frame of Python objects
+    if type_code in (float, decimal.Decimal):
+        return np.array(values, dtype=np.float64)
+    if type_code is int:
+        if None in values:
+            return np.array(values, dtype=np.float64)
+        return np.array(values, dtype=np.int64)
+    if type_code is bool and None not in values:
+        return np.array(values, dtype=np.bool_)
+    if type_code in (datetime.datetime, datetime.date):
+        return pd.to_datetime(np.array(values, dtype=object)).to_numpy()
+    return np.array(values, dtype=object)
+
+
+def _concat_column(chunk, type_code):
+    if not chunk:
+        return _numpy_column((), type_code)
+    if len(chunk) == 1:
+        return chunk[0]
+    if len({c.dtype for c in chunk}) > 1:
+        # Only some batches contained NULLs: widen ints to float, bools to object
+        dtype = np.float64 if type_code is int else object
+        chunk = [c.astype(dtype) for c in chunk]
+    return np.concatenate(chunk)
+
+
+def _arrow_type(type_code):
+    import pyarrow as pa
+
+    return {
+        float: pa.float64(),
+        decimal.Decimal: pa.float64(),
+        int: pa.int64(),
+        bool: pa.bool_(),
+        str: pa.string(),
+        bytes: pa.binary(),
+        bytearray: pa.binary(),
+        datetime.datetime: pa.timestamp("us"),
+        datetime.date: pa.date32(),
+        datetime.time: pa.time64("us"),
+    }.get(type_code, pa.string())
+
+
+def _arrow_column(values, arrow_type):
+    import pyarrow as pa
+
+    if pa.types.is_floating(arrow_type):
+        values = [None if v is None else float(v) for v in values]
+    elif pa.types.is_string(arrow_type):
+        values = [None if v is None else str(v) for v in values]
+    return pa.array(values, type=arrow_type)
+
+
+def _driver_sql(engine, query, params):
+    # Compile :name binds to the driver's positional markers
+    compiled = text(_backend_sql(query)).bindparams(**(params or {})).compile(dialect=engine.dialect)
+    return str(compiled), [compiled.params[name] for name in compiled.positiontup or ()]
+
+
+def _arrow_schema(description):
+    import pyarrow as pa
+
+    return pa.schema([(d[0], _arrow_type(d[1])) for d in description])
+
+
+def _record_batches(batches, schema):
+    import pyarrow as pa
+
+    for columns in batches:
+        yield pa.RecordBatch.from_arrays(
+            [_arrow_column(values, field.type) for values, field in zip(columns, schema)],
+            schema=schema
+        )
+
+
+def _described(description, rows):
+    # pyodbc reports a Python type per column; SQLite and DuckDB do not, so the
+    # type is taken from the first non-NULL value of the first batch instead
+    described = []
+    for i, column in enumerate(description):
+        type_code = column[1]
+        if not isinstance(type_code, type):
+            types = {type(row[i]) for row in rows if row[i] is not None}
+            type_code = float if types == {int, float} else next(iter(types), str)
+        described.append((column[0], type_code) + tuple(column[2:]))
+    return described
+
+
+def _raw_batches(query, params, credentials, batch_rows):
+    # Yields cursor.description, then each fetchmany() batch transposed into
+    # per-column tuples. The pooled connection is held until the generator ends.
+    engine = get_engine(credentials)
+    sql, positional = _driver_sql(engine, query, params)
+    connection = engine.raw_connection()
+    try:
+        cursor = connection.cursor()
+        cursor.arraysize = batch_rows
+        cursor.execute(sql, positional)
+        rows = cursor.fetchmany(batch_rows)
+        yield _described(cursor.description, rows)
+        while rows:
+            yield list(zip(*rows))
+            rows = cursor.fetchmany(batch_rows)
     finally:
-        if 'engine' in locals() and engine:
-            engine.dispose()
-            
-            
-def fetch_data_from_sql_pub(query):
-    """Fetch data from SQL Server using SQLAlchemy with PyODBC."""
-    
-    driver = "ODBC Driver 18 for SQL Server"
-    server = os.getenv("DB_SERVER")
-    database = os.getenv("DB_DATABASE")
-    username = os.getenv("DB_USERNAME_PUB")
-    password = os.getenv("DB_PASSWORD_PUB")
+        connection.close()
 
-    if not all([server, database, username, password]):
-        raise ValueError("Missing one or more database environment variables.")
 
-    # SQLAlchemy connection string
-    connection_string = (
-        f"mssql+pyodbc://{username}:{password}@{server}/{database}"
-        f"?driver={driver}&Encrypt=yes&TrustServerCertificate=yes"
-    )
+def fetch_columnar(query, params=None, credentials="main", as_arrow=False, batch_rows=None):
+    """Fetch a result set into typed column buffers.
+
+    Rows are pulled with fetchmany() and converted batch by batch into NumPy
+    arrays, or Arrow record batches when as_arrow is true, so the whole result
+    never exists as a list of row tuples. Returns a DataFrame (or a
+    pyarrow.Table), or None on a database error.
+    """
+    batch_rows = batch_rows or FETCH_BATCH_ROWS
+    started = time.perf_counter()
+
+    mirrored = mirror.fetch(query, params, credentials, as_arrow)
+    if mirrored is not None:
+        metrics.record(query, credentials, "mirror", started, *metrics.result_size(mirrored))
+        return mirrored
 
     try:
-        # Use SQLAlchemy engine 
-        engine = create_engine(connection_string, fast_executemany=True)
+        batches = _raw_batches(query, params, credentials, batch_rows)
+        description = next(batches)
+        names = [d[0] for d in description]
+        type_codes = [d[1] for d in description]
 
-        with engine.connect() as connection:
-            df = pd.read_sql_query(query, connection)
+        if as_arrow:
+            import pyarrow as pa
+
+            schema = _arrow_schema(description)
+            table = pa.Table.from_batches(_record_batches(batches, schema), schema=schema)
+            metrics.record(query, credentials, DB_BACKEND, started, *metrics.result_size(table), params=params)
+            return table
 
+        chunks = [[] for _ in names]
+        for columns in batches:
+            for chunk, values, type_code in zip(chunks, columns, type_codes):
+                chunk.append(_numpy_column(values, type_code))
+
+        data = {name: _concat_column(chunk, type_code)
+                for name, chunk, type_code in zip(names, chunks, type_codes)}
+        df = pd.DataFrame(data, columns=names, copy=False)
+        metrics.record(query, credentials, DB_BACKEND, started, *metrics.result_size(df), params=params)
         return df
 
     except Exception as e:
         print(f"Database error: {e}")
+        metrics.record(query, credentials, DB_BACKEND, started, error=e, params=params)
         return None
 
+
+def _frames(query, params, chunk_rows, credentials):
+    batches = _raw_batches(query, params, credentials, chunk_rows)
+    try:
+        description = next(batches)
+        names = [d[0] for d in description]
+        type_codes = [d[1] for d in description]
+
+        for columns in batches:
+            yield pd.DataFrame(
+                {name: _numpy_column(values, type_code)
+                 for name, values, type_code in zip(names, columns, type_codes)},
+                columns=names, copy=False
+            )
+    finally:
+        batches.close()
+
+
+def _measured(chunks, query, params, credentials, source, started):
+    # Records one metric for a streamed result once the caller stops reading.
+    # Only the time spent producing chunks counts, not the time the caller
+    # spends on each one (writing a CSV, say), so the slow log sees the query
+    busy = time.perf_counter() - started
+    rows = nbytes = 0
+    error = None
+    chunks = iter(chunks)
+    try:
+        while True:
+            resumed = time.perf_counter()
+            try:
+                chunk = next(chunks)
+            except StopIteration:
+                break
+            finally:
+                busy += time.perf_counter() - resumed
+            chunk_rows, chunk_bytes = metrics.result_size(chunk)
+            rows += chunk_rows
+            nbytes += chunk_bytes
+            yield chunk
+    except Exception as e:
+        error = e
+        raise
+    finally:
+        metrics.record(query, credentials, source, started, rows, nbytes, error, params, seconds=busy)
+
+
+def fetch_iter(query, params=None, chunk_rows=None, credentials="main"):
+    """Yield the result set as DataFrames of at most chunk_rows rows.
+
+    Only one chunk is held in memory at a time. Unlike fetch_data_from_sql,
+    database errors are raised to the caller.
+    """
+    chunk_rows = chunk_rows or FETCH_BATCH_ROWS
+    started = time.perf_counter()
+
+    reader = mirror.fetch_iter(query, params, chunk_rows, credentials)
+    if reader is not None:
+        yield from _measured((batch.to_pandas() for batch in reader), query, params, credentials, "mirror", started)
+        return
+
+    yield from _measured(_frames(query, params, chunk_rows, credentials), query, params, credentials, DB_BACKEND, started)
+
+
+def fetch_arrow_batches(query, params=None, batch_rows=None, credentials="main"):
+    """Yield the result set as Arrow record batches sharing one schema.
+
+    The first value yielded is the pyarrow.Schema. Database errors are raised
+    to the caller.
+    """
+    started = time.perf_counter()
+    batches = _raw_batches(query, params, credentials, batch_rows or FETCH_BATCH_ROWS)
+    try:
+        schema = _arrow_schema(next(batches))
+        yield schema
+        yield from _measured(_record_batches(batches, schema), query, params, credentials, DB_BACKEND, started)
+    finally:
+        batches.close()
+
+
+def fetch_plan(query, params=None, credentials="main"):
+    """Return SQL Server's estimated execution plan for a query as XML.
+
+    The query is compiled but not run. Errors are raised to the caller.
+    """
+    if DB_BACKEND != "mssql":
+        raise ValueError(f"Execution plans are not available on the {DB_BACKEND} backend")
+    engine = get_engine(credentials)
+    sql, positional = _driver_sql(engine, query, params)
+    connection = engine.raw_connection()
+    try:
+        cursor = connection.cursor()
+        cursor.execute("SET SHOWPLAN_XML ON")
+        try:
+            cursor.execute(sql, positional)
+            plan = cursor.fetchone()[0]
+        finally:
+            cursor.execute("SET SHOWPLAN_XML OFF")
+        return plan
+    except Exception:
+        # Never hand a connection that may still have SHOWPLAN on back to the pool
+        connection.invalidate()
+        raise
     finally:
-        if 'engine' in locals() and engine:
-            engine.dispose()
+        connection.close()
@@ -0,0 +1,480 @@
+import os
+import re
+import json
+import time
+import uuid
+import fcntl
+import atexit
+import hashlib
+import tempfile
+import threading
+from collections import OrderedDict
+import config
+
+# Load environment variables
+config.load()
+
+# Joined datasets saved for the stats tab. Each is one uncompressed Arrow IPC
+# file named after the hash of its contents, in a directory shared by the
+# workers. By default the directory is in /dev/shm, so the files live in
+# shared memory: every worker maps the same pages, and loading two columns of
+# a wide join only touches the pages holding those two columns.
+_SHARED_MEMORY = "/dev/shm"
+DATASET_DIR = os.getenv("DATASET_DIR") or os.path.join(
+    _SHARED_MEMORY if os.path.isdir(_SHARED_MEMORY) else tempfile.gettempdir(), "sork-datasets")
+# Datasets unused for this many seconds are deleted once no worker holds them
+DATASET_TTL = int(os.getenv("DATASET_TTL", "86400"))
+# A worker lets go of a dataset it has not read for this many seconds
+DATASET_ATTACH_TTL = int(os.getenv("DATASET_ATTACH_TTL", "600"))
+# Bytes of datasets a worker keeps mapped; the least recently used are let go first
+DATASET_ATTACH_BYTES = int(os.getenv("DATASET_ATTACH_BYTES", str(256 * 1024 * 1024)))
+# Bytes of datasets kept per user and in total; the least recently used go first
+DATASET_USER_BYTES = int(os.getenv("DATASET_USER_BYTES", str(512 * 1024 * 1024)))
+DATASET_TOTAL_BYTES = int(os.getenv("DATASET_TOTAL_BYTES", str(2 * 1024 * 1024 * 1024)))
+# How long the reason a dataset was removed is remembered
+DATASET_TOMBSTONE_SECONDS = 7 * 86400
+# How often each worker prunes expired datasets when started with start_pruning()
+_PRUNE_SECONDS = 600
+
+_SUFFIX = ".arrow"
+_KEY = re.compile(r"[0-9a-f]{64}")
+_REF = re.compile(r"([0-9a-f]{64})\.(\d+)\.ref")
+_OWNER = re.compile(r"([0-9a-f]{64})\.([0-9a-f]{16})\.owner")
+_TOMBSTONE = ".evicted"
+
+# Why a dataset was removed, shown to users who still hold its key
+EVICTION_REASONS = {
+    "expired": "it was not used for {ttl}",
+    "user_quota": "your saved datasets exceeded {user_quota}",
+    "total_quota": "saved datasets from all users exceeded {total_quota}",
+}
+
+# Datasets this process has mapped: key -> [Arrow table, last used, bytes],
+# least recently used first. While a key is here, a <key>.<pid>.ref file in
+# DATASET_DIR tells other workers that this process still holds it.
+_attached = OrderedDict()
+_attached_bytes = 0
+_counts = {"hits": 0, "maps": 0, "missing": 0, "idle_releases": 0, "size_releases": 0}
+_lock = threading.Lock()
+
+
+def _path(key):
+    return os.path.join(DATASET_DIR, key + _SUFFIX)
+
+
+def _ref_path(key, pid=None):
+    return os.path.join(DATASET_DIR, f"{key}.{pid or os.getpid()}.ref")
+
+
+def _owner_id(owner):
+    return hashlib.sha1(str(owner).encode("utf-8")).hexdigest()[:16]
+
+
+def _owner_path(key, owner_id):
+    return os.path.join(DATASET_DIR, f"{key}.{owner_id}.owner")
+
+
+def _tombstone_path(key):
+    return os.path.join(DATASET_DIR, key + _TOMBSTONE)
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+def _touch(path):
+    # Keep recently used datasets from being pruned
+    try:
+        os.utime(path)
+    except OSError:
+        pass
+
+
+def _to_arrow(df):
+    import pyarrow as pa
+    try:
+        return pa.Table.from_pandas(df, preserve_index=False)
+    except (pa.ArrowInvalid, pa.ArrowTypeError):
+        # Object columns mixing text and numbers are stored as text
+        text = {c: "string" for c in df.select_dtypes(include=["object"]).columns}
+        return pa.Table.from_pandas(df.astype(text), preserve_index=False)
+
+
+class DatasetHandle:
+    """A registered dataset. key is what the browser keeps in joined-dataset-store.
+
+    Reads go through columns(), numeric_columns() and load(), the same methods
+    as sources.TableHandle, and only touch the columns asked for. They return
+    None once the dataset is gone.
+    """
+
+    def __init__(self, key, num_rows, num_columns, nbytes, evicted=()):
+        self.key = key
+        self.num_rows = num_rows
+        self.num_columns = num_columns
+        self.nbytes = nbytes
+        # (key, reason) of older datasets removed to make room for this one;
+        # eviction_reason(reason) describes the reason to the user
+        self.evicted = list(evicted)
+
+    def __repr__(self):
+        return f"DatasetHandle({self.key[:12]}, {self.num_rows} rows, {self.num_columns} columns, {self.nbytes} bytes)"
+
+    def schema(self):
+        """Arrow schema, or None if the dataset is gone. Reads no data."""
+        table = _attach(self.key)
+        return None if table is None else table.schema
+
+    def columns(self):
+        """Column names, or None if the dataset is gone."""
+        dataset_schema = self.schema()
+        return None if dataset_schema is None else dataset_schema.names
+
+    def numeric_columns(self):
+        """Names of the numeric columns, or None if the dataset is gone."""
+        import pyarrow as pa
+        dataset_schema = self.schema()
+        if dataset_schema is None:
+            return None
+        return [f.name for f in dataset_schema
+                if pa.types.is_integer(f.type) or pa.types.is_floating(f.type) or pa.types.is_decimal(f.type)]
+
+    def _select(self, columns, dropna, limit):
+        table = _attach(self.key)
+        if table is None:
+            return None
+        if columns is not None:
+            table = table.select(list(columns))
+        # Rows are filtered in Arrow, so dropped rows are never converted
+        if dropna:
+            table = table.drop_null()
+        if limit is not None:
+            table = table.slice(0, limit)
+        return table
+
+    def load(self, columns=None, dropna=True, limit=None):
+        """Read the dataset as a DataFrame, or None if it is gone.
+
+        Only the given columns are converted (KeyError if one is missing). With
+        dropna, rows with a missing value in any of them are left out; limit
+        caps the rows returned. Numeric columns without missing values are
+        read-only views of the shared mapping rather than copies.
+        """
+        table = self._select(columns, dropna, limit)
+        return None if table is None else table.to_pandas(split_blocks=True)
+
+    def chunks(self, columns=None, dropna=True, chunk_rows=None):
+        """Yield the dataset as DataFrames of at most chunk_rows rows (nothing if it is gone)."""
+        table = self._select(columns, dropna, None)
+        if table is None:
+            return
+        for batch in table.to_batches(max_chunksize=chunk_rows):
+            yield batch.to_pandas()
+
+
+def _megabytes(nbytes):
+    megabytes = nbytes / (1024 * 1024)
+    return f"{megabytes:.0f} MB" if megabytes >= 10 else f"{megabytes:.1f} MB"
+
+
+class _RegistryLock:
+    # Serializes quota checks between the workers on this host
+    def __enter__(self):
+        os.makedirs(DATASET_DIR, exist_ok=True)
+        self._file = open(os.path.join(DATASET_DIR, ".lock"), "w")
+        fcntl.flock(self._file, fcntl.LOCK_EX)
+
+    def __exit__(self, *exc):
+        fcntl.flock(self._file, fcntl.LOCK_UN)
+        self._file.close()
+
+
+def register_dataset(df, owner):
+    """Store a DataFrame for owner and return its DatasetHandle.
+
+    The key is the SHA-256 of the Arrow IPC bytes, so registering the same data
+    twice stores it once. Afterwards the owner's datasets fit DATASET_USER_BYTES
+    and all datasets fit DATASET_TOTAL_BYTES; the least recently used are
+    removed to get there and listed in handle.evicted with the quota they were
+    removed for. Raises ValueError if the dataset alone is over a quota.
+    """
+    import pyarrow as pa
+    table = _to_arrow(df)
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_file(sink, table.schema) as writer:
+        writer.write_table(table)
+    data = sink.getvalue()
+    limit = min(DATASET_USER_BYTES, DATASET_TOTAL_BYTES)
+    if data.size > limit:
+        raise ValueError(f"The result is {_megabytes(data.size)}, more than the {_megabytes(limit)} "
+                         "that can be saved for analysis. Select fewer columns or rows.")
+    key = hashlib.sha256(data).hexdigest()
+    owner_id = _owner_id(owner)
+
+    with _RegistryLock():
+        path = _path(key)
+        if os.path.exists(path):
+            _touch(path)
+        else:
+            tmp = f"{path}.{uuid.uuid4().hex}.tmp"
+            try:
+                with open(tmp, "wb") as f:
+                    f.write(data)
+                os.replace(tmp, path)
+            finally:
+                if os.path.exists(tmp):
+                    os.remove(tmp)
+        open(_owner_path(key, owner_id), "w").close()
+        _remove(_tombstone_path(key))
+        evicted = _enforce_quotas(owner_id, key)
+    return DatasetHandle(key, table.num_rows, table.num_columns, data.size, evicted)
+
+
+def _attach(key):
+    # Keys come back from the browser, so anything but our own digests is unknown
+    if not isinstance(key, str) or not _KEY.fullmatch(key):
+        return None
+    now = time.monotonic()
+    with _lock:
+        entry = _attached.get(key)
+        if entry is not None:
+            entry[1] = now
+            _attached.move_to_end(key)
+            _counts["hits"] += 1
+    if entry is not None:
+        _touch(_path(key))
+        return entry[0]
+
+    import pyarrow as pa
+    path = _path(key)
+    try:
+        # The table's buffers point into the mapping; nothing is copied
+        table = pa.ipc.open_file(pa.memory_map(path)).read_all()
+    except FileNotFoundError:
+        with _lock:
+            _counts["missing"] += 1
+        return None
+    _touch(path)
+    global _attached_bytes
+    with _lock:
+        if key not in _attached:
+            open(_ref_path(key), "w").close()
+            _attached[key] = [table, now, table.nbytes]
+            _attached_bytes += table.nbytes
+            _counts["maps"] += 1
+        table = _attached[key][0]
+    _release_idle(key)
+    return table
+
+
+def _release(key):
+    # Called with _lock held. The mapping closes once no DataFrame built from it is left
+    global _attached_bytes
+    _attached_bytes -= _attached.pop(key)[2]
+    _remove(_ref_path(key))
+
+
+def _release_idle(keep=None):
+    # Lets go of datasets unused for DATASET_ATTACH_TTL, then of the least
+    # recently used until the rest fit DATASET_ATTACH_BYTES
+    cutoff = time.monotonic() - DATASET_ATTACH_TTL
+    with _lock:
+        for key in [key for key, entry in _attached.items() if entry[1] < cutoff and key != keep]:
+            _release(key)
+            _counts["idle_releases"] += 1
+        for key in list(_attached):
+            if _attached_bytes <= DATASET_ATTACH_BYTES:
+                break
+            if key != keep:
+                _release(key)
+                _counts["size_releases"] += 1
+
+
+@atexit.register
+def _release_all():
+    global _attached_bytes
+    with _lock:
+        for key in _attached:
+            _remove(_ref_path(key))
+        _attached.clear()
+        _attached_bytes = 0
+
+
+def get_dataset(key):
+    """DatasetHandle for a stored dataset, or None if it is gone."""
+    table = _attach(key)
+    if table is None:
+        return None
+    try:
+        nbytes = os.path.getsize(_path(key))
+    except OSError:
+        nbytes = table.nbytes
+    return DatasetHandle(key, table.num_rows, table.num_columns, nbytes)
+
+
+def _live_references():
+    # key -> number of live processes holding it; markers of dead processes are removed
+    refs = {}
+    for entry in os.scandir(DATASET_DIR):
+        match = _REF.fullmatch(entry.name)
+        if match is None:
+            continue
+        key, pid = match.group(1), int(match.group(2))
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            _remove(entry.path)
+            continue
+        except PermissionError:
+            pass
+        refs[key] = refs.get(key, 0) + 1
+    return refs
+
+
+def _evict(key, reason):
+    # Mappings already open in a worker stay valid until it lets go of them
+    for entry in os.scandir(DATASET_DIR):
+        match = _OWNER.fullmatch(entry.name)
+        if match is not None and match.group(1) == key:
+            _remove(entry.path)
+    _remove(_path(key))
+    with open(_tombstone_path(key), "w") as f:
+        json.dump({"reason": reason, "at": time.time()}, f)
+
+
+def _scan(now):
+    # Called with the registry lock held. Stored datasets and their owners;
+    # old tombstones and leftover temporary files are removed on the way
+    datasets, owners = {}, {}
+    for entry in os.scandir(DATASET_DIR):
+        try:
+            if entry.name.endswith(_SUFFIX):
+                stat = entry.stat()
+                datasets[entry.name[:-len(_SUFFIX)]] = (stat.st_mtime, stat.st_size)
+            elif _OWNER.fullmatch(entry.name):
+                key, owner = _OWNER.fullmatch(entry.name).groups()
+                owners.setdefault(key, set()).add(owner)
+            elif entry.name.endswith(_TOMBSTONE) or entry.name.endswith(".tmp"):
+                if now - entry.stat().st_mtime > DATASET_TOMBSTONE_SECONDS:
+                    _remove(entry.path)
+        except OSError:
+            continue
+    return datasets, owners
+
+
+def _expire(datasets, now, keep=None):
+    # Called with the registry lock held; removes from datasets the ones evicted
+    refs = _live_references()
+    for key, (used, _) in list(datasets.items()):
+        if key != keep and used < now - DATASET_TTL and not refs.get(key):
+            _evict(key, "expired")
+            del datasets[key]
+
+
+def _enforce_quotas(owner_id, keep):
+    # Called with the registry lock held; returns (key, reason) of the
+    # datasets removed to make room, leaving out expired ones
+    now = time.time()
+    datasets, owners = _scan(now)
+    _expire(datasets, now, keep)
+
+    evicted = []
+    # Least recently used first
+    mine = sorted((used, size, key) for key, (used, size) in datasets.items() if owner_id in owners.get(key, ()))
+    total_mine = sum(size for _, size, _ in mine)
+    for _, size, key in mine:
+        if total_mine <= DATASET_USER_BYTES:
+            break
+        if key == keep:
+            continue
+        owners[key].discard(owner_id)
+        _remove(_owner_path(key, owner_id))
+        total_mine -= size
+        if not owners[key]:
+            _evict(key, "user_quota")
+            del datasets[key]
+            evicted.append((key, "user_quota"))
+
+    everything = sorted((used, size, key) for key, (used, size) in datasets.items())
+    total = sum(size for _, size, _ in everything)
+    for _, size, key in everything:
+        if total <= DATASET_TOTAL_BYTES:
+            break
+        if key == keep:
+            continue
+        _evict(key, "total_quota")
+        total -= size
+        evicted.append((key, "total_quota"))
+    return evicted
+
+
+def prune():
+    """Delete datasets unused for DATASET_TTL that no worker holds, and old tombstones."""
+    _release_idle()
+    if not os.path.isdir(DATASET_DIR):
+        return
+    with _RegistryLock():
+        now = time.time()
+        datasets, _ = _scan(now)
+        _expire(datasets, now)
+
+
+def start_pruning():
+    """Call prune() every few minutes in a background thread.
+
+    register_dataset() also prunes, but without new joins nothing else would.
+    Start it once per worker, after fork.
+    """
+    def run():
+        while True:
+            time.sleep(_PRUNE_SECONDS)
+            try:
+                prune()
+            except Exception as e:
+                print(f"Pruning joined datasets failed: {e}")
+
+    threading.Thread(target=run, name="dataset-prune", daemon=True).start()
+
+
+def eviction_reason(reason):
+    """Sentence for the user explaining an eviction reason, such as "user_quota"."""
+    return EVICTION_REASONS.get(reason, "it was removed").format(
+        ttl=f"{DATASET_TTL // 3600} hours", user_quota=_megabytes(DATASET_USER_BYTES),
+        total_quota=_megabytes(DATASET_TOTAL_BYTES))
+
+
+def status(key):
+    """Whether a dataset can be loaded: {"state": "available" | "evicted" | "unknown", ...}.
+
+    Evicted datasets also carry "reason" (a sentence for the user) and "at".
+    """
+    if not isinstance(key, str) or not _KEY.fullmatch(key):
+        return {"state": "unknown"}
+    if os.path.exists(_path(key)):
+        return {"state": "available"}
+    try:
+        with open(_tombstone_path(key)) as f:
+            tombstone = json.load(f)
+    except (OSError, ValueError):
+        return {"state": "unknown"}
+    return {"state": "evicted", "reason": eviction_reason(tombstone.get("reason")), "at": tombstone.get("at")}
+
+
+def stats():
+    """Stored datasets, their total size and quotas, and what this process holds mapped."""
+    files = sizes = 0
+    for entry in os.scandir(DATASET_DIR) if os.path.isdir(DATASET_DIR) else ():
+        if entry.name.endswith(_SUFFIX):
+            try:
+                sizes += entry.stat().st_size
+                files += 1
+            except OSError:
+                continue
+    with _lock:
+        attached = dict(_counts, datasets=len(_attached), bytes=_attached_bytes, max_bytes=DATASET_ATTACH_BYTES)
+    return {"directory": DATASET_DIR, "datasets": files, "bytes": sizes, "attached_here": attached,
+            "held_by_workers": len(_live_references()) if files else 0,
+            "user_quota_bytes": DATASET_USER_BYTES, "total_quota_bytes": DATASET_TOTAL_BYTES}
@@ -0,0 +1,33 @@
+import os
+import tempfile
+import pandas as pd
+from dash import dcc
+from database import fetch_iter
+
+# Rows fetched and written per chunk when exporting to CSV
+EXPORT_CHUNK_ROWS = int(os.getenv("EXPORT_CHUNK_ROWS", "50000"))
+
+
+def send_query_csv(query, filename, columns=None, params=None):
+    """Stream a query into a CSV download one chunk at a time.
+
+    Chunks are appended to a temporary file, so the full result is never held
+    as a DataFrame. columns gives the header to write when the query returns
+    no rows; without it an empty result returns None.
+    """
+    with tempfile.NamedTemporaryFile("w", suffix=".csv", newline="", delete=False) as f:
+        path = f.name
+    try:
+        header = True
+        with open(path, "w", newline="") as f:
+            for chunk in fetch_iter(query, params, chunk_rows=EXPORT_CHUNK_ROWS):
+                chunk.to_csv(f, header=header, index=False)
+                header = False
+            if header and columns:
+                pd.DataFrame(columns=columns).to_csv(f, index=False)
+
+        if header and not columns:
+            return None
+        return dcc.send_file(path, filename=filename)
+    finally:
+        os.remove(path)
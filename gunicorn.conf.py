@@ -0,0 +1,58 @@
+"""Production server settings.
+
+    gunicorn -c gunicorn.conf.py
+
+Every setting can be changed through the environment or .env, see the README.
+"""
+import os
+# Imported by name: gunicorn reads every global here, and "config" is one of its settings
+from config import load
+
+load()
+
+wsgi_app = "app:server"
+bind = os.getenv("WEB_BIND", "0.0.0.0:8050")
+
+# Callbacks are mostly pandas and scikit-learn work that holds the GIL, so
+# processes give the parallelism and threads cover requests waiting on SQL
+workers = int(os.getenv("WEB_WORKERS", str(os.cpu_count() or 1)))
+threads = int(os.getenv("WEB_THREADS", "4"))
+worker_class = "gthread"
+
+# Large joins and downloads can take a while on SQL Server
+timeout = int(os.getenv("WEB_TIMEOUT", "120"))
+graceful_timeout = int(os.getenv("WEB_GRACEFUL_TIMEOUT", "30"))
+keepalive = int(os.getenv("WEB_KEEPALIVE", "5"))
+
+# Restart a worker after this many requests to return memory held by pandas; 0 never restarts
+max_requests = int(os.getenv("WEB_MAX_REQUESTS", "1000"))
+max_requests_jitter = int(os.getenv("WEB_MAX_REQUESTS_JITTER", "100"))
+
+# Import the app once in the master so workers share its memory and start fast
+preload_app = os.getenv("WEB_PRELOAD", "true").lower() in ("1", "true", "yes")
+
+accesslog = os.getenv("WEB_ACCESS_LOG", "-") or None
+errorlog = "-"
+
+if workers > 1 and os.getenv("DB_BACKEND", "mssql").lower() == "duckdb":
+    # A DuckDB file can only be shared between processes read-only
+    os.environ.setdefault("DB_OFFLINE_READ_ONLY", "true")
+
+
+def post_fork(server, worker):
+    # Pooled connections and DuckDB handles created in the master must not be
+    # shared with the workers; each worker opens its own on first use
+    import database
+    import dataset_store
+    import mirror
+    import site_index
+
+    database.dispose_engines(close=False)
+    mirror.after_fork()
+    # Start filling the local mirror when it is enabled; the sync lock makes
+    # one worker copy each table while the others skip it
+    mirror.warm()
+    # Each worker loads the map's sites before its first visitor clicks one
+    site_index.warm()
+    # Expired joined datasets are removed even when nobody registers a new one
+    dataset_store.start_pruning()
@@ -0,0 +1,210 @@
+import os
+import sys
+import json
+import time
+import bisect
+import logging
+import threading
+from collections import deque
+import config
+import slow_log
+from query import query_id
+
+# Load environment variables
+config.load()
+
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "true").lower() in ("1", "true", "yes")
+# Where one JSON line per query is written: a file path, "-" for stderr, empty to disable
+QUERY_LOG = os.getenv("QUERY_LOG", "-")
+# Recent durations kept per callback for the p50/p95/p99 estimates
+METRICS_WINDOW = int(os.getenv("METRICS_WINDOW", "1024"))
+# Bearer token that lets a scraper read /metrics, /metrics.json and /cache-stats
+# without a session; empty allows only admins (see slow_log.is_admin)
+METRICS_TOKEN = os.getenv("METRICS_TOKEN", "")
+
+# Upper bounds in seconds of the query duration histogram buckets
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+QUANTILES = (0.5, 0.95, 0.99)
+
+# (callback, credentials, source) -> counters and bucket counts
+_series = {}
+# callback -> recent durations
+_windows = {}
+_lock = threading.Lock()
+
+_log = logging.getLogger("sork.queries")
+_log.propagate = False
+if QUERY_LOG:
+    _handler = logging.StreamHandler(sys.stderr) if QUERY_LOG == "-" else logging.FileHandler(QUERY_LOG)
+    _handler.setFormatter(logging.Formatter("%(message)s"))
+    _log.addHandler(_handler)
+    _log.setLevel(logging.INFO)
+
+
+def current_callback():
+    """Output id of the Dash callback being served, or where the query came from."""
+    try:
+        from flask import has_request_context, request
+    except ImportError:
+        return "background"
+    if not has_request_context():
+        return "background"
+    if request.path.endswith("_dash-update-component"):
+        body = request.get_json(silent=True) or {}
+        return body.get("output", "unknown")
+    return request.path
+
+
+def result_size(result):
+    """Rows and approximate in-memory bytes of a DataFrame or Arrow table/batch."""
+    if result is None:
+        return 0, 0
+    if hasattr(result, "memory_usage"):
+        return len(result), int(result.memory_usage(index=True).sum())
+    return result.num_rows, int(result.nbytes)
+
+
+def record(query, credentials, source, started, rows=0, nbytes=0, error=None, params=None, seconds=None):
+    """Record one query that began at time.perf_counter() value started.
+
+    source is where the result came from: the database backend ("mssql",
+    "sqlite" or "duckdb"), "mirror" or "cache".
+    seconds, when given, replaces the time elapsed since started.
+    SQL Server queries over the slow-query threshold also go to the slow log.
+    """
+    if seconds is None:
+        seconds = time.perf_counter() - started
+    callback = current_callback()
+    if source == "mssql":
+        slow_log.observe(query, params, credentials, callback, seconds, rows, error)
+    if not METRICS_ENABLED:
+        return
+
+    with _lock:
+        series = _series.get((callback, credentials, source))
+        if series is None:
+            series = _series[(callback, credentials, source)] = {
+                "count": 0, "errors": 0, "seconds": 0.0, "rows": 0, "bytes": 0,
+                "buckets": [0] * len(BUCKETS),
+            }
+        series["count"] += 1
+        series["seconds"] += seconds
+        series["rows"] += rows
+        series["bytes"] += nbytes
+        if error is not None:
+            series["errors"] += 1
+        index = bisect.bisect_left(BUCKETS, seconds)
+        if index < len(BUCKETS):
+            series["buckets"][index] += 1
+
+        window = _windows.get(callback)
+        if window is None:
+            window = _windows[callback] = deque(maxlen=METRICS_WINDOW)
+        window.append(seconds)
+
+    if _log.handlers:
+        _log.info(json.dumps({
+            "ts": time.time(),
+            "callback": callback,
+            "credentials": credentials,
+            "source": source,
+            "seconds": round(seconds, 6),
+            "rows": rows,
+            "bytes": nbytes,
+            "error": None if error is None else str(error),
+            # Parameters are left out, they can hold user-entered values
+            "query_id": query_id(query),
+            "sql": " ".join(query.split())[:500],
+        }))
+
+
+def _quantile(ordered, q):
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def summary():
+    """Per-callback query counts, totals and p50/p95/p99 durations."""
+    with _lock:
+        series = {key: dict(value) for key, value in _series.items()}
+        windows = {callback: sorted(window) for callback, window in _windows.items()}
+
+    result = {}
+    for (callback, credentials, source), value in series.items():
+        entry = result.setdefault(callback, {"queries": 0, "errors": 0, "seconds": 0.0,
+                                             "rows": 0, "bytes": 0, "sources": {}})
+        entry["queries"] += value["count"]
+        entry["errors"] += value["errors"]
+        entry["seconds"] += value["seconds"]
+        entry["rows"] += value["rows"]
+        entry["bytes"] += value["bytes"]
+        source_key = f"{credentials}/{source}"
+        entry["sources"][source_key] = entry["sources"].get(source_key, 0) + value["count"]
+    for callback, entry in result.items():
+        ordered = windows.get(callback)
+        for q in QUANTILES:
+            entry[f"p{int(q * 100)}"] = _quantile(ordered, q) if ordered else None
+    return result
+
+
+def _labels(**labels):
+    def escape(value):
+        return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+    return "{" + ",".join(f'{name}="{escape(value)}"' for name, value in labels.items()) + "}"
+
+
+def prometheus():
+    """Every metric in the Prometheus text exposition format."""
+    with _lock:
+        series = {key: dict(value, buckets=list(value["buckets"])) for key, value in _series.items()}
+        windows = {callback: sorted(window) for callback, window in _windows.items()}
+
+    lines = [
+        "# HELP sork_query_duration_seconds Wall time of database queries.",
+        "# TYPE sork_query_duration_seconds histogram",
+    ]
+    for (callback, credentials, source), value in sorted(series.items()):
+        cumulative = 0
+        for bound, count in zip(BUCKETS, value["buckets"]):
+            cumulative += count
+            labels = _labels(callback=callback, credentials=credentials, source=source, le=bound)
+            lines.append(f"sork_query_duration_seconds_bucket{labels} {cumulative}")
+        labels = _labels(callback=callback, credentials=credentials, source=source, le="+Inf")
+        lines.append(f"sork_query_duration_seconds_bucket{labels} {value['count']}")
+        labels = _labels(callback=callback, credentials=credentials, source=source)
+        lines.append(f"sork_query_duration_seconds_sum{labels} {value['seconds']}")
+        lines.append(f"sork_query_duration_seconds_count{labels} {value['count']}")
+
+    for name, key, help_text in (
+        ("sork_query_rows_total", "rows", "Rows returned by database queries."),
+        ("sork_query_bytes_total", "bytes", "Approximate in-memory bytes returned by database queries."),
+        ("sork_query_errors_total", "errors", "Database queries that failed."),
+    ):
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} counter")
+        for (callback, credentials, source), value in sorted(series.items()):
+            labels = _labels(callback=callback, credentials=credentials, source=source)
+            lines.append(f"{name}{labels} {value[key]}")
+
+    # Quantiles are over the recent window; _sum and _count are totals since
+    # start, which Prometheus expects to only ever grow
+    totals = {}
+    for (callback, _, _), value in series.items():
+        seconds, count = totals.get(callback, (0.0, 0))
+        totals[callback] = (seconds + value["seconds"], count + value["count"])
+    lines.append("# HELP sork_callback_query_seconds Query durations per callback, quantiles over recent queries.")
+    lines.append("# TYPE sork_callback_query_seconds summary")
+    for callback, ordered in sorted(windows.items()):
+        for q in QUANTILES:
+            lines.append(f"sork_callback_query_seconds{_labels(callback=callback, quantile=q)} "
+                         f"{_quantile(ordered, q)}")
+        seconds, count = totals.get(callback, (0.0, 0))
+        lines.append(f"sork_callback_query_seconds_sum{_labels(callback=callback)} {seconds}")
+        lines.append(f"sork_callback_query_seconds_count{_labels(callback=callback)} {count}")
+    return "\n".join(lines) + "\n"
+
+
+def reset():
+    """Forget every recorded query."""
+    with _lock:
+        _series.clear()
+        _windows.clear()
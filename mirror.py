@@ -0,0 +1,281 @@
+import os
+import json
+import time
+import uuid
+import fcntl
+import hashlib
+import tempfile
+import threading
+import config
+import data_versions
+import tsql
+from query import referenced_tables, table_ref
+
+# Load environment variables
+config.load()
+
+# Optional local mirror: each table is copied into Parquet files under
+# MIRROR_DIR and read through an embedded DuckDB instead of SQL Server
+MIRROR_ENABLED = os.getenv("MIRROR_ENABLED", "false").lower() in ("1", "true", "yes")
+MIRROR_DIR = os.getenv("MIRROR_DIR", os.path.join(tempfile.gettempdir(), "sork-mirror"))
+# Seconds before a mirrored table is fully re-synced even if unchanged
+MIRROR_MAX_AGE = int(os.getenv("MIRROR_MAX_AGE", "86400"))
+MIRROR_BATCH_ROWS = int(os.getenv("MIRROR_BATCH_ROWS", "50000"))
+# Parts replaced by a sync are kept this many seconds, since a view or stream
+# planned before the swap may still open them
+_RETIRED_PART_SECONDS = 3600
+
+# Tables mirrored for each credential set. The map table is synced with the
+# public credentials so public reads keep that login's permissions.
+MIRROR_TABLES = {
+    "main": [t for t in os.getenv("TABLE_OPTIONS", "").split(",")
+             + os.getenv("MIRROR_EXTRA_TABLES", "").split(",") if t],
+    "pub": [t for t in [os.getenv("MAP_TABLE")] if t],
+}
+
+_connection = None
+_views = {}          # (credentials, table) -> tuple of Parquet files behind the view
+_syncing = set()     # (credentials, table) pairs with a sync in progress
+_lock = threading.Lock()
+
+
+def _schema(credentials):
+    return f"mirror_{credentials}"
+
+
+def _table_dir(credentials, table):
+    return os.path.join(MIRROR_DIR, credentials, hashlib.sha1(table.encode("utf-8")).hexdigest())
+
+
+def _read_manifest(credentials, table):
+    try:
+        with open(os.path.join(_table_dir(credentials, table), "manifest.json")) as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+def _write_manifest(credentials, table, manifest):
+    directory = _table_dir(credentials, table)
+    tmp = os.path.join(directory, f"manifest.{uuid.uuid4().hex}.tmp")
+    with open(tmp, "w") as f:
+        json.dump(manifest, f)
+    os.replace(tmp, os.path.join(directory, "manifest.json"))
+
+
+def _is_fresh(manifest, table):
+    return (
+        manifest is not None
+        and manifest["version"] == data_versions.table_version(table)
+        and time.time() - manifest["synced_at"] < MIRROR_MAX_AGE
+    )
+
+
+def sync_table(table, credentials="main"):
+    """Copy a table into a fresh set of Parquet files and publish them.
+
+    Does nothing while another process on this host is copying the same table,
+    or once it has published a fresh copy.
+    """
+    directory = _table_dir(credentials, table)
+    os.makedirs(directory, exist_ok=True)
+    with open(os.path.join(directory, ".sync.lock"), "w") as lock:
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return
+        try:
+            if not _is_fresh(_read_manifest(credentials, table), table):
+                _copy_table(table, credentials, directory)
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def _copy_table(table, credentials, directory):
+    import pyarrow.parquet as pq
+    # Imported here because the database layer routes reads through this module
+    from database import fetch_arrow_batches
+
+    # Taken before reading, so an upload during the copy leaves the mirror stale
+    version = data_versions.table_version(table)
+    part = f"part-{uuid.uuid4().hex}.parquet"
+    tmp = os.path.join(directory, part + ".tmp")
+
+    batches = fetch_arrow_batches(f"SELECT * FROM {table_ref(table)}",
+                                  batch_rows=MIRROR_BATCH_ROWS, credentials=credentials)
+    with pq.ParquetWriter(tmp, next(batches)) as writer:
+        for batch in batches:
+            writer.write_batch(batch)
+    os.replace(tmp, os.path.join(directory, part))
+
+    # Every other part, listed in the old manifest or left over, is retired
+    # now and deleted by a sync that runs once it is old enough
+    now = time.time()
+    retired = dict((_read_manifest(credentials, table) or {}).get("retired", []))
+    for name in os.listdir(directory):
+        if name.startswith("part-") and name.endswith(".parquet") and name != part:
+            retired.setdefault(name, now)
+    expired = [name for name, at in retired.items() if now - at >= _RETIRED_PART_SECONDS]
+    _write_manifest(credentials, table, {
+        "table": table,
+        "version": version,
+        "synced_at": now,
+        "parts": [part],
+        "retired": [[name, at] for name, at in retired.items() if name not in expired],
+    })
+
+    for name in expired:
+        try:
+            os.remove(os.path.join(directory, name))
+        except FileNotFoundError:
+            pass
+
+
+def append_rows(table, df):
+    """Add rows uploaded through the dashboard as a new Parquet part.
+
+    Call after data_versions.bump(). If the rows cannot be appended the
+    mirror is dropped and re-synced on next use.
+    """
+    if not MIRROR_ENABLED:
+        return
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    for credentials, tables in MIRROR_TABLES.items():
+        if table not in tables:
+            continue
+        directory = _table_dir(credentials, table)
+        manifest = _read_manifest(credentials, table)
+        if manifest is None:
+            continue
+        try:
+            schema = pq.read_schema(os.path.join(directory, manifest["parts"][0]))
+            rows = pa.Table.from_pandas(df, preserve_index=False).select(schema.names).cast(schema)
+            part = f"part-{uuid.uuid4().hex}.parquet"
+            pq.write_table(rows, os.path.join(directory, part))
+            manifest["parts"].append(part)
+            manifest["version"] = data_versions.table_version(table)
+            _write_manifest(credentials, table, manifest)
+        except Exception as e:
+            print(f"Mirror append failed for {table}, re-syncing: {e}")
+            os.remove(os.path.join(directory, "manifest.json"))
+            _sync_in_background(table, credentials)
+
+
+def _sync_in_background(table, credentials):
+    key = (credentials, table)
+    with _lock:
+        if key in _syncing:
+            return
+        _syncing.add(key)
+
+    def run():
+        try:
+            sync_table(table, credentials)
+        except Exception as e:
+            print(f"Mirror sync failed for {table}: {e}")
+        finally:
+            with _lock:
+                _syncing.discard(key)
+
+    threading.Thread(target=run, name=f"mirror-sync-{table}", daemon=True).start()
+
+
+def warm():
+    """Start background syncs for every configured table that is missing or stale."""
+    if not MIRROR_ENABLED:
+        return
+    for credentials, tables in MIRROR_TABLES.items():
+        for table in tables:
+            if not _is_fresh(_read_manifest(credentials, table), table):
+                _sync_in_background(table, credentials)
+
+
+def after_fork():
+    """Drop state inherited from the parent process in a new worker.
+
+    DuckDB connections cannot be used across fork, and syncs running in the
+    parent never finish in the child, so both are forgotten here.
+    """
+    global _connection, _views, _syncing, _lock
+    _connection = None
+    _views = {}
+    _syncing = set()
+    _lock = threading.Lock()
+
+
+def _cursor():
+    global _connection
+    import duckdb
+
+    with _lock:
+        if _connection is None:
+            _connection = duckdb.connect()
+            for credentials in MIRROR_TABLES:
+                _connection.execute(f"CREATE SCHEMA IF NOT EXISTS {tsql.quote(_schema(credentials))}")
+        return _connection.cursor()
+
+
+def _ensure_view(cursor, credentials, table, manifest):
+    directory = _table_dir(credentials, table)
+    files = tuple(os.path.join(directory, name) for name in manifest["parts"])
+    if _views.get((credentials, table)) == files:
+        return
+    file_list = ", ".join("'" + f.replace("'", "''") + "'" for f in files)
+    cursor.execute(
+        f"CREATE OR REPLACE VIEW {tsql.quote(_schema(credentials))}.{tsql.quote(table)} AS "
+        f"SELECT * FROM read_parquet([{file_list}], union_by_name = true)"
+    )
+    _views[(credentials, table)] = files
+
+
+def _prepare(query, credentials):
+    # Returns a cursor with views for every table the query reads, or None when
+    # any of them is not mirrored or out of date (a re-sync is then started)
+    if not MIRROR_ENABLED or credentials not in MIRROR_TABLES:
+        return None
+    tables = referenced_tables(query)
+    if not tables or not tables.issubset(MIRROR_TABLES[credentials]):
+        return None
+
+    manifests = {}
+    for table in tables:
+        manifest = _read_manifest(credentials, table)
+        if not _is_fresh(manifest, table):
+            _sync_in_background(table, credentials)
+            return None
+        manifests[table] = manifest
+
+    cursor = _cursor()
+    with _lock:
+        for table, manifest in manifests.items():
+            _ensure_view(cursor, credentials, table, manifest)
+    return cursor
+
+
+def _execute(query, params, credentials):
+    cursor = _prepare(query, credentials)
+    if cursor is None:
+        return None
+    try:
+        return cursor.execute(tsql.translate(query, "duckdb", _schema(credentials)), params or {})
+    except Exception as e:
+        print(f"Mirror query failed, using SQL Server: {e}")
+        return None
+
+
+def fetch(query, params=None, credentials="main", as_arrow=False):
+    """Answer a query from the mirror, or return None if it cannot."""
+    result = _execute(query, params, credentials)
+    if result is None:
+        return None
+    return result.arrow() if as_arrow else result.df()
+
+
+def fetch_iter(query, params=None, chunk_rows=None, credentials="main"):
+    """Record batch reader over the mirror's answer to a query, or None if it cannot."""
+    result = _execute(query, params, credentials)
+    if result is None:
+        return None
+    return result.fetch_record_batch(chunk_rows or MIRROR_BATCH_ROWS)
@@ -0,0 +1,135 @@
+import os
+import glob
+import uuid
+import sqlite3
+import tempfile
+import threading
+import pandas as pd
+import config
+from sqlalchemy import create_engine, event
+from sqlalchemy.pool import QueuePool
+import tsql
+
+# Load environment variables
+config.load()
+
+# Local stand-ins for SQL Server, used when DB_BACKEND is sqlite or duckdb.
+# Every CSV or Parquet file in DB_FIXTURE_DIR becomes a dbo table named after
+# the file, so the tabs' queries run unchanged once translated by tsql.
+BACKENDS = ("sqlite", "duckdb")
+DB_FIXTURE_DIR = os.getenv("DB_FIXTURE_DIR", "fixtures")
+# Rebuild the local database from the fixtures at startup even if it exists
+DB_FIXTURE_RESEED = os.getenv("DB_FIXTURE_RESEED", "false").lower() in ("1", "true", "yes")
+# DuckDB lets one process hold a database file for writing; several server
+# workers can share it only when they all open it read-only
+DB_OFFLINE_READ_ONLY = os.getenv("DB_OFFLINE_READ_ONLY", "false").lower() in ("1", "true", "yes")
+# Rows read from a CSV fixture at a time while seeding SQLite
+SEED_CHUNK_ROWS = 50000
+
+_seeded = set()
+_lock = threading.Lock()
+
+
+def database_path(backend):
+    """Location of the local database file for a backend."""
+    return os.getenv("DB_OFFLINE_PATH") or os.path.join(tempfile.gettempdir(), f"sork-offline.{backend}")
+
+
+def fixture_files(fixture_dir=None):
+    """Table name -> fixture file for every CSV or Parquet file in the fixture directory."""
+    fixture_dir = fixture_dir or DB_FIXTURE_DIR
+    files = {}
+    for path in sorted(glob.glob(os.path.join(fixture_dir, "*.csv")) + glob.glob(os.path.join(fixture_dir, "*.parquet"))):
+        files[os.path.splitext(os.path.basename(path))[0]] = path
+    return files
+
+
+def _seed_sqlite(path, files):
+    connection = sqlite3.connect(path)
+    try:
+        for table, source in files.items():
+            if source.endswith(".parquet"):
+                chunks = [pd.read_parquet(source)]
+            else:
+                chunks = pd.read_csv(source, chunksize=SEED_CHUNK_ROWS)
+            for i, chunk in enumerate(chunks):
+                chunk.to_sql(table, connection, if_exists="replace" if i == 0 else "append", index=False)
+        connection.commit()
+    finally:
+        connection.close()
+
+
+def _seed_duckdb(path, files):
+    import duckdb
+
+    connection = duckdb.connect(path)
+    try:
+        connection.execute("CREATE SCHEMA IF NOT EXISTS dbo")
+        for table, source in files.items():
+            reader = "read_parquet" if source.endswith(".parquet") else "read_csv_auto"
+            literal = "'" + source.replace("'", "''") + "'"
+            connection.execute(
+                f"CREATE OR REPLACE TABLE dbo.{tsql.quote(table)} AS SELECT * FROM {reader}({literal})")
+    finally:
+        connection.close()
+
+
+def seed(backend, fixture_dir=None, path=None):
+    """Build the local database for a backend from the fixture files.
+
+    The new file replaces the old one only once it is complete, so other
+    workers never open a half-seeded database. Returns the tables created.
+    """
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown offline backend: {backend}")
+    files = fixture_files(fixture_dir)
+    if not files:
+        raise ValueError(f"No CSV or Parquet fixtures in {fixture_dir or DB_FIXTURE_DIR}")
+
+    path = path or database_path(backend)
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp = f"{path}.{uuid.uuid4().hex}.tmp"
+    try:
+        if backend == "sqlite":
+            _seed_sqlite(tmp, files)
+        else:
+            _seed_duckdb(tmp, files)
+        os.replace(tmp, path)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+    return list(files)
+
+
+def _ensure_seeded(backend):
+    with _lock:
+        if backend in _seeded:
+            return
+        if DB_FIXTURE_RESEED or not os.path.exists(database_path(backend)):
+            seed(backend)
+        _seeded.add(backend)
+
+
+def engine(backend, **pool_settings):
+    """Pooled SQLAlchemy engine for a local backend, seeding it on first use.
+
+    SQLite has no schemas, so the database file is attached as "dbo" to each
+    connection and [dbo].[table] references resolve as they do on SQL Server.
+    """
+    _ensure_seeded(backend)
+    path = database_path(backend)
+
+    if backend == "duckdb":
+        return create_engine(f"duckdb:///{path}", poolclass=QueuePool,
+                             connect_args={"read_only": DB_OFFLINE_READ_ONLY}, **pool_settings)
+
+    sqlite_engine = create_engine(
+        "sqlite://", poolclass=QueuePool,
+        connect_args={"check_same_thread": False}, **pool_settings
+    )
+
+    @event.listens_for(sqlite_engine, "connect")
+    def attach(dbapi_connection, connection_record):
+        dbapi_connection.execute("ATTACH DATABASE ? AS dbo", (path,))
+
+    return sqlite_engine
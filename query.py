@@ -0,0 +1,73 @@
+import re
+import hashlib
+
+# SQL Server limits identifiers to 128 characters
+MAX_IDENTIFIER_LENGTH = 128
+
+JOIN_TYPES = {"inner": "INNER", "left": "LEFT", "right": "RIGHT", "full": "FULL"}
+
+_BIND = re.compile(r"(?<![:\w\\]):(\w+)")
+_DBO_TABLE = re.compile(r"\[dbo\]\.\[((?:[^\]]|\]\])+)\]")
+
+
+def quote_ident(name):
+    """Quote a table, column or alias name as a bracketed T-SQL identifier.
+
+    Colons are escaped so SQLAlchemy does not read them as bind parameters.
+    """
+    if not isinstance(name, str) or not name or len(name) > MAX_IDENTIFIER_LENGTH:
+        raise ValueError(f"Invalid identifier: {name!r}")
+    if any(ord(c) < 32 for c in name):
+        raise ValueError(f"Invalid identifier: {name!r}")
+    return "[" + name.replace("]", "]]").replace(":", "\\:") + "]"
+
+
+def table_ref(table, schema="dbo"):
+    """Schema-qualified, quoted table name."""
+    return f"{quote_ident(schema)}.{quote_ident(table)}"
+
+
+def referenced_tables(sql):
+    """Names of the dbo tables a query built with table_ref() reads."""
+    return {m.replace("]]", "]").replace("\\:", ":") for m in _DBO_TABLE.findall(sql)}
+
+
+def query_id(sql):
+    """Short stable id for a query's text, ignoring whitespace and parameter values."""
+    return hashlib.sha1(" ".join(sql.split()).encode("utf-8")).hexdigest()[:12]
+
+
+def column_ref(column, alias=None):
+    """Quoted column name, optionally qualified by a table alias."""
+    if alias is None:
+        return quote_ident(column)
+    return f"{alias}.{quote_ident(column)}"
+
+
+def column_list(columns, alias=None):
+    """Comma separated list of quoted columns."""
+    return ", ".join(column_ref(c, alias) for c in columns)
+
+
+def join_keyword(join_type):
+    """Validated keyword for a join type chosen in the UI."""
+    if join_type not in JOIN_TYPES:
+        raise ValueError(f"Invalid join type: {join_type!r}")
+    return JOIN_TYPES[join_type]
+
+
+def _literal(value):
+    if value is None:
+        return "NULL"
+    if isinstance(value, bool):
+        return "1" if value else "0"
+    if isinstance(value, (int, float)):
+        return repr(value)
+    return "'" + str(value).replace("'", "''") + "'"
+
+
+def render(sql, params=None):
+    """Inline bound parameters as literals. For display and logs only."""
+    if params:
+        sql = _BIND.sub(lambda m: _literal(params[m.group(1)]) if m.group(1) in params else m.group(0), sql)
+    return sql.replace("\\:", ":")
@@ -0,0 +1,99 @@
+import os
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+import config
+import data_versions
+from query import referenced_tables
+
+# Load environment variables
+config.load()
+
+# Off by default unless change tracking is on: uploads are the only other thing
+# that bumps a table's data version, so changes made elsewhere would go unseen
+RESULT_CACHE_ENABLED = os.getenv(
+    "RESULT_CACHE_ENABLED", "true" if data_versions.USE_CHANGE_TRACKING else "false").lower() in ("1", "true", "yes")
+RESULT_CACHE_MAX_ENTRIES = int(os.getenv("RESULT_CACHE_MAX_ENTRIES", "256"))
+RESULT_CACHE_TTL = int(os.getenv("RESULT_CACHE_TTL", "3600"))
+# Results larger than this are returned but never cached
+RESULT_CACHE_MAX_ENTRY_BYTES = int(os.getenv("RESULT_CACHE_MAX_ENTRY_BYTES", str(64 * 1024 * 1024)))
+
+# key -> (stored_at, DataFrame)
+_entries = OrderedDict()
+_lock = threading.Lock()
+_stats = {"hits": 0, "misses": 0, "stores": 0, "evictions": 0, "uncacheable": 0}
+
+
+def fingerprint(query, params=None, credentials="main"):
+    """Stable key for a query: normalized SQL text, parameters and credential set."""
+    normalized = " ".join(query.split())
+    bound = repr(sorted((params or {}).items()))
+    return hashlib.sha256(f"{credentials}\n{normalized}\n{bound}".encode("utf-8")).hexdigest()
+
+
+def _count(name):
+    with _lock:
+        _stats[name] += 1
+
+
+def get_or_fetch(query, params, credentials, fetch):
+    """Return a cached result for the query, or run fetch() and cache its result.
+
+    Only queries that read dbo tables are cached, and none while change
+    tracking is on but unavailable. The key includes the data version of every
+    referenced table, so results are never served after one of those tables
+    changed, as far as data_versions can tell.
+    """
+    tables = referenced_tables(query)
+    if not RESULT_CACHE_ENABLED or not tables:
+        return fetch()
+    # Change tracking was asked for but the database gives no version, so
+    # changes made outside the dashboard would go unseen
+    if data_versions.USE_CHANGE_TRACKING and not data_versions.change_tracking_available():
+        return fetch()
+
+    key = hashlib.sha256(
+        (fingerprint(query, params, credentials) + repr(data_versions.table_versions(tables))).encode("utf-8")
+    ).hexdigest()
+
+    with _lock:
+        entry = _entries.get(key)
+        if entry is not None and time.monotonic() - entry[0] < RESULT_CACHE_TTL:
+            _entries.move_to_end(key)
+            _stats["hits"] += 1
+            # Shallow copy so callers cannot rename or add columns on the cached frame
+            return entry[1].copy(deep=False)
+        _stats["misses"] += 1
+
+    df = fetch()
+    if df is None:
+        return df
+    if df.memory_usage(index=True).sum() > RESULT_CACHE_MAX_ENTRY_BYTES:
+        _count("uncacheable")
+        return df
+
+    with _lock:
+        _entries[key] = (time.monotonic(), df)
+        _entries.move_to_end(key)
+        _stats["stores"] += 1
+        while len(_entries) > RESULT_CACHE_MAX_ENTRIES:
+            _entries.popitem(last=False)
+            _stats["evictions"] += 1
+    return df.copy(deep=False)
+
+
+def clear():
+    """Drop every cached result."""
+    with _lock:
+        _entries.clear()
+
+
+def stats():
+    """Hit, miss, store and eviction counters for this process."""
+    with _lock:
+        result = dict(_stats)
+        result["entries"] = len(_entries)
+    lookups = result["hits"] + result["misses"]
+    result["hit_ratio"] = result["hits"] / lookups if lookups else 0.0
+    return result
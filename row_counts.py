@@ -0,0 +1,64 @@
+import os
+import time
+import threading
+import pandas as pd
+import config
+from database import DB_BACKEND, fetch_uncached
+from query import table_ref
+
+# Load environment variables
+config.load()
+
+# Seconds a row count is reused before it is read again
+ROW_COUNT_TTL = int(os.getenv("ROW_COUNT_TTL", "300"))
+
+# table -> (loaded_at, row count)
+_counts = {}
+_lock = threading.Lock()
+
+
+def _metadata_count(table):
+    if DB_BACKEND != "mssql":
+        return None
+    # Heap (0) or clustered index (1) partitions hold every row exactly once
+    # Uncached: this module keeps its own cache, which invalidate() clears
+    df = fetch_uncached("""
+        SELECT SUM(row_count) AS row_count
+        FROM sys.dm_db_partition_stats
+        WHERE object_id = OBJECT_ID(:object_name) AND index_id IN (0, 1)
+    """, {"object_name": "[dbo].[" + table.replace("]", "]]") + "]"})
+    if df is None or df.empty or pd.isna(df.iloc[0]['row_count']):
+        return None
+    return int(df.iloc[0]['row_count'])
+
+
+def _exact_count(table):
+    df = fetch_uncached(f"SELECT COUNT_BIG(*) AS row_count FROM {table_ref(table)}")
+    if df is None or df.empty:
+        raise RuntimeError(f"Could not count rows in {table}.")
+    return int(df.iloc[0]['row_count'])
+
+
+def get_row_count(table, exact=False):
+    """Number of rows in a table, read from partition metadata when possible."""
+    entry = _counts.get(table)
+    if not exact and entry is not None and time.monotonic() - entry[0] < ROW_COUNT_TTL:
+        return entry[1]
+
+    count = None if exact else _metadata_count(table)
+    if count is None:
+        # No VIEW DATABASE STATE permission or not a base table
+        count = _exact_count(table)
+
+    with _lock:
+        _counts[table] = (time.monotonic(), count)
+    return count
+
+
+def invalidate(table=None):
+    """Forget the cached count for a table, or for every table."""
+    with _lock:
+        if table is None:
+            _counts.clear()
+        else:
+            _counts.pop(table, None)
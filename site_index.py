@@ -0,0 +1,245 @@
+import os
+import time
+import threading
+import config
+import catalog
+import data_versions
+from database import fetch_data_from_sql_pub
+from query import table_ref, column_list
+
+# Load environment variables
+config.load()
+
+MAP_TABLE = os.getenv("MAP_TABLE")
+SITE_INDEX_TTL = int(os.getenv("SITE_INDEX_TTL", "300"))
+
+# One row per tree site of MAP_TABLE: its name, mean position and number of
+# trees, from a single GROUP BY. Each worker keeps the index until the table's
+# data version changes, along with anything built from it (see derived()),
+# such as the rows of the table split by site for the map's click details.
+# Changes the data version does not see are picked up after SITE_INDEX_TTL:
+# the index and everything built from it are then reloaded in the background
+# while callers keep getting the current values.
+
+# table -> {"version": ..., "loaded_at": ..., "sites": DataFrame,
+#           "derived": {name: value}, "builders": {name: build}}
+_indexes = {}
+# table -> {name: (version, value, loaded_at of the index it was built from)},
+# kept across versions (see snapshot())
+_snapshots = {}
+_refreshing = set()
+# Guards the dictionaries above; never held while querying the database
+_lock = threading.Lock()
+# table -> lock held while loading its index, so one caller loads it while the
+# others wait, without blocking readers of other tables or of snapshots
+_build_locks = {}
+# Index a background reload is filling, returned to derived() calls on that thread
+_reloading = threading.local()
+
+
+def _load(table):
+    df = fetch_data_from_sql_pub(f"""
+        SELECT locality_full_name, AVG(Latitude) AS latitude, AVG(Longitude) AS longitude, COUNT(*) AS trees
+        FROM {table_ref(table)}
+        WHERE locality_full_name IS NOT NULL
+        GROUP BY locality_full_name
+        ORDER BY locality_full_name
+    """)
+    if df is None:
+        raise RuntimeError(f"Could not load the tree sites in {table}.")
+    # Sites without any coordinates cannot be placed on the map
+    return df.dropna(subset=["latitude", "longitude"]).reset_index(drop=True)
+
+
+def _new_entry(table, version):
+    return {"version": version, "loaded_at": time.monotonic(), "sites": _load(table), "derived": {}, "builders": {}}
+
+
+def _entry(table):
+    pending = getattr(_reloading, "entries", {}).get(table)
+    if pending is not None:
+        return pending
+    version = data_versions.table_version(table)
+    entry = _indexes.get(table)
+    if entry is not None and entry["version"] == version:
+        if time.monotonic() - entry["loaded_at"] >= SITE_INDEX_TTL:
+            _reload_in_background(table)
+        return entry
+    with _lock:
+        build_lock = _build_locks.setdefault(table, threading.Lock())
+    with build_lock:
+        entry = _indexes.get(table)
+        if entry is None or entry["version"] != version:
+            entry = _new_entry(table, version)
+            with _lock:
+                _indexes[table] = entry
+        return entry
+
+
+def _reload(table, old):
+    # Rebuild everything built from the old index before swapping it in, so
+    # no caller waits on the reload
+    entry = _new_entry(table, data_versions.table_version(table))
+    _reloading.entries = {table: entry}
+    try:
+        for name, build in list(old["builders"].items()):
+            _derived(entry, name, build)
+    finally:
+        _reloading.entries = {}
+    with _lock:
+        # A rebuild for a new data version may have replaced it meanwhile
+        if _indexes.get(table) is old:
+            _indexes[table] = entry
+
+
+def _reload_in_background(table):
+    key = (table, None)
+    with _lock:
+        old = _indexes.get(table)
+        if old is None or key in _refreshing:
+            return
+        _refreshing.add(key)
+
+    def run():
+        try:
+            _reload(table, old)
+        except Exception as e:
+            print(f"Reloading the site index for {table} failed: {e}")
+            # Keep the current index for another SITE_INDEX_TTL before retrying
+            old["loaded_at"] = time.monotonic()
+        finally:
+            with _lock:
+                _refreshing.discard(key)
+
+    threading.Thread(target=run, name=f"site-index-{table}", daemon=True).start()
+
+
+def get_sites(table=None):
+    """Tree sites as a DataFrame with locality_full_name, latitude, longitude and trees.
+
+    Shared by every caller; do not modify it.
+    """
+    return _entry(table or MAP_TABLE)["sites"]
+
+
+def _derived(entry, name, build):
+    value = entry["derived"].get(name)
+    if value is None:
+        value = build(entry["sites"])
+        with _lock:
+            entry["derived"].setdefault(name, value)
+            entry["builders"].setdefault(name, build)
+            value = entry["derived"][name]
+    return value
+
+
+def derived(name, build, table=None):
+    """build(sites), computed once per load of the site index and cached under name."""
+    return _derived(_entry(table or MAP_TABLE), name, build)
+
+
+def _refresh(table, name, build):
+    entry = _entry(table)
+    value = _derived(entry, name, build)
+    with _lock:
+        _snapshots.setdefault(table, {})[name] = (entry["version"], value, entry["loaded_at"])
+    return entry["version"], value
+
+
+def _refresh_in_background(table, name, build):
+    key = (table, name)
+    with _lock:
+        if key in _refreshing:
+            return
+        _refreshing.add(key)
+
+    def run():
+        try:
+            _refresh(table, name, build)
+        except Exception as e:
+            print(f"Refreshing {name} for {table} failed: {e}")
+        finally:
+            with _lock:
+                _refreshing.discard(key)
+
+    threading.Thread(target=run, name=f"site-index-{name}", daemon=True).start()
+
+
+def snapshot(name, build, table=None):
+    """(version, build(sites)) without waiting for a rebuild.
+
+    Like derived(), but once the table's version changes or the index is
+    older than SITE_INDEX_TTL the previous value keeps being returned while a
+    background thread builds the new one. Only the very first call waits.
+    """
+    table = table or MAP_TABLE
+    current = _snapshots.get(table, {}).get(name)
+    if current is None:
+        return _refresh(table, name, build)
+    version, value, loaded_at = current
+    entry = _indexes.get(table)
+    if entry is not None and time.monotonic() - entry["loaded_at"] >= SITE_INDEX_TTL:
+        _reload_in_background(table)
+    if entry is None or entry["loaded_at"] != loaded_at or version != data_versions.table_version(table):
+        _refresh_in_background(table, name, build)
+    return version, value
+
+
+def _load_tree_rows(table):
+    # One query for the whole table
+    columns = [c for c in catalog.get_columns(table, credentials="pub") if c != 'Accession']
+    df = fetch_data_from_sql_pub(f"SELECT {column_list(columns)} FROM {table_ref(table)} WHERE locality_full_name IS NOT NULL")
+    if df is None:
+        raise RuntimeError(f"Could not load the trees in {table}.")
+    return df
+
+
+def get_tree_rows(table=None):
+    """Every row of the table with a site, without Accession.
+
+    Shared by every caller; do not modify it.
+    """
+    table = table or MAP_TABLE
+    return derived("tree_rows", lambda sites: _load_tree_rows(table), table)
+
+
+def _partition(df):
+    partitions = {name: rows.reset_index(drop=True) for name, rows in df.groupby("locality_full_name", sort=False)}
+    return df.iloc[0:0], partitions
+
+
+def get_trees(locality, table=None):
+    """Rows of the table at one site, without Accession; empty for an unknown site.
+
+    The first call loads every site at once, later ones are a dictionary lookup.
+    Shared by every caller; do not modify the result.
+    """
+    table = table or MAP_TABLE
+    empty, partitions = derived("trees", lambda sites: _partition(get_tree_rows(table)), table)
+    return partitions.get(locality, empty)
+
+
+def warm(table=None):
+    """Load the site index and tree details in a background thread."""
+    table = table or MAP_TABLE
+    if not table:
+        return
+
+    def run():
+        try:
+            get_trees(None, table)
+        except Exception as e:
+            print(f"Warming the site index for {table} failed: {e}")
+
+    threading.Thread(target=run, name=f"site-index-{table}", daemon=True).start()
+
+
+def invalidate(table=None):
+    """Forget the cached index for a table, or for every table."""
+    with _lock:
+        if table is None:
+            _indexes.clear()
+            _snapshots.clear()
+        else:
+            _indexes.pop(table, None)
+            _snapshots.pop(table, None)
@@ -0,0 +1,251 @@
+import os
+import re
+import json
+import time
+import heapq
+import queue
+import tempfile
+import threading
+import logging
+import logging.handlers
+import xml.etree.ElementTree as ET
+import config
+from query import query_id
+
+# Load environment variables
+config.load()
+
+# SQL Server queries slower than this many seconds are logged; 0 disables the log
+SLOW_QUERY_SECONDS = float(os.getenv("SLOW_QUERY_SECONDS", "1.0"))
+SLOW_QUERY_LOG = os.getenv("SLOW_QUERY_LOG", os.path.join(tempfile.gettempdir(), "sork-slow-queries.log"))
+SLOW_QUERY_LOG_BYTES = int(os.getenv("SLOW_QUERY_LOG_BYTES", str(10 * 1024 * 1024)))
+SLOW_QUERY_LOG_BACKUPS = int(os.getenv("SLOW_QUERY_LOG_BACKUPS", "3"))
+# A plan is captured at most once per query text in this many seconds
+SLOW_QUERY_PLAN_TTL = int(os.getenv("SLOW_QUERY_PLAN_TTL", "3600"))
+# Emails allowed to open the admin page; any logged-in user when empty
+SLOW_QUERY_ADMINS = {e.strip().lower() for e in os.getenv("SLOW_QUERY_ADMINS", "").split(",") if e.strip()}
+
+# Each process writes its own rotating file, SLOW_QUERY_LOG with its pid
+# before the extension, since rotation is not safe across processes. The
+# files of workers that are gone are merged too, until they are this old.
+_DEAD_LOG_SECONDS = 7 * 86400
+
+_SHOWPLAN_NS = {"p": "http://schemas.microsoft.com/sqlserver/2004/07/showplan"}
+_TRY_CAST = re.compile(r"TRY_CAST\s*\(\s*(?:TRY_CAST\s*\(\s*)*(\[(?:[^\]]|\]\])+\]|[\w.]+)", re.IGNORECASE)
+
+# Entries waiting for a plan and a write; dropped rather than blocking a callback
+_pending = queue.Queue(maxsize=100)
+_planned = {}        # query id -> time its plan was last captured
+_worker = None
+_handler_pid = None
+_lock = threading.Lock()
+
+_log = logging.getLogger("sork.slow_queries")
+_log.propagate = False
+_log.setLevel(logging.INFO)
+
+
+def _log_files():
+    # (pid, [paths, oldest first]) of every process's slow log
+    directory = os.path.dirname(SLOW_QUERY_LOG) or "."
+    base, ext = os.path.splitext(os.path.basename(SLOW_QUERY_LOG))
+    pattern = re.compile(re.escape(base) + r"\.(\d+)" + re.escape(ext) + r"(?:\.(\d+))?")
+    files = {}
+    try:
+        names = os.listdir(directory)
+    except FileNotFoundError:
+        return []
+    for name in names:
+        match = pattern.fullmatch(name)
+        if match is not None:
+            files.setdefault(int(match.group(1)), []).append((-int(match.group(2) or 0), os.path.join(directory, name)))
+    return [(pid, [path for _, path in sorted(paths)]) for pid, paths in files.items()]
+
+
+def _remove_dead_logs():
+    for pid, paths in _log_files():
+        if pid == os.getpid():
+            continue
+        try:
+            os.kill(pid, 0)
+            continue
+        except ProcessLookupError:
+            pass
+        except PermissionError:
+            continue
+        for path in paths:
+            try:
+                if time.time() - os.path.getmtime(path) > _DEAD_LOG_SECONDS:
+                    os.remove(path)
+            except OSError:
+                pass
+
+
+def _handler():
+    # A handler inherited from the parent process would write to its file
+    global _handler_pid
+    if _handler_pid == os.getpid():
+        return
+    for handler in list(_log.handlers):
+        _log.removeHandler(handler)
+        handler.close()
+    os.makedirs(os.path.dirname(SLOW_QUERY_LOG) or ".", exist_ok=True)
+    _remove_dead_logs()
+    base, ext = os.path.splitext(SLOW_QUERY_LOG)
+    handler = logging.handlers.RotatingFileHandler(
+        f"{base}.{os.getpid()}{ext}", maxBytes=SLOW_QUERY_LOG_BYTES, backupCount=SLOW_QUERY_LOG_BACKUPS)
+    handler.setFormatter(logging.Formatter("%(message)s"))
+    _log.addHandler(handler)
+    _handler_pid = os.getpid()
+
+
+def observe(query, params, credentials, callback, seconds, rows=0, error=None):
+    """Queue a SQL Server query for the slow log if it exceeded the threshold."""
+    if SLOW_QUERY_SECONDS <= 0 or seconds < SLOW_QUERY_SECONDS:
+        return
+    entry = {
+        "ts": time.time(),
+        "query_id": query_id(query),
+        "callback": callback,
+        "credentials": credentials,
+        "seconds": round(seconds, 6),
+        "rows": rows,
+        "error": None if error is None else str(error),
+        "sql": query,
+        "params": params or {},
+    }
+    try:
+        _pending.put_nowait(entry)
+    except queue.Full:
+        return
+    _start_worker()
+
+
+def _start_worker():
+    global _worker
+    with _lock:
+        if _worker is None or not _worker.is_alive():
+            _worker = threading.Thread(target=_run, name="slow-query-log", daemon=True)
+            _worker.start()
+
+
+def _run():
+    _handler()
+    while True:
+        entry = _pending.get()
+        try:
+            entry["plan"] = _plan_for(entry)
+            _log.info(json.dumps(entry, default=str))
+        except Exception as e:
+            print(f"Slow query log error: {e}")
+
+
+def _plan_for(entry):
+    # Plans are compiled on the server, so skip queries planned recently
+    last = _planned.get(entry["query_id"])
+    if last is not None and time.time() - last < SLOW_QUERY_PLAN_TTL:
+        return None
+    # Imported here because the database layer reports to this module
+    from database import fetch_plan
+
+    _planned[entry["query_id"]] = time.time()
+    try:
+        return fetch_plan(entry["sql"], entry["params"], entry["credentials"])
+    except Exception as e:
+        entry["plan_error"] = str(e)
+        return None
+
+
+def plan_findings(plan, sql=""):
+    """Missing-index suggestions and conversion warnings from a SHOWPLAN_XML plan.
+
+    Columns wrapped in TRY_CAST in the query text are listed too, since the
+    optimizer cannot seek an index through them.
+    """
+    findings = {"missing_indexes": [], "converts": [],
+                "try_cast_columns": sorted({m.replace("]]", "]") for m in _TRY_CAST.findall(sql)})}
+    if not plan:
+        return findings
+    try:
+        root = ET.fromstring(plan)
+    except ET.ParseError:
+        return findings
+
+    for group in root.iterfind(".//p:MissingIndexGroup", _SHOWPLAN_NS):
+        for index in group.iterfind("p:MissingIndex", _SHOWPLAN_NS):
+            suggestion = {"table": index.get("Table"), "impact": float(group.get("Impact", 0))}
+            for columns in index.iterfind("p:ColumnGroup", _SHOWPLAN_NS):
+                suggestion[columns.get("Usage", "").lower()] = [
+                    c.get("Name") for c in columns.iterfind("p:Column", _SHOWPLAN_NS)]
+            findings["missing_indexes"].append(suggestion)
+
+    for warning in root.iterfind(".//p:PlanAffectingConvert", _SHOWPLAN_NS):
+        findings["converts"].append({"issue": warning.get("ConvertIssue"),
+                                     "expression": warning.get("Expression")})
+    return findings
+
+
+def _read(paths):
+    for path in paths:
+        try:
+            with open(path) as f:
+                for line in f:
+                    try:
+                        yield json.loads(line)
+                    except ValueError:
+                        continue
+        except FileNotFoundError:
+            continue
+
+
+def _entries():
+    # Every process's entries merged oldest first, so later entries win
+    return heapq.merge(*(_read(paths) for _, paths in _log_files()), key=lambda entry: entry.get("ts", 0))
+
+
+def worst_offenders(limit=25):
+    """Slow queries grouped by query text, slowest total time first."""
+    groups = {}
+    for entry in _entries():
+        group = groups.get(entry["query_id"])
+        if group is None:
+            group = groups[entry["query_id"]] = {
+                "query_id": entry["query_id"], "count": 0, "total_seconds": 0.0,
+                "max_seconds": 0.0, "callbacks": set(), "plan": None,
+            }
+        group["count"] += 1
+        group["total_seconds"] += entry["seconds"]
+        if entry["seconds"] >= group["max_seconds"]:
+            group["max_seconds"] = entry["seconds"]
+            group["slowest_params"] = entry.get("params")
+        group["callbacks"].add(entry.get("callback"))
+        group["last_seen"] = entry["ts"]
+        group["sql"] = entry["sql"]
+        group["error"] = entry.get("error")
+        if entry.get("plan"):
+            group["plan"] = entry["plan"]
+        elif entry.get("plan_error"):
+            group["plan_error"] = entry["plan_error"]
+
+    offenders = sorted(groups.values(), key=lambda g: g["total_seconds"], reverse=True)[:limit]
+    for group in offenders:
+        group["callbacks"] = sorted(c for c in group["callbacks"] if c)
+        group["mean_seconds"] = group["total_seconds"] / group["count"]
+        group["findings"] = plan_findings(group["plan"], group["sql"])
+    return offenders
+
+
+def latest_plan(qid):
+    """Most recent captured plan XML for a query id, or None."""
+    found = None
+    for entry in _entries():
+        if entry["query_id"] == qid and entry.get("plan"):
+            found = entry["plan"]
+    return found
+
+
+def is_admin(user):
+    """Whether a session user may open the slow query page."""
+    if not user:
+        return False
+    return not SLOW_QUERY_ADMINS or str(user.get("email", "")).lower() in SLOW_QUERY_ADMINS
@@ -0,0 +1,70 @@
+import catalog
+import row_counts
+import dataset_store
+import config
+from database import fetch_columnar, fetch_iter
+from query import table_ref, column_list, column_ref
+
+# Load environment variables
+config.load()
+
+# Value of the stats tab's table dropdown while the joined dataset is selected
+JOINED = "__joined__"
+
+
+class TableHandle:
+    """A database table, read the way dataset_store.DatasetHandle reads a joined dataset.
+
+    load() and chunks() select only the columns asked for and leave missing
+    values and the row limit to the database.
+    """
+
+    def __init__(self, table):
+        self.table = table
+
+    def __repr__(self):
+        return f"TableHandle({self.table})"
+
+    @property
+    def num_rows(self):
+        return row_counts.get_row_count(self.table)
+
+    def columns(self):
+        """Column names, from the catalog."""
+        return catalog.get_columns(self.table)
+
+    def numeric_columns(self):
+        """Columns whose SQL type is numeric, from the catalog."""
+        return catalog.get_numeric_columns(self.table)
+
+    def _query(self, columns, dropna, limit):
+        columns = list(columns) if columns is not None else self.columns()
+        top = "TOP (:limit) " if limit is not None else ""
+        query = f"SELECT {top}{column_list(columns)} FROM {table_ref(self.table)}"
+        if dropna:
+            query += " WHERE " + " AND ".join(f"{column_ref(c)} IS NOT NULL" for c in columns)
+        return query, ({"limit": int(limit)} if limit is not None else None)
+
+    def load(self, columns=None, dropna=True, limit=None):
+        """Read the table as a DataFrame, or None on a database error.
+
+        With dropna, rows with a missing value in any of the columns are
+        filtered out by the query; limit caps the rows returned.
+        """
+        return fetch_columnar(*self._query(columns, dropna, limit))
+
+    def chunks(self, columns=None, dropna=True, chunk_rows=None):
+        """Yield the table as DataFrames of at most chunk_rows rows. Database errors are raised."""
+        query, params = self._query(columns, dropna, None)
+        yield from fetch_iter(query, params, chunk_rows=chunk_rows)
+
+
+def open_source(selected_table, joined_data=None, use_joined=False):
+    """Handle for what the stats tab has selected.
+
+    The joined dataset when it is in use, otherwise the table. None when the
+    joined dataset is selected but no longer stored.
+    """
+    if joined_data and (use_joined or selected_table == JOINED):
+        return dataset_store.get_dataset(joined_data)
+    return TableHandle(selected_table)
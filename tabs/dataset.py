@@ -2,24 +2,27 @@ from dash import dcc, html, Input, Output, State, callback, ctx, ALL, MATCH, das
 import dash_bootstrap_components as dbc
 import dash
 from charts import create_database_Table
-from dotenv import load_dotenv
+import config
 from database import fetch_data_from_sql
+import catalog
+import row_counts
+from exports import send_query_csv
+from query import table_ref, column_list, column_ref, quote_ident, join_keyword, render
 from tabs.joins import joins_layout
 import os
+from flask import session
 import pandas as pd
 from pandas.api.types import is_numeric_dtype
-import plotly.express as px
 import json
-import uuid
-from cache_config import cache
+import dataset_store
 
 # Load environment variables
-load_dotenv(override=True)
+config.load()
 
-@cache.memoize(timeout=3600)
-def store_large_df(key, df_dict):
-    print("Storing to cache with key:", key)
-    cache.set(key, df_dict, timeout=3600)
+def dataset_owner():
+    """Who a joined dataset counts against for DATASET_USER_BYTES."""
+    user = session.get("user") or {}
+    return user.get("email") or user.get("sub") or "anonymous"
 
 # Table Options
 table_options = os.getenv("TABLE_OPTIONS").split(",")
@@ -339,8 +342,7 @@ def update_column_options_on_table_change(selected_table):
     if selected_table is None:
         return [], [], {"display": "none"}
     try:
-        sample_df = fetch_data_from_sql(f"SELECT TOP 1 * FROM [dbo].[{selected_table}]")
-        cols = sample_df.columns.tolist()
+        cols = catalog.get_columns(selected_table)
         opts = [{'label': c, 'value': c} for c in cols]
         return opts, cols, {"display": "block", "marginBottom": "15px"}
     except Exception as e:
@@ -393,8 +395,7 @@ def update_row_count_info(selected_table):
     if selected_table is None:
         return "", 1000
     try:
-        count_df = fetch_data_from_sql(f"SELECT COUNT(*) AS row_count FROM [dbo].[{selected_table}]")
-        total = count_df.iloc[0]['row_count']
+        total = row_counts.get_row_count(selected_table)
         return f"(Max: {total} rows available)", total
     except Exception as e:
         print(f"Error fetching row count: {e}")
@@ -419,8 +420,7 @@ def update_output(selected_table, selected_columns, row_count, column_options):
     if row_count is None:
         row_count = 20
     try:
-        cnt_df = fetch_data_from_sql(f"SELECT COUNT(*) AS row_count FROM [dbo].[{selected_table}]")
-        total = cnt_df.iloc[0]['row_count']
+        total = row_counts.get_row_count(selected_table)
         row_count = min(row_count, total)
     except:
         pass
@@ -452,11 +452,14 @@ def generate_figure(n_clicks, selected_table, x_var, y_var, row_count):
     # Generate different data frame if the joined one is stored
     if selected_table:
         col1, col2 = x_var, y_var
-        query = f"SELECT TOP {row_count} [{col1}], [{col2}] FROM [dbo].[{selected_table}]"
-        df = fetch_data_from_sql(query)[[col1, col2]].dropna()
+        query = f"SELECT TOP (:row_count) {column_list([col1, col2])} FROM {table_ref(selected_table)}"
+        df = fetch_data_from_sql(query, {"row_count": int(row_count or 20)})[[col1, col2]].dropna()
     else:
         return [], {"display": "none"}
     
+    # Imported on first use to keep startup fast
+    import plotly.express as px
+
     num1, num2 = is_numeric_dtype(df[col1]), is_numeric_dtype(df[col2])
     
     if num1 and num2:
@@ -562,11 +565,8 @@ def update_column_options(first_table, second_table, join_type):
     
     # Get columns from both tables
     try:
-        first_df = fetch_data_from_sql(f"SELECT TOP 1 * FROM [dbo].[{first_table}]")
-        second_df = fetch_data_from_sql(f"SELECT TOP 1 * FROM [dbo].[{second_table}]")
-        
-        first_columns = first_df.columns.tolist()
-        second_columns = second_df.columns.tolist()
+        first_columns = catalog.get_columns(first_table)
+        second_columns = catalog.get_columns(second_table)
         
         first_column_options = [{"label": col, "value": col} for col in first_columns]
         second_column_options = [{"label": col, "value": col} for col in second_columns]
@@ -619,6 +619,38 @@ def handle_second_table_column_selection(select_clicks, deselect_clicks, options
     
     return current_value
 
+# Build the SQL for a two-table join; the row limit is bound as :row_limit
+def build_join_query(first_table, join_type, second_table, first_key, second_key,
+                     first_columns, second_columns):
+    # Format column selections for SQL query
+    first_cols = []
+    if first_columns:
+        for col in first_columns:
+            if col != first_key:  # Avoid duplicate keys in the result
+                first_cols.append(f"{column_ref(col, 't1')} AS {quote_ident('t1_' + col)}")
+            else:
+                first_cols.append(column_ref(col, 't1'))  # Don't rename the join key
+    
+    second_cols = []
+    if second_columns:
+        for col in second_columns:
+            if col != second_key or col == first_key:  # Avoid duplicate keys or columns with same name
+                second_cols.append(f"{column_ref(col, 't2')} AS {quote_ident('t2_' + col)}")
+            else:
+                second_cols.append(column_ref(col, 't2'))
+    
+    # Construct the SQL query
+    columns = ", ".join(first_cols + second_cols)
+    if not columns.strip():
+        columns = f"{column_ref(first_key, 't1')}, {column_ref(second_key, 't2')}"
+    
+    return f"""
+        SELECT TOP (:row_limit) {columns}
+        FROM {table_ref(first_table)} AS t1
+        {join_keyword(join_type)} JOIN {table_ref(second_table)} AS t2
+        ON {column_ref(first_key, 't1')} = {column_ref(second_key, 't2')}
+        """
+
 # Generate and execute the join
 @callback(
     [Output('join-results-div', 'style'),
@@ -651,37 +683,12 @@ def execute_join(n_clicks, first_table, join_type, second_table, first_key, seco
         return {"display": "none"}, {"display": "block"}, "", None, "", "Please select at least one column from either table", None
     
     try:
-        # Format column selections for SQL query
-        first_cols = []
-        if first_columns:
-            for col in first_columns:
-                if col != first_key:  # Avoid duplicate keys in the result
-                    first_cols.append(f"t1.[{col}] AS [t1_{col}]")
-                else:
-                    first_cols.append(f"t1.[{col}]")  # Don't rename the join key
-        
-        second_cols = []
-        if second_columns:
-            for col in second_columns:
-                if col != second_key or col == first_key:  # Avoid duplicate keys or columns with same name
-                    second_cols.append(f"t2.[{col}] AS [t2_{col}]")
-                else:
-                    second_cols.append(f"t2.[{col}]")
-        
-        # Construct the SQL query
-        columns = ", ".join(first_cols + second_cols)
-        if not columns.strip():
-            columns = "t1.[" + first_key + "], t2.[" + second_key + "]"
-        
-        sql_query = f"""
-        SELECT TOP {row_limit} {columns}
-        FROM [dbo].[{first_table}] AS t1
-        {join_type.upper()} JOIN [dbo].[{second_table}] AS t2
-        ON t1.[{first_key}] = t2.[{second_key}]
-        """
+        sql_query = build_join_query(first_table, join_type, second_table, first_key, second_key,
+                                     first_columns, second_columns)
+        params = {"row_limit": int(row_limit)}
         
         # Execute the query
-        result_df = fetch_data_from_sql(sql_query)
+        result_df = fetch_data_from_sql(sql_query, params)
         
         # Create stats information
         row_count = len(result_df)
@@ -717,12 +724,23 @@ def execute_join(n_clicks, first_table, join_type, second_table, first_key, seco
         )
         
         # Format the SQL query for display
-        formatted_query = html.Pre(sql_query, style={"margin": 0})
+        formatted_query = html.Pre(render(sql_query, params), style={"margin": 0})
 
-        # Convert dataframe to dict for storage
-        dataset_dict = result_df.to_dict('records')
-        data_key = str(uuid.uuid4())
-        store_large_df(data_key, dataset_dict)
+        # Stored as Arrow so the stats tab can load just the columns it needs.
+        # A result too large to store is still shown, just not saved.
+        data_key = None
+        try:
+            handle = dataset_store.register_dataset(result_df, dataset_owner())
+        except ValueError as e:
+            stats_text += f" | Not saved for analysis: {e}"
+        else:
+            stats_text += f" | {handle.nbytes / (1024 * 1024):.1f} MB saved for analysis"
+            removed = {}
+            for _, reason in handle.evicted:
+                removed[reason] = removed.get(reason, 0) + 1
+            for reason, count in removed.items():
+                stats_text += f" ({count} older joined dataset(s) removed because {dataset_store.eviction_reason(reason)})"
+            data_key = handle.key
         
         return {"display": "block"}, {"display": "none"}, formatted_query, table, stats_text, "", data_key
     
@@ -749,42 +767,18 @@ def download_join_results(n_clicks, first_table, join_type, second_table, first_
         return dash.no_update
     
     try:
-        # Format column selections for SQL query
-        first_cols = []
-        if first_columns:
-            for col in first_columns:
-                if col != first_key:  # Avoid duplicate keys in the result
-                    first_cols.append(f"t1.[{col}] AS [t1_{col}]")
-                else:
-                    first_cols.append(f"t1.[{col}]")  # Don't rename the join key
-        
-        second_cols = []
-        if second_columns:
-            for col in second_columns:
-                if col != second_key or col == first_key:  # Avoid duplicate keys or columns with same name
-                    second_cols.append(f"t2.[{col}] AS [t2_{col}]")
-                else:
-                    second_cols.append(f"t2.[{col}]")
-        
-        # Construct the SQL query
-        columns = ", ".join(first_cols + second_cols)
-        if not columns.strip():
-            columns = "t1.[" + first_key + "], t2.[" + second_key + "]"
-        
-        sql_query = f"""
-        SELECT TOP {row_limit} {columns}
-        FROM [dbo].[{first_table}] AS t1
-        {join_type.upper()} JOIN [dbo].[{second_table}] AS t2
-        ON t1.[{first_key}] = t2.[{second_key}]
-        """
-        
-        # Execute the query
-        result_df = fetch_data_from_sql(sql_query)
+        sql_query = build_join_query(first_table, join_type, second_table, first_key, second_key,
+                                     first_columns, second_columns)
+        params = {"row_limit": int(row_limit)}
         
         # Generate a filename based on the tables being joined
         filename = f"{first_table}_{join_type}_join_{second_table}.csv"
         
-        return dcc.send_data_frame(result_df.to_csv, filename, index=False)
+        # Stream the result into a download, nothing if it is empty
+        download = send_query_csv(sql_query, filename, params=params)
+        if download is None:
+            return dash.no_update
+        return download
     except Exception as e:
         # If there's an error, don't download anything
         print(f"Error during download: {e}")
@@ -6,11 +6,15 @@ import pandas as pd
 from io import StringIO
 import base64
 from database import fetch_data_from_sql
-from dotenv import load_dotenv
+import catalog
+import row_counts
+from exports import send_query_csv
+from query import table_ref, column_list
+import config
 import os
 
 # Load environment variables
-load_dotenv(override=True)
+config.load()
 
 # Table Options
 table_options = os.getenv("TABLE_OPTIONS").split(",")
@@ -178,15 +182,12 @@ def update_column_options(selected_table):
         return [], [], "", 100
     
     try:
-        # Get a sample row to determine columns
-        sample_df = fetch_data_from_sql(f"SELECT TOP 1 * FROM [dbo].[{selected_table}]")
-        columns = sample_df.columns.tolist()
+        # Look up the columns in the catalog
+        columns = catalog.get_columns(selected_table)
         column_options = [{'label': col, 'value': col} for col in columns]
         
         # Get total row count
-        count_query = f"SELECT COUNT(*) AS row_count FROM [dbo].[{selected_table}]"
-        count_df = fetch_data_from_sql(count_query)
-        total_rows = count_df.iloc[0]['row_count']
+        total_rows = row_counts.get_row_count(selected_table)
         
         row_info = f"This table contains {total_rows} rows in total."
         
@@ -239,19 +240,17 @@ def update_preview(n_clicks, selected_table, start_row, end_row, selected_column
     offset = start_row - 1
     
     try:
-        # Build the column list for the query
-        column_list = ", ".join([f"[{col}]" for col in selected_columns])
-        
         # Query with pagination
         query = f"""
-        SELECT {column_list} 
-        FROM [dbo].[{selected_table}]
+        SELECT {column_list(selected_columns)} 
+        FROM {table_ref(selected_table)}
         ORDER BY (SELECT NULL)
-        OFFSET {offset} ROWS
-        FETCH NEXT {min(row_count, 100)} ROWS ONLY
+        OFFSET :offset ROWS
+        FETCH NEXT :row_count ROWS ONLY
         """
+        params = {"offset": offset, "row_count": min(row_count, 100)}
         
-        preview_df = fetch_data_from_sql(query)
+        preview_df = fetch_data_from_sql(query, params)
         
         # Only show up to 10 rows in preview
         display_rows = min(10, len(preview_df))
@@ -312,22 +311,18 @@ def download_csv(n_clicks, selected_table, start_row, end_row, selected_columns)
     offset = start_row - 1
     
     try:
-        # Build the column list for the query
-        column_list = ", ".join([f"[{col}]" for col in selected_columns])
-        
         # Query with pagination
         query = f"""
-        SELECT {column_list} 
-        FROM [dbo].[{selected_table}]
+        SELECT {column_list(selected_columns)} 
+        FROM {table_ref(selected_table)}
         ORDER BY (SELECT NULL)
-        OFFSET {offset} ROWS
-        FETCH NEXT {row_count} ROWS ONLY
+        OFFSET :offset ROWS
+        FETCH NEXT :row_count ROWS ONLY
         """
+        params = {"offset": offset, "row_count": row_count}
         
-        df = fetch_data_from_sql(query)
-        
-        # Return the data as a CSV download
-        return dcc.send_data_frame(df.to_csv, f"{selected_table}_rows_{start_row}_to_{end_row}.csv", index=False)
+        # Stream the data into a CSV download
+        return send_query_csv(query, f"{selected_table}_rows_{start_row}_to_{end_row}.csv", selected_columns, params)
     except Exception as e:
         # In case of error, we need to return something to prevent the callback from failing
         # But there's no good way to show errors in a download callback
@@ -1,12 +1,15 @@
 import os
 from dash import dcc, html, Input, Output, State, callback, callback_context, dash_table, ctx
 import dash
-from dotenv import load_dotenv
+import config
 from database import fetch_data_from_sql
+import catalog
+from exports import send_query_csv
+from query import table_ref, column_list, column_ref, quote_ident
 import pandas as pd
 
 # Load environment variables
-load_dotenv(override=True)
+config.load()
 
 CORE_TABLES={
     "db_main": "Growth/Survival",
@@ -199,19 +202,16 @@ def update_core_table_columns(selected_table):
         return [], {"display": "none"}, [], {"display": "none"}, [], {"display": "none"}, {"display": "none"}
 
     try:
-        # Fetch garden table columns
-        sample_df = fetch_data_from_sql(f"SELECT TOP 1 * FROM dbo.[{GARDENS_TABLE}]")
-        cols = sample_df.columns.tolist()
+        # Garden table columns
+        cols = catalog.get_columns(GARDENS_TABLE)
         GARDENS_TABLE_OPTIONS = [{'label': c, 'value': c} for c in cols]
 
-        # Fetch maternal tree table columns
-        sample_df = fetch_data_from_sql(f"SELECT TOP 1 * FROM dbo.[{MATERNAL_TREE_TABLE}]")
-        cols = sample_df.columns.tolist()
+        # Maternal tree table columns
+        cols = catalog.get_columns(MATERNAL_TREE_TABLE)
         MATERNAL_TREE_OPTIONS = [{'label': c, 'value': c} for c in cols]
 
-        # Fetch core table columns
-        sample_df = fetch_data_from_sql(f"SELECT TOP 1 * FROM [dbo].[{selected_table}]")
-        cols = sample_df.columns.tolist()
+        # Core table columns
+        cols = catalog.get_columns(selected_table)
         opts = [{'label': c, 'value': c} for c in cols]
         
         return (opts, {"display": "block", "marginBottom": "15px"}, 
@@ -279,6 +279,89 @@ def handle_garden_select_buttons(select_all_clicks, deselect_all_clicks, current
     
     return dash.no_update
 
+# Build the Common Garden join; returns the SQL and the selected column groups
+def build_join_query(core_table, core_table_vars, maternal_tree_vars, garden_climate_vars):
+    if core_table not in CORE_TABLES:
+        raise ValueError(f"Unknown core table: {core_table}")
+
+    # 1) Required core columns
+    if core_table == "leaf_traits_2016":
+        required_core_cols = ["Accession", "Locality", "Site"]
+        garden_key_cols = {"Site"}
+    else:
+        required_core_cols = ["Accession", "Locality", "Year", "Site"]
+        garden_key_cols = {"Year", "Site"}
+    tree_key_cols = {"Accession", "Locality"}
+
+    # 2) Core SELECT
+    core_cols = required_core_cols[:]
+    if core_table_vars:
+        core_cols += [c for c in core_table_vars if c not in core_cols]
+    core_sel = column_list(core_cols, "core")
+    selected_clauses = [core_sel]
+
+    # 3) Clean out any key‐columns from the non‐core selections
+    safe_tree_vars   = [c for c in maternal_tree_vars   or [] if c not in tree_key_cols]
+    safe_garden_vars = [c for c in garden_climate_vars or [] if c not in garden_key_cols]
+
+    # 4) Maternal‐tree join
+    joins = []
+    if maternal_tree_vars:
+        # only add non‐key columns to SELECT
+        if safe_tree_vars:
+            tree_sel = ", ".join(
+                f"{column_ref(c, 'maternal')} AS {quote_ident('maternal_' + c.replace(' ', '_'))}"
+                for c in safe_tree_vars
+            )
+            selected_clauses.append(tree_sel)
+
+        # build a subquery that SELECTs keys + only the safe vars
+        tree_cols = ["TRY_CAST(TRY_CAST([Accession] AS NUMERIC) AS INT) AS [Accession]",
+                     "[Locality]"] \
+                    + [quote_ident(c) for c in safe_tree_vars]
+        joins.append(f"""
+LEFT JOIN (
+  SELECT {', '.join(tree_cols)}
+  FROM {table_ref(MATERNAL_TREE_TABLE)}
+) maternal
+  ON core.[Accession] = maternal.[Accession]
+ AND core.[Locality]  = maternal.[Locality]
+""".strip())
+
+    # 5) Garden‐climate join
+    if garden_climate_vars:
+        if safe_garden_vars:
+            garden_sel = ", ".join(
+                f"{column_ref(c, 'garden')} AS {quote_ident('garden_' + c.replace(' ', '_'))}"
+                for c in safe_garden_vars
+            )
+            selected_clauses.append(garden_sel)
+
+        if core_table == "leaf_traits_2016":
+            garden_cols = ["[Site]"] + [quote_ident(c) for c in safe_garden_vars]
+            join_cond   = "core.[Site] = garden.[Site]"
+        else:
+            garden_cols = ["TRY_CAST(TRY_CAST([Year] AS NUMERIC) AS INT) AS [Year]",
+                           "[Site]"] + [quote_ident(c) for c in safe_garden_vars]
+            join_cond   = "core.[Year] = garden.[Year] AND core.[Site] = garden.[Site]"
+
+        joins.append(f"""
+LEFT JOIN (
+  SELECT {', '.join(garden_cols)}
+  FROM {table_ref(GARDENS_TABLE)}
+) garden
+  ON {join_cond}
+""".strip())
+
+    # 6) Assemble
+    sql_query = f"""
+SELECT DISTINCT
+  {', '.join(selected_clauses)}
+FROM {table_ref(core_table)} core
+{chr(10).join(joins)}
+""".strip()
+    return sql_query, core_cols, safe_tree_vars, safe_garden_vars
+
 # Main execution callback - handles both validation and execution
 @callback(
     [
@@ -301,82 +384,8 @@ def execute_join(n_clicks, core_table, core_table_vars, maternal_tree_vars, gard
         return {"display": "none"}, [], "", ""
 
     try:
-        # 1) Required core columns
-        if core_table == "leaf_traits_2016":
-            required_core_cols = ["Accession", "Locality", "Site"]
-            garden_key_cols = {"Site"}
-        else:
-            required_core_cols = ["Accession", "Locality", "Year", "Site"]
-            garden_key_cols = {"Year", "Site"}
-        tree_key_cols = {"Accession", "Locality"}
-
-        # 2) Core SELECT
-        core_cols = required_core_cols[:]
-        if core_table_vars:
-            core_cols += [c for c in core_table_vars if c not in core_cols]
-        core_sel = ", ".join(f"core.[{c}]" for c in core_cols)
-        selected_clauses = [core_sel]
-
-        # 3) Clean out any key‐columns from the non‐core selections
-        safe_tree_vars   = [c for c in maternal_tree_vars   or [] if c not in tree_key_cols]
-        safe_garden_vars = [c for c in garden_climate_vars or [] if c not in garden_key_cols]
-
-        # 4) Maternal‐tree join
-        joins = []
-        if maternal_tree_vars:
-            # only add non‐key columns to SELECT
-            if safe_tree_vars:
-                tree_sel = ", ".join(
-                    f"maternal.[{c}] AS [maternal_{c.replace(' ', '_')}]"
-                    for c in safe_tree_vars
-                )
-                selected_clauses.append(tree_sel)
-
-            # build a subquery that SELECTs keys + only the safe vars
-            tree_cols = ["TRY_CAST(TRY_CAST([Accession] AS NUMERIC) AS INT) AS [Accession]",
-                         "[Locality]"] \
-                        + [f"[{c}]" for c in safe_tree_vars]
-            joins.append(f"""
-LEFT JOIN (
-  SELECT {', '.join(tree_cols)}
-  FROM [dbo].[{MATERNAL_TREE_TABLE}]
-) maternal
-  ON core.[Accession] = maternal.[Accession]
- AND core.[Locality]  = maternal.[Locality]
-""".strip())
-
-        # 5) Garden‐climate join
-        if garden_climate_vars:
-            if safe_garden_vars:
-                garden_sel = ", ".join(
-                    f"garden.[{c}] AS [garden_{c.replace(' ', '_')}]"
-                    for c in safe_garden_vars
-                )
-                selected_clauses.append(garden_sel)
-
-            if core_table == "leaf_traits_2016":
-                garden_cols = ["[Site]"] + [f"[{c}]" for c in safe_garden_vars]
-                join_cond   = "core.[Site] = garden.[Site]"
-            else:
-                garden_cols = ["TRY_CAST(TRY_CAST([Year] AS NUMERIC) AS INT) AS [Year]",
-                               "[Site]"] + [f"[{c}]" for c in safe_garden_vars]
-                join_cond   = "core.[Year] = garden.[Year] AND core.[Site] = garden.[Site]"
-
-            joins.append(f"""
-LEFT JOIN (
-  SELECT {', '.join(garden_cols)}
-  FROM [dbo].[{GARDENS_TABLE}]
-) garden
-  ON {join_cond}
-""".strip())
-
-        # 6) Assemble & run
-        sql_query = f"""
-SELECT DISTINCT
-  {', '.join(selected_clauses)}
-FROM [dbo].[{core_table}] core
-{chr(10).join(joins)}
-""".strip()
+        sql_query, core_cols, safe_tree_vars, safe_garden_vars = build_join_query(
+            core_table, core_table_vars, maternal_tree_vars, garden_climate_vars)
         result_df = fetch_data_from_sql(sql_query)
 
         # 7) If nothing came back, hide and exit
@@ -427,93 +436,14 @@ def download_join_results(n_clicks, core_table, core_table_vars, maternal_tree_v
         return dash.no_update
 
     try:
-       # 1) Required core columns
-        if core_table == "leaf_traits_2016":
-            required_core_cols = ["Accession", "Locality", "Site"]
-            garden_key_cols = {"Site"}
-        else:
-            required_core_cols = ["Accession", "Locality", "Year", "Site"]
-            garden_key_cols = {"Year", "Site"}
-        tree_key_cols = {"Accession", "Locality"}
-
-        # 2) Core SELECT
-        core_cols = required_core_cols[:]
-        if core_table_vars:
-            core_cols += [c for c in core_table_vars if c not in core_cols]
-        core_sel = ", ".join(f"core.[{c}]" for c in core_cols)
-        selected_clauses = [core_sel]
-
-        # 3) Clean out any key‐columns from the non‐core selections
-        safe_tree_vars   = [c for c in maternal_tree_vars   or [] if c not in tree_key_cols]
-        safe_garden_vars = [c for c in garden_climate_vars or [] if c not in garden_key_cols]
-
-        # 4) Maternal‐tree join
-        joins = []
-        if maternal_tree_vars:
-            # only add non‐key columns to SELECT
-            if safe_tree_vars:
-                tree_sel = ", ".join(
-                    f"maternal.[{c}] AS [maternal_{c.replace(' ', '_')}]"
-                    for c in safe_tree_vars
-                )
-                selected_clauses.append(tree_sel)
-
-            # build a subquery that SELECTs keys + only the safe vars
-            tree_cols = ["TRY_CAST(TRY_CAST([Accession] AS NUMERIC) AS INT) AS [Accession]",
-                         "[Locality]"] \
-                        + [f"[{c}]" for c in safe_tree_vars]
-            joins.append(f"""
-LEFT JOIN (
-  SELECT {', '.join(tree_cols)}
-  FROM [dbo].[{MATERNAL_TREE_TABLE}]
-) maternal
-  ON core.[Accession] = maternal.[Accession]
- AND core.[Locality]  = maternal.[Locality]
-""".strip())
-
-        # 5) Garden‐climate join
-        if garden_climate_vars:
-            if safe_garden_vars:
-                garden_sel = ", ".join(
-                    f"garden.[{c}] AS [garden_{c.replace(' ', '_')}]"
-                    for c in safe_garden_vars
-                )
-                selected_clauses.append(garden_sel)
-
-            if core_table == "leaf_traits_2016":
-                garden_cols = ["[Site]"] + [f"[{c}]" for c in safe_garden_vars]
-                join_cond   = "core.[Site] = garden.[Site]"
-            else:
-                garden_cols = ["TRY_CAST(TRY_CAST([Year] AS NUMERIC) AS INT) AS [Year]",
-                               "[Site]"] + [f"[{c}]" for c in safe_garden_vars]
-                join_cond   = "core.[Year] = garden.[Year] AND core.[Site] = garden.[Site]"
-
-            joins.append(f"""
-LEFT JOIN (
-  SELECT {', '.join(garden_cols)}
-  FROM [dbo].[{GARDENS_TABLE}]
-) garden
-  ON {join_cond}
-""".strip())
+        sql_query, core_cols, safe_tree_vars, safe_garden_vars = build_join_query(
+            core_table, core_table_vars, maternal_tree_vars, garden_climate_vars)
 
-        # 6) Assemble & run
-        sql_query = f"""
-SELECT DISTINCT
-  {', '.join(selected_clauses)}
-FROM [dbo].[{core_table}] core
-{chr(10).join(joins)}
-""".strip()
-        result_df = fetch_data_from_sql(sql_query)
-        # guard against None or empty
-        if result_df is None or result_df.empty:
+        # 7) Stream the result into a download, nothing if it is empty
+        download = send_query_csv(sql_query, f"{core_table}_joined_data.csv")
+        if download is None:
             return dash.no_update
-
-        # 6) Trigger download
-        return dcc.send_data_frame(
-            result_df.to_csv,
-            f"{core_table}_joined_data.csv",
-            index=False
-        )
+        return download
 
     except Exception as e:
         print(f"Error during download: {e}")
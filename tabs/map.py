@@ -1,15 +1,24 @@
 import dash
-from dash import dcc, html, Input, Output, callback, callback_context, dash_table
+from dash import dcc, html, Input, Output, callback, callback_context, clientside_callback, dash_table
 import plotly.graph_objects as go
+from plotly.utils import PlotlyJSONEncoder
 import pandas as pd
-from dotenv import load_dotenv
+import config
 import os
-from database import fetch_data_from_sql_pub
+import json
+import hashlib
+import site_index
+import counties
 
 # Load environment variables
-load_dotenv(override=True)
+config.load()
 map_table = os.getenv("MAP_TABLE")
 
+# Browser and proxy caching of /public/map.json: seconds it is fresh, then
+# seconds a cached copy may still be shown while it is revalidated
+PUBLIC_MAP_MAX_AGE = int(os.getenv("PUBLIC_MAP_MAX_AGE", "300"))
+PUBLIC_MAP_STALE_SECONDS = int(os.getenv("PUBLIC_MAP_STALE_SECONDS", "86400"))
+
 UCLA_coordinates = {
     "latitude": 34.0682,
     "longitude": -118.4455
@@ -81,36 +90,55 @@ map_layout = dcc.Tab(
     style={"padding": "15px"}
 )
 
-# Callback to handle both map updates and click data
-@callback(
-    [Output('california-map', 'figure'),
-     Output('stored-click-data', 'data')],
-    [Input('reset-map', 'n_clicks'),
-     Input('california-map', 'clickData')]
-)
-def update_map_and_click_data(reset_clicks, clickData):
-    # Determine which input triggered the callback
-    ctx = callback_context
-    trigger_id = ctx.triggered[0]['prop_id'].split('.')[0] if ctx.triggered else None
-    
-    # Create the base map figure
-    fig = go.Figure()
+# Shade counties by their number of trees; hovering shows the trait means
+def county_layer():
+    summary = counties.county_summary(map_table)
+    traits = counties.county_traits(map_table)
+    shown = summary[summary['trees'] > 0]
+    hover_list = []
+    for _, county in shown.iterrows():
+        lines = [f"{county['county']} County", f"{county['sites']} sites, {county['trees']} trees"]
+        lines += [f"Mean {trait}: {county[trait]:.2f}" for trait in traits if pd.notna(county[trait])]
+        hover_list.append("<br>".join(lines))
+    return go.Choroplethmapbox(
+        # Relative to the app's URL prefix, which the clientside callback adds
+        geojson = counties.geojson_path(),
+        featureidkey = "properties.GEO_ID",
+        locations = shown['GEO_ID'].tolist(),
+        z = shown['trees'].tolist(),
+        hovertext = hover_list,
+        hoverinfo = 'text',
+        colorscale = 'Greens',
+        marker = {'opacity': 0.45, 'line': {'width': 0.5, 'color': '#133817'}},
+        colorbar = {'title': 'Trees'},
+        name = 'Counties'
+    )
+
+# Build the map of every tree site plus UCLA from the site index
+def build_map_figure(sites):
+    lon_list = sites['longitude'].tolist()
+    lat_list = sites['latitude'].tolist()
+    text_list = sites['locality_full_name'].tolist()
+    hover_list = [f"{name}<br>{trees} trees" for name, trees in zip(text_list, sites['trees'])]
 
-    # Fetch coordinates for map
-    lon_list = fetch_data_from_sql_pub(f"SELECT AVG(Longitude) AS avg_longitude FROM dbo.[{map_table}] GROUP BY locality_full_name")['avg_longitude'].tolist()
-    lat_list = fetch_data_from_sql_pub(f"SELECT AVG(Latitude) AS avg_latitude FROM dbo.[{map_table}] GROUP BY locality_full_name")['avg_latitude'].tolist()      
-    text_list = fetch_data_from_sql_pub(f"SELECT DISTINCT locality_full_name FROM dbo.[{map_table}]")['locality_full_name'].tolist()
-    
     # add UCLA marker
     lon_list.append(UCLA_coordinates['longitude'])
     lat_list.append(UCLA_coordinates['latitude'])
     text_list.append("UCLA (#1 Public University)")
+    hover_list.append("UCLA (#1 Public University)")
 
+    fig = go.Figure()
+    # Counties go underneath the site markers; the map still works without them
+    try:
+        fig.add_trace(county_layer())
+    except Exception as e:
+        print(f"Error building the county layer: {e}")
     fig.add_trace(go.Scattermapbox(
         mode = "markers+text",
         lon = lon_list,
         lat = lat_list,
         text = text_list,
+        hovertext = hover_list,
         textposition = "top right",
         marker = {'size':8, 'color':'#007bff'},
         hoverinfo='text'
@@ -128,13 +156,105 @@ def update_map_and_click_data(reset_clicks, clickData):
         paper_bgcolor="#e5ecf6",
         plot_bgcolor="#e5ecf6"
     )
-    
+    return fig
+
+# Body of /public/map.json: the map figure and the sites it shows
+def build_public_map(sites):
+    body = json.dumps({
+        "figure": build_map_figure(sites),
+        "sites": sites.to_dict("records"),
+    }, cls=PlotlyJSONEncoder)
+    return body, hashlib.sha1(body.encode("utf-8")).hexdigest()
+
+def public_map():
+    """(etag, JSON body) of the public map, from the last build of the site index.
+
+    When the map table's version has changed the previous body is returned
+    while the new one is built in the background, so no request waits on the
+    database after the first.
+    """
+    version, (body, digest) = site_index.snapshot("public_map", build_public_map, map_table)
+    # Strong ETag: changes with the data version and with the body itself
+    etag = hashlib.sha1(f"{map_table}:{version}:{digest}".encode("utf-8")).hexdigest()
+    return etag, body
+
+def public_map_cache_control():
+    return f"public, max-age={PUBLIC_MAP_MAX_AGE}, stale-while-revalidate={PUBLIC_MAP_STALE_SECONDS}"
+
+# Draw the map on load and on reset. The browser fetches the figure from
+# /public/map.json, so repeat visits are answered by its HTTP cache or a 304.
+clientside_callback(
+    """
+    async function(resetClicks) {
+        const config = JSON.parse(document.getElementById('_dash-config').textContent);
+        const response = await fetch(config.requests_pathname_prefix + 'public/map.json');
+        if (!response.ok) {
+            return window.dash_clientside.no_update;
+        }
+        const figure = (await response.json()).figure;
+        figure.data.forEach(trace => {
+            if (typeof trace.geojson === 'string') {
+                trace.geojson = config.requests_pathname_prefix + trace.geojson;
+            }
+        });
+        return figure;
+    }
+    """,
+    Output('california-map', 'figure'),
+    [Input('reset-map', 'n_clicks')]
+)
+
+# Remember the clicked site; reset clears it. The figure is left untouched.
+@callback(
+    Output('stored-click-data', 'data'),
+    [Input('reset-map', 'n_clicks'),
+     Input('california-map', 'clickData')]
+)
+def update_click_data(reset_clicks, clickData):
+    # Determine which input triggered the callback
+    ctx = callback_context
+    trigger_id = ctx.triggered[0]['prop_id'].split('.')[0] if ctx.triggered else None
+
     # Handle click data - if the map was clicked, update the stored click data
     if trigger_id == 'california-map':
-        return fig, clickData
+        return clickData
     
-    # If reset button was clicked or initial load, return the figure with no click data
-    return fig, None
+    # If reset button was clicked or initial load, clear the click data
+    return None
+
+# Summary of a clicked county: its trait means and the sites inside it
+def county_details(geo_id):
+    summary = counties.county_summary(map_table)
+    county = summary[summary['GEO_ID'] == geo_id].iloc[0]
+    sites = site_index.get_sites(map_table)
+    sites = sites[sites['locality_full_name'].isin(counties.county_sites(geo_id, map_table))]
+    rows = [{"Statistic": f"Mean {trait}", "Value": round(county[trait], 4)}
+            for trait in counties.county_traits(map_table) if pd.notna(county[trait])]
+    return html.Div([
+        html.H5(f"Trees in {county['county']} County", style={
+            "marginBottom": "15px",
+            "backgroundColor": "#72b7eb",
+            "color": "white",
+            "padding": "10px",
+            "borderRadius": "5px"
+        }),
+        html.P(f"Found {county['trees']} trees at {county['sites']} sites in this county",
+               style={"fontWeight": "bold", "marginBottom": "15px"}),
+        dash_table.DataTable(
+            columns=[{"name": "Statistic", "id": "Statistic"}, {"name": "Value", "id": "Value"}],
+            data=rows,
+            style_cell={'textAlign': 'left', 'padding': '8px'},
+            style_header={'backgroundColor': '#f8f9fa', 'fontWeight': 'bold'},
+        ),
+        html.Br(),
+        dash_table.DataTable(
+            columns=[{"name": "Site", "id": "locality_full_name"}, {"name": "Trees", "id": "trees"}],
+            data=sites[['locality_full_name', 'trees']].to_dict('records'),
+            style_cell={'textAlign': 'left', 'padding': '8px'},
+            style_header={'backgroundColor': '#f8f9fa', 'fontWeight': 'bold'},
+            page_size=10,
+        ),
+    ])
 
 # Display information about the clicked tree site
 @callback(
@@ -144,16 +264,15 @@ def update_map_and_click_data(reset_clicks, clickData):
 def display_click_data(clickData):
     if clickData and 'points' in clickData and len(clickData['points']) > 0:
         try:
+            # A click on a county rather than a site
+            if 'location' in clickData['points'][0]:
+                return county_details(clickData['points'][0]['location'])
+
             # Get the locality name from click data
             locality_name = clickData['points'][0]['text']
             
-            # get column names from the table
-            columns = fetch_data_from_sql_pub(f"SELECT TOP 1 * FROM dbo.[{map_table}]").columns.tolist()
-            columns.remove('Accession')
-            columns_string = ', '.join(columns)
-
-            # Fetch all data for this location
-            df = fetch_data_from_sql_pub(f"SELECT {columns_string} FROM dbo.[{map_table}] WHERE locality_full_name = '{locality_name}'")
+            # Trees at this location, from the per-site partitions of the map table
+            df = site_index.get_trees(locality_name, map_table)
 
             if df.empty:
                 return html.Div([
@@ -1,24 +1,24 @@
 from dash import dcc, html, Input, Output, State, callback
 import dash
 import plotly.graph_objects as go
-import plotly.express as px
 import pandas as pd
 import numpy as np
-from scipy import stats
-from database import fetch_data_from_sql
-from sklearn.decomposition import PCA
-from sklearn.preprocessing import StandardScaler
 import dash_bootstrap_components as dbc
-from dotenv import load_dotenv
+import config
 import os
-from cache_config import cache
+import time
+import dataset_store
+from sources import open_source
 
 # Load environment variables
-load_dotenv(override=True)
+config.load()
 
 # Table Options
 table_options = os.getenv("TABLE_OPTIONS").split(",")
 
+# Tables with more rows than this are streamed through PCA in chunks
+STATS_STREAM_ROWS = int(os.getenv("STATS_STREAM_ROWS", "200000"))
+
 
 # Statistical test options
 stat_test_options = [
@@ -221,18 +221,21 @@ def show_test_container(selected_test):
     
     return {"display": "block"}, lr_style, pca_style, summary_style, empty_output, empty_output, empty_output
 
-# Function to get numeric columns from a table
-def get_numeric_columns(table_name):
-    try:
-        # Get a sample of data to determine column types
-        df = fetch_data_from_sql(f"SELECT TOP 100 * FROM [dbo].[{table_name}]")
-        
-        # Filter to only numeric columns
-        numeric_cols = df.select_dtypes(include=['number']).columns.tolist()
-        return numeric_cols
-    except Exception as e:
-        print(f"Error getting numeric columns: {e}")
-        return []
+# Message shown when the joined dataset a test needs can no longer be loaded
+def missing_dataset(key):
+    status = dataset_store.status(key)
+    if status["state"] == "evicted":
+        removed = time.strftime("%Y-%m-%d %H:%M", time.localtime(status["at"])) if status.get("at") else "earlier"
+        return html.Div([
+            html.H5("Dataset Evicted", style={"color": "red"}),
+            html.P(f"The joined dataset was removed at {removed} because {status['reason']}. "
+                   "Re-run the join on the Dataset tab to analyze it again.")
+        ])
+    return html.Div([
+        html.H5("Dataset Not Found", style={"color": "red"}),
+        html.P("The joined dataset is not available on this server, for example after a restart. "
+               "Re-run the join on the Dataset tab to analyze it again.")
+    ])
 
 # Callback to populate dropdowns with numeric columns
 @callback(
@@ -249,21 +252,17 @@ def update_variable_options(selected_table, joined_data):
         return empty_options, empty_options, empty_options, empty_options
     
     try:
-        if selected_table == "__joined__" and joined_data:
-            df = pd.DataFrame(cache.get(joined_data))
-        else:
-            df = fetch_data_from_sql(f"SELECT TOP 100 * FROM [dbo].[{selected_table}]")
-
-        if df is None or df.empty:
-            return empty_options, empty_options, empty_options, empty_options
-    
-        numeric_cols = df.select_dtypes(include=["number"]).columns.tolist()
+        # From the stored schema or the catalog; no data is loaded
+        source = open_source(selected_table, joined_data)
+        numeric_cols = source.numeric_columns() if source is not None else None
+        if not numeric_cols:
+            return [], [], [], []
         options = [{"label": col, "value": col} for col in numeric_cols]
         
         return options, options, options, options
     except Exception as e:
         print(f"Error fetching variables: {e}")
-        return [], []
+        return [], [], [], []
 
 # Linear Regression Callback
 @callback(
@@ -281,19 +280,11 @@ def generate_linear_regression(n_clicks, selected_table, x_var, y_var, joined_da
         return html.Div()
     
     try:
-        # If join, use cached data
-        if use_joined and joined_data:
-            cached_df = pd.DataFrame(cache.get(joined_data))
-            if cached_df is None:
-                return html.Div([
-                    html.H5("Cache Miss", style={"color": "red"}),
-                    html.P("Cached dataset not found. Please re-run the join or reload data.")
-                ])
-            df = cached_df[[x_var, y_var]].dropna()
-        else:
-            # Fetch the data
-            query = f"SELECT [{x_var}], [{y_var}] FROM [dbo].[{selected_table}] WHERE [{x_var}] IS NOT NULL AND [{y_var}] IS NOT NULL"
-            df = fetch_data_from_sql(query)
+        # Only the two columns, without rows missing either
+        source = open_source(selected_table, joined_data, use_joined)
+        if source is None:
+            return missing_dataset(joined_data)
+        df = source.load([x_var, y_var])
         
         # Check if we have enough data
         if df is None or df.empty:
@@ -306,6 +297,9 @@ def generate_linear_regression(n_clicks, selected_table, x_var, y_var, joined_da
         x = df[x_var].values
         y = df[y_var].values
         
+        # scipy, scikit-learn and plotly express are imported on first use to keep startup fast
+        from scipy import stats
+
         slope, intercept, r_value, p_value, std_err = stats.linregress(x, y)
         
         # Generate prediction line
@@ -415,6 +409,43 @@ def generate_linear_regression(n_clicks, selected_table, x_var, y_var, joined_da
             html.P(f"An error occurred: {str(e)}")
         ])
     
+# PCA over standardized columns in two streamed passes; chunks() yields the rows again on each call
+def streaming_pca(chunks, n_components):
+    # Pass 1: column sums and cross products, shifted by the first chunk's
+    # mean to keep the variance computation numerically stable
+    count, shift, sums, cross = 0, None, None, None
+    for chunk in chunks():
+        x = chunk.dropna().to_numpy(dtype=np.float64)
+        if len(x) == 0:
+            continue
+        if shift is None:
+            shift = x.mean(axis=0)
+            sums = np.zeros(x.shape[1])
+            cross = np.zeros((x.shape[1], x.shape[1]))
+        x = x - shift
+        count += len(x)
+        sums += x.sum(axis=0)
+        cross += x.T @ x
+
+    if count < 3:
+        return None
+
+    mean = shift + sums / count
+    cov = cross / count - np.outer(sums / count, sums / count)
+    std = np.sqrt(np.clip(np.diag(cov), 0, None))
+    std[std == 0] = 1.0  # StandardScaler leaves constant columns unscaled
+
+    # Eigen-decomposition of the correlation matrix matches StandardScaler + PCA
+    eigvals, eigvecs = np.linalg.eigh(cov / np.outer(std, std))
+    order = np.argsort(eigvals)[::-1]
+    components = eigvecs[:, order[:n_components]].T
+    explained_ratio = eigvals[order[:n_components]] / eigvals.sum()
+
+    # Pass 2: project each chunk onto the components
+    scores = [((chunk.dropna().to_numpy(dtype=np.float64) - mean) / std) @ components.T
+              for chunk in chunks()]
+    return np.vstack(scores), explained_ratio, components
+
 # PCA Callback
 @callback(
     Output("pca-output", "children", allow_duplicate=True),
@@ -431,41 +462,47 @@ def generate_pca(n_clicks, selected_table, variables, dimensions, joined_data, u
         return html.Div()
     
     try:
-        # Fetch the data
-        # If join, use cached data
-        if use_joined and joined_data:
-            cached_df = pd.DataFrame(cache.get(joined_data))
-            if cached_df is None:
-                return html.Div([
-                    html.H5("Cache Miss", style={"color": "red"}),
-                    html.P("Cached dataset not found. Please re-run the join or reload data.")
-                ])
-            df = cached_df
-        else:
-            columns = ", ".join([f"[{var}]" for var in variables])
-            query = f"SELECT {columns} FROM [dbo].[{selected_table}]"
-            df = fetch_data_from_sql(query)
+        # Determine number of components
+        n_components = min(3, len(variables))
         
-        # Drop rows with NaN values
-        df = df.dropna()
+        source = open_source(selected_table, joined_data, use_joined)
+        if source is None:
+            return missing_dataset(joined_data)
+
+        # Large tables are streamed instead of held in memory
+        stream = source.num_rows > STATS_STREAM_ROWS
+        if stream:
+            streamed = streaming_pca(lambda: source.chunks(variables), n_components)
+            enough_data = streamed is not None
+        else:
+            # Rows with missing values are left out by the source
+            df = source.load(variables)
+            enough_data = df is not None and len(df) >= 3
         
         # Check if we have enough data
-        if len(df) < 3:
+        if not enough_data:
             return html.Div([
                 html.H5("Insufficient Data", style={"color": "red"}),
                 html.P("Not enough valid data points for PCA analysis.")
             ])
         
-        # Scale the data
-        scaler = StandardScaler()
-        scaled_data = scaler.fit_transform(df)
-        
-        # Determine number of components
-        n_components = min(3, len(variables))
-        
-        # Perform PCA
-        pca = PCA(n_components=n_components)
-        pca_result = pca.fit_transform(scaled_data)
+        import plotly.express as px
+
+        if stream:
+            pca_result, explained_ratio, loadings = streamed
+        else:
+            from sklearn.decomposition import PCA
+            from sklearn.preprocessing import StandardScaler
+
+            # Scale the data
+            scaler = StandardScaler()
+            scaled_data = scaler.fit_transform(df)
+            
+            # Perform PCA
+            pca = PCA(n_components=n_components)
+            pca_result = pca.fit_transform(scaled_data)
+            explained_ratio = pca.explained_variance_ratio_
+            loadings = pca.components_
         
         # Create a DataFrame with PCA results
         pca_df = pd.DataFrame(
@@ -474,7 +511,7 @@ def generate_pca(n_clicks, selected_table, variables, dimensions, joined_data, u
         )
         
         # Calculate explained variance
-        explained_variance = pca.explained_variance_ratio_ * 100
+        explained_variance = explained_ratio * 100
         
         # Create the plot
         if dimensions == '3d' and n_components >= 3:
@@ -511,7 +548,6 @@ def generate_pca(n_clicks, selected_table, variables, dimensions, joined_data, u
         )
         
         # Create loading plot and variance table
-        loadings = pca.components_
         loading_df = pd.DataFrame(loadings.T, columns=[f'PC{i+1}' for i in range(n_components)], index=variables)
         
         # Create variance explanation table
@@ -586,26 +622,18 @@ def generate_summary_statistics(n_clicks, selected_table, variable, joined_data,
         return html.Div()
     
     try:
-        if use_joined and joined_data:
-            cached_df = pd.DataFrame(cache.get(joined_data))
-            if cached_df is None:
-                return html.Div([
-                    html.H5("Cache Miss", style={"color": "red"}),
-                    html.P("Cached dataset not found. Please re-run the join or reload data.")
-                ])
-            df = cached_df
-            if variable not in df.columns:
-                return html.Div([
-                    html.H5("Column Not Found", style={"color": "red"}),
-                    html.P(f"The variable '{variable}' is not in the joined dataset.")
-                ])
-        else:
-            # Fetch the data
-            query = f"SELECT [{variable}] FROM [dbo].[{selected_table}] WHERE [{variable}] IS NOT NULL"
-            df = fetch_data_from_sql(query)
+        source = open_source(selected_table, joined_data, use_joined)
+        if source is None:
+            return missing_dataset(joined_data)
+        if variable not in source.columns():
+            return html.Div([
+                html.H5("Column Not Found", style={"color": "red"}),
+                html.P(f"The variable '{variable}' is not in the selected dataset.")
+            ])
+        df = source.load([variable])
             
         # Check if we have enough data
-        if len(df) < 1:
+        if df is None or len(df) < 1:
             return html.Div([
                 html.H5("Insufficient Data", style={"color": "red"}),
                 html.P("No valid data points for summary statistics.")
@@ -5,31 +5,16 @@ import dash
 import pandas as pd
 import io
 import base64
-from database import fetch_data_from_sql
-from dotenv import load_dotenv
+import catalog
+import config
 import os
-import sqlalchemy
-from sqlalchemy import create_engine
 
 # Load environment variables
-load_dotenv(override=True)
+config.load()
 
 # Table Options
 table_options = os.getenv("TABLE_OPTIONS").split(",")
 
-# Database connection settings from environment variables
-driver = "ODBC Driver 18 for SQL Server"
-server = os.getenv("DB_SERVER")
-database = os.getenv("DB_DATABASE")
-username = os.getenv("DB_USERNAME_UP")
-password = os.getenv("DB_PASSWORD_UP")
-
-# SQL Alchemy connection string
-connection_string = (
-    f"mssql+pyodbc://{username}:{password}@{server}/{database}"
-    f"?driver={driver}&Encrypt=yes&TrustServerCertificate=yes"
-)
-
 upload_layout = dcc.Tab(
     [
         # Store the tab's active state
@@ -149,12 +134,8 @@ def display_table_structure(selected_table):
         return []
     
     try:
-        # Get a sample row to determine columns and types
-        sample_df = fetch_data_from_sql(f"SELECT TOP 1 * FROM [dbo].[{selected_table}]")
-        
-        # Get column details
-        columns = sample_df.columns.tolist()
-        dtypes = sample_df.dtypes.to_dict()
+        # Get column details from the catalog
+        columns = catalog.get_column_info(selected_table)
         
         # Create table structure information
         structure_info = [
@@ -162,10 +143,12 @@ def display_table_structure(selected_table):
             html.P(f"This table has {len(columns)} columns:", style={"marginBottom": "5px"}),
             html.Div([
                 dash_table.DataTable(
-                    data=[{"Column": col, "Data Type": str(dtypes[col])} for col in columns],
+                    data=[{"Column": col["name"], "Data Type": col["sql_type"],
+                           "Nullable": "Yes" if col["nullable"] else "No"} for col in columns],
                     columns=[
                         {"name": "Column", "id": "Column"},
-                        {"name": "Data Type", "id": "Data Type"}
+                        {"name": "Data Type", "id": "Data Type"},
+                        {"name": "Nullable", "id": "Nullable"}
                     ],
                     style_table={'overflowX': 'auto'},
                     style_cell={
@@ -215,9 +198,8 @@ def validate_and_preview_csv(contents, selected_table, filename):
         return [], [], True
     
     try:
-        # Get table structure from database
-        sample_df = fetch_data_from_sql(f"SELECT TOP 1 * FROM [dbo].[{selected_table}]")
-        table_columns = sample_df.columns.tolist()
+        # Get table structure from the catalog
+        table_columns = catalog.get_columns(selected_table)
         
         # Parse the uploaded CSV
         df, error = parse_csv(contents)
@@ -287,6 +269,8 @@ def get_preview_table(df):
         )
     ]
 """
+# Disabled. Re-enabling it also needs get_engine (from database), row_counts,
+# data_versions and mirror imported above.
 # Callback to handle database upload
 @callback(
     Output("upload-result", "children"),
@@ -309,20 +293,24 @@ def upload_to_database(n_clicks, contents, selected_table, filename):
             ])
         
         # Get table structure
-        sample_df = fetch_data_from_sql(f"SELECT TOP 1 * FROM [dbo].[{selected_table}]")
-        table_columns = sample_df.columns.tolist()
+        table_columns = catalog.get_columns(selected_table)
         
         # Rename CSV columns to match database columns
         if len(df.columns) == len(table_columns):
             df.columns = table_columns
         
-        # Create database connection
-        engine = create_engine(connection_string, fast_executemany=True)
+        # Use the pooled upload engine
+        engine = get_engine("up")
         
         # Upload data to the database
         with engine.begin() as connection:
             df.to_sql(selected_table, connection, if_exists='append', index=False, schema='dbo')
         
+        # Cached results and the row count no longer match the table
+        data_versions.bump(selected_table)
+        row_counts.invalidate(selected_table)
+        mirror.append_rows(selected_table, df)
+        
         return html.Div([
             html.H5("Upload Successful", style={"color": "green"}),
             html.P(f"Successfully uploaded {len(df)} rows to table '{selected_table}'.")
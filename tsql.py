@@ -0,0 +1,80 @@
+import re
+
+# Translates the T-SQL the tabs emit into another engine's dialect. Only the
+# constructs the dashboard uses are covered: bracket quoting, [dbo] schema
+# prefixes, TOP, OFFSET/FETCH, ORDER BY (SELECT NULL), COUNT_BIG, TRY_CAST and
+# :name bind parameters.
+
+DIALECTS = ("duckdb", "sqlite")
+
+_LITERAL = re.compile(r"'(?:[^']|'')*'|\[(?:[^\]]|\]\])*\]|\"(?:[^\"]|\"\")*\"")
+_PLACEHOLDER = re.compile(r"\x00(\d+)\x00")
+_BIND = re.compile(r"(?<![:\w\\$]):(\w+)")
+_DBO_PREFIX = re.compile(r"\x00(\d+)\x00\s*\.\s*(?=\x00)")
+_TOP = re.compile(r"^(\s*SELECT\s+(?:DISTINCT\s+)?)TOP\s*(?:\(\s*([^()]+?)\s*\)|(\d+))\s*", re.IGNORECASE)
+_OFFSET_FETCH = re.compile(
+    r"OFFSET\s+(\S+)\s+ROWS?\s+FETCH\s+(?:NEXT|FIRST)\s+(\S+)\s+ROWS?\s+ONLY", re.IGNORECASE)
+_ORDER_BY_NULL = re.compile(r"ORDER\s+BY\s+\(\s*SELECT\s+NULL\s*\)", re.IGNORECASE)
+_COUNT_BIG = re.compile(r"\bCOUNT_BIG\s*\(", re.IGNORECASE)
+_TRY_CAST = re.compile(r"\bTRY_CAST\s*\(", re.IGNORECASE)
+
+
+def quote(name):
+    """Standard double-quoted identifier."""
+    return '"' + name.replace('"', '""') + '"'
+
+
+def translate(sql, dialect="duckdb", schema=None, keep_binds=False):
+    """Rewrite a T-SQL query for dialect.
+
+    [dbo].[table] becomes "table", or "schema"."table" when schema is given.
+    With keep_binds, :name parameters and \\: escapes are left for SQLAlchemy
+    to compile instead of being rewritten to the driver's own style.
+    """
+    if dialect not in DIALECTS:
+        raise ValueError(f"Unsupported dialect: {dialect}")
+
+    # Set string literals and quoted identifiers aside so rewrites cannot touch them
+    literals = []
+
+    def stash(match):
+        literals.append(match.group(0))
+        return f"\x00{len(literals) - 1}\x00"
+
+    skeleton = _LITERAL.sub(stash, sql.replace("\\:", "\x01"))
+
+    def schema_prefix(match):
+        if literals[int(match.group(1))].lower() != "[dbo]":
+            return match.group(0)
+        return quote(schema) + "." if schema else ""
+
+    skeleton = _DBO_PREFIX.sub(schema_prefix, skeleton)
+    skeleton = _COUNT_BIG.sub("COUNT(", skeleton)
+    if dialect == "sqlite":
+        # SQLite's CAST never raises; text that does not parse becomes 0, not NULL
+        skeleton = _TRY_CAST.sub("CAST(", skeleton)
+    skeleton = _ORDER_BY_NULL.sub("", skeleton)
+    skeleton = _OFFSET_FETCH.sub(r"LIMIT \2 OFFSET \1", skeleton)
+
+    top = _TOP.search(skeleton)
+    if top:
+        limit = top.group(2) or top.group(3)
+        skeleton = skeleton[:top.start()] + top.group(1) + skeleton[top.end():]
+        skeleton = skeleton.rstrip().rstrip(";") + f"\nLIMIT {limit}"
+
+    if not keep_binds:
+        skeleton = _bind_parameters(skeleton, dialect)
+
+    def restore(match):
+        literal = literals[int(match.group(1))]
+        if literal.startswith("["):
+            return quote(literal[1:-1].replace("]]", "]"))
+        return literal
+
+    return _PLACEHOLDER.sub(restore, skeleton).replace("\x01", "\\:" if keep_binds else ":")
+
+
+def _bind_parameters(sql, dialect):
+    if dialect == "duckdb":
+        return _BIND.sub(r"$\1", sql)
+    return sql